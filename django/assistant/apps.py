@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AssistantConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'assistant'
+
+    def ready(self):
+        from assistant import versions, tree_cache, search_backends, sync
+        versions.connect_receivers()
+        sync.connect_receivers()
+        tree_cache.connect_receivers()
+        search_backends.connect_receivers()
@@ -0,0 +1,127 @@
+"""Per-file deltas between reduced source trees of two revisions.
+
+Files are compared by the hashes in revision snapshots, so contents are loaded only
+for added and modified files. Deltas of a pair of blobs never change and are cached.
+
+Two formats are supported:
+- unified: a unified diff text per file
+- ranges: a list of {"start", "end", "lines"} edits, each replacing lines
+  start:end (0-based, end exclusive) of the base file with lines
+"""
+import difflib
+from django.core.cache import cache
+from assistant.models import FileBlob, Revision
+
+
+DIFF_FORMATS = ("unified", "ranges")
+
+
+def diff_revisions(base, revision, fmt="unified"):
+    """Changes that turn the tree of base into the tree of revision, base may be None"""
+    base_refs = base.get_snapshot() if base is not None else []
+    return diff_snapshots(base_refs, revision.get_snapshot(), fmt)
+
+
+def prefetch_changes(revisions, fmt="unified"):
+    """Diffs many revisions against their previous revisions, contents of all changed
+    files are loaded with a single query. Changes are kept in revision.changes"""
+    revisions = Revision.prefetch_snapshots(revisions)
+    comparisons = []
+    for revision in revisions:
+        base = revision.get_previous()
+        base_refs = base.get_snapshot() if base is not None else []
+        comparisons.append(compare_snapshots(base_refs, revision.get_snapshot()))
+
+    contents = load_contents(changed for changed, removed in comparisons)
+    for revision, (changed, removed) in zip(revisions, comparisons):
+        revision.changes = make_changes(changed, removed, contents, fmt)
+    return revisions
+
+
+def diff_snapshots(base_refs, refs, fmt="unified"):
+    changed, removed = compare_snapshots(base_refs, refs)
+    return make_changes(changed, removed, load_contents([changed]), fmt)
+
+
+def compare_snapshots(base_refs, refs):
+    """(path, old ref, new ref) of added and modified files and paths of removed files"""
+    old_files = {ref["file_path"]: ref for ref in base_refs if 'snippet' not in ref}
+    new_files = {ref["file_path"]: ref for ref in refs if 'snippet' not in ref}
+
+    changed = []
+    for path, ref in new_files.items():
+        old_ref = old_files.get(path)
+        if old_ref is None or get_key(old_ref) != get_key(ref):
+            changed.append((path, old_ref, ref))
+
+    removed = [path for path in old_files if path not in new_files]
+    return changed, removed
+
+
+def load_contents(changed_lists):
+    """Maps hashes of blobs referenced by lists of changed files to their contents"""
+    hashes = {r["sha256"] for changed in changed_lists for _, old_ref, ref in changed
+              for r in (old_ref, ref) if r and "sha256" in r}
+    if not hashes:
+        return {}
+    return dict(FileBlob.objects.filter(sha256__in=hashes).values_list("sha256", "content"))
+
+
+def make_changes(changed, removed, contents, fmt):
+    def get_content(ref):
+        if ref is None:
+            return ""
+        if "sha256" in ref:
+            return contents[ref["sha256"]]
+        return str(ref.get("content", ""))
+
+    changes = []
+    for path, old_ref, ref in changed:
+        delta = get_delta(path, old_ref, ref, get_content, fmt)
+        status = "added" if old_ref is None else "modified"
+        changes.append(dict(file_path=path, status=status, delta=delta))
+
+    for path in removed:
+        changes.append(dict(file_path=path, status="removed", delta=None))
+    return changes
+
+
+def get_key(ref):
+    if ref is None:
+        return None
+    return ref.get("sha256") or str(ref.get("content", ""))
+
+
+def get_delta(path, old_ref, ref, get_content, fmt):
+    """Delta between two versions of a file, cached when both are stored as blobs"""
+    old_hash = old_ref.get("sha256") if old_ref is not None else ""
+    cache_key = None
+    if old_hash is not None and "sha256" in ref:
+        cache_key = f"file-delta:{fmt}:{path}:{old_hash}:{ref['sha256']}"
+        delta = cache.get(cache_key)
+        if delta is not None:
+            return delta
+
+    if fmt == "ranges":
+        delta = make_ranges(get_content(old_ref), get_content(ref))
+    else:
+        delta = make_unified_diff(path, get_content(old_ref), get_content(ref))
+
+    if cache_key is not None:
+        cache.set(cache_key, delta, timeout=None)
+    return delta
+
+
+def make_unified_diff(path, old_content, new_content):
+    return "".join(difflib.unified_diff(
+        old_content.splitlines(keepends=True), new_content.splitlines(keepends=True),
+        fromfile=f"a/{path}", tofile=f"b/{path}"
+    ))
+
+
+def make_ranges(old_content, new_content):
+    old_lines = old_content.splitlines()
+    new_lines = new_content.splitlines()
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [dict(start=i1, end=i2, lines=new_lines[j1:j2])
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
@@ -1,21 +1,69 @@
 from django.core.management.base import BaseCommand, CommandError
-from assistant.models import MultimediaMessage
+from django.utils import timezone
+from assistant.models import Chat, MultimediaMessage
+from assistant import versions
+
+
+def find_missing_chats(message_rows):
+    """Maps chat ids to ids of messages without a chat whose nearest ancestor with a chat
+    belongs to that chat. message_rows are (id, parent_id, chat_id) tuples."""
+    parents = {}
+    chats = {}
+    for message_id, parent_id, chat_id in message_rows:
+        parents[message_id] = parent_id
+        if chat_id is not None:
+            chats[message_id] = chat_id
+
+    missing = {}
+    for message_id in parents:
+        if message_id in chats:
+            continue
+
+        path = []
+        current = message_id
+        while current is not None and current not in chats:
+            path.append(current)
+            current = parents.get(current)
+
+        chat_id = chats.get(current)
+        for path_id in path:
+            chats[path_id] = chat_id
+            if chat_id is not None:
+                missing.setdefault(chat_id, []).append(path_id)
+    return missing
 
 
 class Command(BaseCommand):
-    help = "Adds a chat relation to every non-orphan message object"
+    help = ("Adds a chat relation to every non-orphan message object. Messages are updated in "
+            "batches, an interrupted run can be resumed by running the command again")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
 
     def handle(self, *args, **options):
-        chatless = MultimediaMessage.objects.filter(chat__isnull=True)
-        count = chatless.count()
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("Batch size must be positive")
 
-        for i, message in enumerate(chatless):
-            message.add_chat()
-            message.save()
-            if i % 50 == 0:
+        rows = MultimediaMessage.objects.values_list('id', 'parent_id', 'chat_id').iterator()
+        missing = find_missing_chats(rows)
+        count = sum(len(ids) for ids in missing.values())
+
+        processed = 0
+        for chat_id, ids in missing.items():
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                MultimediaMessage.objects.filter(pk__in=batch, chat__isnull=True).update(
+                    chat_id=chat_id, updated=timezone.now()
+                )
+                processed += len(batch)
                 self.stdout.write(
-                    self.style.SUCCESS('Processed "%s" out of "%s" messages' % (i, count))
+                    self.style.SUCCESS('Processed "%s" out of "%s" messages' % (processed, count))
                 )
+            # active branches are recomputed on the next access
+            Chat.objects.filter(pk=chat_id).update(active_path=None)
+            # bulk updates skip the post_save receivers, so cached copies of the chat expire here
+            versions.bump_versions([chat_id])
 
         self.stdout.write(
             self.style.SUCCESS("Operation was successfully completed!")
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from assistant.models import Chat, MultimediaMessage, Revision, get_text_documents
+from assistant.search_backends import get_search_backend
+
+
+def iter_batches(queryset, batch_size):
+    """Yields lists of objects (or rows) of the queryset ordered by primary key"""
+    last_pk = None
+    while True:
+        batch_qs = queryset.order_by('pk')
+        if last_pk is not None:
+            batch_qs = batch_qs.filter(pk__gt=last_pk)
+        batch = list(batch_qs[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+        last_pk = last[0] if isinstance(last, tuple) else last.pk
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the full-text search index of chats, their message texts and revisions. "
+            "Objects are indexed in batches")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("Batch size must be positive")
+
+        backend = get_search_backend()
+        backend.clear()
+
+        chats = Chat.objects.all()
+        self.index_batches("chats", chats, batch_size, backend,
+                           lambda batch: [chat.get_search_document() for chat in batch])
+
+        messages = MultimediaMessage.objects.filter(chat__isnull=False).values_list(
+            'id', 'content_id', 'chat_id'
+        )
+        self.index_batches("messages", messages, batch_size, backend,
+                           lambda batch: get_text_documents({row[1]: row[2] for row in batch}))
+
+        revisions = Revision.objects.filter(message__chat__isnull=False).select_related('message')
+        self.index_batches("revisions", revisions, batch_size, backend,
+                           lambda batch: [rev.get_search_document()
+                                          for rev in Revision.prefetch_src_trees(batch)])
+
+        if hasattr(backend, "optimize"):
+            backend.optimize()
+
+        self.stdout.write(
+            self.style.SUCCESS("Operation was successfully completed!")
+        )
+
+    def index_batches(self, name, queryset, batch_size, backend, get_documents):
+        count = queryset.count()
+        processed = 0
+        for batch in iter_batches(queryset, batch_size):
+            backend.index(get_documents(batch))
+            processed += len(batch)
+            self.stdout.write(
+                self.style.SUCCESS('Indexed "%s" out of "%s" %s' % (processed, count, name))
+            )
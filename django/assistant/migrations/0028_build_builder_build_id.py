@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0027_modality_oai_item_alter_modality_modality_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='build',
+            name='builder_build_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0028_build_builder_build_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='build',
+            name='server_url',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='build',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='build_race_size',
+            field=models.IntegerField(default=2),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='build_strategy',
+            field=models.CharField(choices=[('sequential', 'Try build servers one after another'), ('race', 'Build on several servers at once, first success wins'), ('least_loaded', 'Build on the server with the shortest queue')], default='sequential', max_length=20),
+        ),
+    ]
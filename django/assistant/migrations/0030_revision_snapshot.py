@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0029_build_server_url_build_timings_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revision',
+            name='snapshot',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
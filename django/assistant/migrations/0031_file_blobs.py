@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:55
+
+import hashlib
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def split_entries(entries):
+    refs = []
+    blobs = {}
+    for entry in entries:
+        ref = dict(entry)
+        content = ref.pop("content", None)
+        if isinstance(content, str):
+            sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            blobs[sha256] = content
+            ref["sha256"] = sha256
+        elif content is not None:
+            ref["content"] = content
+        refs.append(ref)
+    return refs, blobs
+
+
+def move_contents_to_blobs(apps, schema_editor):
+    Revision = apps.get_model("assistant", "Revision")
+    FileBlob = apps.get_model("assistant", "FileBlob")
+
+    last_id = 0
+    while True:
+        batch = list(Revision.objects.filter(pk__gt=last_id).order_by("pk")[:BATCH_SIZE])
+        if not batch:
+            break
+
+        blobs = {}
+        for revision in batch:
+            revision.files, revision_blobs = split_entries(revision.src_tree or [])
+            revision.snapshot = None
+            blobs.update(revision_blobs)
+
+        FileBlob.objects.bulk_create(
+            [FileBlob(sha256=sha256, content=content) for sha256, content in blobs.items()],
+            ignore_conflicts=True
+        )
+        Revision.objects.bulk_update(batch, ["files", "snapshot"])
+        last_id = batch[-1].pk
+
+
+def restore_contents(apps, schema_editor):
+    Revision = apps.get_model("assistant", "Revision")
+    FileBlob = apps.get_model("assistant", "FileBlob")
+
+    last_id = 0
+    while True:
+        batch = list(Revision.objects.filter(pk__gt=last_id).order_by("pk")[:BATCH_SIZE])
+        if not batch:
+            break
+
+        hashes = {ref["sha256"] for revision in batch for ref in revision.files if "sha256" in ref}
+        contents = dict(FileBlob.objects.filter(sha256__in=hashes).values_list("sha256", "content"))
+        for revision in batch:
+            revision.src_tree = []
+            for ref in revision.files:
+                entry = {key: value for key, value in ref.items() if key != "sha256"}
+                if "sha256" in ref:
+                    entry["content"] = contents[ref["sha256"]]
+                revision.src_tree.append(entry)
+            revision.snapshot = None
+
+        Revision.objects.bulk_update(batch, ["src_tree", "snapshot"])
+        last_id = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0030_revision_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='revision',
+            name='files',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='revision',
+            name='src_tree',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_contents_to_blobs, restore_contents),
+        migrations.RemoveField(
+            model_name='revision',
+            name='src_tree',
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:02
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+BATCH_SIZE = 1000
+
+
+def assign_chats(apps, schema_editor):
+    """Sets chat of every message to the chat of its nearest ancestor that has one"""
+    MultimediaMessage = apps.get_model("assistant", "MultimediaMessage")
+
+    parents = {}
+    chats = {}
+    for message_id, parent_id, chat_id in MultimediaMessage.objects.values_list('id', 'parent_id', 'chat_id'):
+        parents[message_id] = parent_id
+        if chat_id is not None:
+            chats[message_id] = chat_id
+
+    missing = {}
+    for message_id in parents:
+        path = []
+        current = message_id
+        while current is not None and current not in chats:
+            path.append(current)
+            current = parents.get(current)
+
+        chat_id = chats.get(current)
+        for path_id in path:
+            chats[path_id] = chat_id
+            if chat_id is not None:
+                missing.setdefault(chat_id, []).append(path_id)
+
+    for chat_id, ids in missing.items():
+        for i in range(0, len(ids), BATCH_SIZE):
+            MultimediaMessage.objects.filter(pk__in=ids[i:i + BATCH_SIZE]).update(
+                chat_id=chat_id, updated=timezone.now()
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0032_updated_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_chats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='multimediamessage',
+            index=models.Index(fields=['chat', 'parent'], name='message_chat_parent_idx'),
+        ),
+    ]
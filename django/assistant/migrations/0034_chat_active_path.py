@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0033_message_chat_parent_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='active_path',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
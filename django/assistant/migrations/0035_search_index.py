@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+# existing chats are indexed by "manage.py rebuild_search_index"
+CREATE_INDEX = ("CREATE VIRTUAL TABLE IF NOT EXISTS assistant_search_index "
+                "USING fts5(chat_id UNINDEXED, title, body)")
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS assistant_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0034_chat_active_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0035_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['created', 'id'], name='chat_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generation',
+            index=models.Index(fields=['start_time', 'id'], name='generation_start_time_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0036_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0037_chat_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('deleted', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat_id', 'deleted'], name='deleted_object_chat_idx')],
+            },
+        ),
+    ]
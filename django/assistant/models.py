@@ -1,9 +1,12 @@
 import os
-from django.db import models
+import hashlib
+from collections import defaultdict
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Max
+from django.db.models import Max, Min, Count, Q
 from django.core.files.base import ContentFile
+from assistant import search_backends
 
 
 class Server(models.Model):
@@ -34,6 +37,11 @@ class Preset(models.Model):
 
 
 class Configuration(models.Model):
+    class BuildStrategy(models.TextChoices):
+        SEQUENTIAL = 'sequential', _('Try build servers one after another')
+        RACE = 'race', _('Build on several servers at once, first success wins')
+        LEAST_LOADED = 'least_loaded', _('Build on the server with the shortest queue')
+
     name = models.CharField(max_length=255, unique=True)
     llm_model = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
@@ -51,6 +59,11 @@ class Configuration(models.Model):
     autorun = models.BooleanField(default=False)
     max_iterations = models.IntegerField(default=1)
 
+    build_strategy = models.CharField(max_length=20, choices=BuildStrategy.choices,
+                                      default=BuildStrategy.SEQUENTIAL)
+    # max number of build servers used at once by the race strategy
+    build_race_size = models.IntegerField(default=2)
+
     def __str__(self):
         return self.name
 
@@ -92,11 +105,191 @@ class Monitor:
         return getattr(self.suite, self.operations_reverse_relation)
 
 
+class FileBlob(models.Model):
+    """Content of a source file, shared by all revisions containing the same file"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    content = models.TextField()
+
+
+def split_file_entries(entries):
+    """Replaces contents of source tree entries with sha256 hashes of their blobs.
+
+    Returns the file references and a dict mapping hashes to contents.
+    """
+    refs = []
+    blobs = {}
+    for entry in entries:
+        ref = dict(entry)
+        content = ref.pop("content", None)
+        if isinstance(content, str):
+            sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            blobs[sha256] = content
+            ref["sha256"] = sha256
+        elif content is not None:
+            ref["content"] = content
+        refs.append(ref)
+    return refs, blobs
+
+
+def resolve_file_entries(*ref_lists):
+    """Turns lists of file references back into source trees, fetching blobs in one query"""
+    hashes = {ref["sha256"] for refs in ref_lists for ref in refs if "sha256" in ref}
+    contents = dict(FileBlob.objects.filter(sha256__in=hashes).values_list("sha256", "content"))
+
+    def resolve(ref):
+        entry = {key: value for key, value in ref.items() if key != "sha256"}
+        if "sha256" in ref:
+            entry["content"] = contents[ref["sha256"]]
+        return entry
+
+    return [[resolve(ref) for ref in refs] for refs in ref_lists]
+
+
 class Revision(models.Model):
-    src_tree = models.JSONField()
+    # source tree entries with contents replaced by FileBlob hashes, see src_tree
+    files = models.JSONField(default=list)
     message = models.ForeignKey("MultimediaMessage", related_name="revisions",
                                 on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    # reduced source tree up to this revision as a list of file references
+    snapshot = models.JSONField(blank=True, null=True)
+
+    @property
+    def src_tree(self):
+        if getattr(self, "_src_tree", None) is None:
+            self._src_tree, = resolve_file_entries(self.files)
+        return self._src_tree
+
+    @src_tree.setter
+    def src_tree(self, entries):
+        self.files, self._new_blobs = split_file_entries(entries)
+        self._src_tree = list(entries)
+
+    @classmethod
+    def prefetch_src_trees(cls, revisions):
+        """Resolves source trees of many revisions with a single query"""
+        revisions = list(revisions)
+        for revision, src_tree in zip(revisions, resolve_file_entries(*[r.files for r in revisions])):
+            revision._src_tree = src_tree
+        return revisions
+
+    def save(self, **kwargs):
+        new_blobs = getattr(self, "_new_blobs", None)
+        if new_blobs:
+            FileBlob.objects.bulk_create(
+                [FileBlob(sha256=sha256, content=content) for sha256, content in new_blobs.items()],
+                ignore_conflicts=True
+            )
+            self._new_blobs = None
+        super().save(**kwargs)
+        self.clear_snapshots()
+        search_backends.get_search_backend().index([self.get_search_document()])
+
+    def delete(self, **kwargs):
+        result = super().delete(**kwargs)
+        self.clear_snapshots()
+        return result
+
+    def clear_snapshots(self):
+        """Drops snapshots built on top of this revision: its own one and those of revisions
+        of all replies below its message, they are rebuilt on demand"""
+        message_ids = []
+        level = [self.message_id]
+        while level:
+            message_ids.extend(level)
+            level = list(MultimediaMessage.objects.filter(parent_id__in=level).values_list('id', flat=True))
+
+        stale = Q(message_id__in=message_ids[1:])
+        if self.pk is not None:
+            stale |= Q(pk=self.pk)
+        Revision.objects.filter(stale).update(snapshot=None)
+        self.snapshot = None
+
+    def get_search_document(self):
+        entries = [entry for entry in self.src_tree if "deleted" not in entry]
+        paths = "\n".join(entry["file_path"] for entry in entries)
+        contents = "\n".join(str(entry.get("content", "")) for entry in entries)
+        return ("revision", self.pk, self.message.chat_id, paths, contents)
+
+    @classmethod
+    def prefetch_previous(cls, revisions):
+        """Finds previous revisions (see get_previous) of many revisions and of their
+        ancestors with a query per level of missing ancestors, one for a chat branch"""
+        revisions = list(revisions)
+        parents = {}
+        pending = {revision.message_id for revision in revisions}
+        while pending:
+            parents.update(dict.fromkeys(pending))
+            parents.update(MultimediaMessage.objects.filter(pk__in=pending).values_list('id', 'parent_id'))
+            pending = {parent_id for parent_id in parents.values()
+                       if parent_id is not None and parent_id not in parents}
+
+        first_ids = dict(cls.objects.filter(message_id__in=parents).values('message_id').annotate(
+            first_id=Min('id')).values_list('message_id', 'first_id'))
+        known = {revision.pk: revision for revision in revisions}
+        known.update(cls.objects.in_bulk([pk for pk in first_ids.values() if pk not in known]))
+        firsts = {message_id: known[pk] for message_id, pk in first_ids.items()}
+
+        for revision in known.values():
+            parent_id = parents.get(revision.message_id)
+            while parent_id is not None and parent_id not in firsts:
+                parent_id = parents.get(parent_id)
+            revision._previous = firsts.get(parent_id)
+        return revisions
+
+    def get_previous(self):
+        """First revision of the nearest ancestor message that has revisions"""
+        if hasattr(self, "_previous"):
+            return self._previous
+
+        message = self.message.parent
+        while message is not None:
+            revision = message.revisions.order_by('pk').first()
+            if revision is not None:
+                return revision
+            message = message.parent
+
+    @classmethod
+    def prefetch_snapshots(cls, revisions):
+        """Builds missing snapshots of many revisions and saves them with a single query"""
+        revisions = cls.prefetch_previous(revisions)
+        built = [built for revision in revisions for built in revision.build_snapshot()]
+        cls.objects.bulk_update(built, ['snapshot'])
+        return revisions
+
+    def get_snapshot(self):
+        """Returns the snapshot, building missing ones from the nearest ancestor that has it"""
+        for revision in self.build_snapshot():
+            Revision.objects.filter(pk=revision.pk).update(snapshot=revision.snapshot)
+        return self.snapshot
+
+    def build_snapshot(self):
+        """Sets missing snapshots of the revision and its ancestors without saving them,
+        returns revisions that got one"""
+        chain = []
+        revision = self
+        while revision is not None and revision.snapshot is None:
+            chain.append(revision)
+            revision = revision.get_previous()
+
+        files = {ref["file_path"]: ref for ref in revision.snapshot} if revision is not None else {}
+        for revision in reversed(chain):
+            for ref in revision.files:
+                path = ref["file_path"]
+                if "deleted" in ref:
+                    files.pop(path, None)
+                else:
+                    files[path] = ref
+            revision.snapshot = list(files.values())
+        return chain
+
+    def get_source_tree(self):
+        """Reduced source tree of the revision, file contents are fetched in one query"""
+        refs = [ref for ref in self.get_snapshot() if 'snippet' not in ref]
+        src_tree, = resolve_file_entries(refs)
+        return src_tree
 
 
 class OperationSuite(models.Model):
@@ -118,12 +311,35 @@ class OperationSuite(models.Model):
     def interactions_monitor(self):
         return Monitor(self, "interactions")
 
+    operation_relations = ("builds", "lints", "tests")
+
     @property
     def complete(self):
-        return (self.builds_monitor.all_finished and 
-                self.lints_monitor.all_finished and 
-                self.tests_monitor.all_finished and 
-                self.interactions_monitor.all_finished)
+        summary = self.get_summary()
+        return all(summary[relation]["running"] == 0 for relation in self.operation_relations)
+
+    def get_summary(self):
+        """Number of running, successful and failed operations of every kind, computed in one query"""
+        aggregates = {}
+        for relation in self.operation_relations:
+            aggregates[f"{relation}_total"] = Count(relation, distinct=True)
+            aggregates[f"{relation}_running"] = Count(
+                relation, filter=Q(**{f"{relation}__finished": False}), distinct=True
+            )
+            aggregates[f"{relation}_successful"] = Count(
+                relation, filter=Q(**{f"{relation}__finished": True, f"{relation}__success": True}),
+                distinct=True
+            )
+
+        counts = OperationSuite.objects.filter(pk=self.pk).aggregate(**aggregates)
+        summary = {}
+        for relation in self.operation_relations:
+            total = counts[f"{relation}_total"]
+            running = counts[f"{relation}_running"]
+            successful = counts[f"{relation}_successful"]
+            summary[relation] = dict(total=total, running=running, successful=successful,
+                                     failed=total - running - successful)
+        return summary
 
 
 class Operation(models.Model):
@@ -143,6 +359,11 @@ class Build(Operation):
     screenshot = models.ImageField(upload_to='screenshots/', blank=True, null=True)
     url = models.URLField(blank=True, null=True)
 
+    # id of the build on the build server, its workspace can be reused by later builds
+    builder_build_id = models.CharField(max_length=64, blank=True, null=True)
+    server_url = models.CharField(max_length=255, blank=True, null=True)
+    timings = models.JSONField(blank=True, null=True)
+
     operation_suite = models.ForeignKey(OperationSuite, related_name="builds",
                                         blank=True, null=True, on_delete=models.CASCADE)
 
@@ -203,6 +424,21 @@ class Chat(models.Model):
     coding_mode = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
 
+    # ids of messages on the active branch (following child_index from the root),
+    # kept up to date by MultimediaMessage.save and delete
+    active_path = models.JSONField(blank=True, null=True)
+
+    # bumped on writes to the chat and its related objects, see assistant/versions.py
+    version = models.PositiveBigIntegerField(default=0)
+
+    update_only_fields = ("active_path", "version")
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the chat list, see KeysetPagination
+            models.Index(fields=['created', 'id'], name='chat_created_id_idx')
+        ]
+
     def get_system_message(self):
         default_coder_prompt = """You are a highly skilled web-developer with expertise in React.
 
@@ -229,44 +465,73 @@ You have access to React and standard web technologies.
 
         return msg
 
+    def save(self, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # these are only changed with update(), a stale copy must not overwrite them
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.update_only_fields]
+        super().save(**kwargs)
+        search_backends.get_search_backend().index([self.get_search_document()])
+
+    def get_search_document(self):
+        return ("chat", self.pk, self.pk, self.name, self.description or "")
+
+    def get_root_message(self):
+        return self.messages.filter(parent__isnull=True).order_by('pk').first()
+
     def get_message_ids(self):
-        root_msg = self.messages.first()
-        if not root_msg:
-            return []
+        if self.active_path is None:
+            self.update_active_path()
+        return self.active_path
+
+    def update_active_path(self):
+        """Recomputes the active branch from child indices of all messages of the chat"""
+        rows = self.messages.order_by('pk').values_list('id', 'parent_id', 'child_index')
+        replies = defaultdict(list)
+        child_indices = {}
+        roots = []
+        for message_id, parent_id, child_index in rows:
+            child_indices[message_id] = child_index
+            if parent_id is None:
+                roots.append(message_id)
+            else:
+                replies[parent_id].append(message_id)
 
-        msg = root_msg
-        result = [msg.id]
-        # todo: error handling
-        while msg.replies.exists():
-            msg = msg.replies.all()[msg.child_index]
-            result.append(msg.id)
-        return result
+        path = roots[:1]
+        while path and replies[path[-1]]:
+            children = replies[path[-1]]
+            child_index = child_indices[path[-1]]
+            if not 0 <= child_index < len(children):
+                break
+            path.append(children[child_index])
+
+        self.active_path = path
+        Chat.objects.filter(pk=self.pk).update(active_path=path)
+        return path
 
     def get_revisions(self):
         ids = self.get_message_ids()
         return Revision.objects.filter(message__id__in=ids)
 
     def get_last_text(self):
-        root = self.messages.first()
-        if not root:
+        ids = self.get_message_ids()
+        if not ids:
             return ""
-        
-        def get_text(msg):
-            modality = msg.content
-            if modality.modality_type == "text":
-                return modality.text
 
-            text_modality = modality.mixture.filter(modality_type="text").last()
-            if text_modality:
-                return text_modality.text
+        contents = dict(MultimediaMessage.objects.filter(pk__in=ids).values_list('id', 'content_id'))
+        modalities = Modality.objects.filter(
+            Q(pk__in=contents.values(), modality_type="text") |
+            Q(mixed_modality_id__in=contents.values(), modality_type="text")
+        ).order_by('order', 'pk')
 
-        last = root
-        last_text = get_text(last) or ""
-        
-        while last.replies.exists():
-            replies = last.replies.all()
-            last = replies[last.child_index]
-            text = get_text(last)
+        texts = {}
+        for modality in modalities:
+            # text of a text content or of the last text modality of a mixture
+            texts[modality.mixed_modality_id or modality.id] = modality.text
+
+        last_text = ""
+        for message_id in ids:
+            text = texts.get(contents[message_id])
             if text:
                 last_text = text
         return last_text
@@ -317,6 +582,7 @@ class MultimediaMessage(models.Model):
     active_revision = models.OneToOneField('Revision', on_delete=models.SET_NULL, 
                                            blank=True, null=True, related_name='active_message')
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     content = models.OneToOneField("Modality", on_delete=models.CASCADE,
                                    related_name='content_message')
@@ -328,6 +594,11 @@ class MultimediaMessage(models.Model):
     # deprecated field
     thoughts = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'parent'], name='message_chat_parent_idx')
+        ]
+
     def get_root(self):
         if self.parent is None:
             return self
@@ -335,6 +606,14 @@ class MultimediaMessage(models.Model):
         return self.parent.get_root()
 
     def get_history(self):
+        if self.chat_id is not None:
+            path = self.chat.get_message_ids()
+            if self.id in path:
+                ids = path[:path.index(self.id) + 1]
+                messages = MultimediaMessage.objects.in_bulk(ids[:-1])
+                messages[self.id] = self
+                return [messages[message_id] for message_id in ids]
+
         message = self
         history = [message]
         while message.parent:
@@ -368,7 +647,7 @@ class MultimediaMessage(models.Model):
         if self.revisions.exists():
             for old_revision in self.revisions.all():
                 cloned_revision = Revision.objects.create(
-                    src_tree=old_revision.src_tree, message=message
+                    files=old_revision.files, message=message
                 )
                 if self.active_revision and self.active_revision.id == old_revision.id:
                     message.active_revision = cloned_revision
@@ -383,35 +662,136 @@ class MultimediaMessage(models.Model):
 
     def save(self, **kwargs):
         self.add_chat()
-        super().save(**kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            if self.chat_id is not None:
+                self.chat.update_active_path()
+
+        # texts saved before the message had no chat to be indexed with
+        if adding and self.chat_id is not None:
+            documents = get_text_documents({self.content_id: self.chat_id})
+            search_backends.get_search_backend().index(documents)
+
+    def delete(self, **kwargs):
+        chat = self.chat
+        with transaction.atomic():
+            result = super().delete(**kwargs)
+            if chat is not None:
+                chat.update_active_path()
+        return result
 
     def __str__(self):
         return f"{self.role.capitalize()} message"
 
 
-def reduce_source_tree(revision):
-
-    def updated_tree(old_tree, new_tree):
-        """Note, this may change ordering"""
-        res_dict = {entry["file_path"]:entry for entry in old_tree}
-
-        for entry in new_tree:
-            path = entry["file_path"]
-            if "deleted" in entry:
-                if path in res_dict:
-                    del res_dict[path]
-            else:
-                res_dict[path] = entry
+def get_text_documents(chat_ids):
+    """Search documents of text modalities in content trees, chat_ids maps content ids to chat ids"""
+    chat_ids = dict(chat_ids)
+    documents = []
+    level = Modality.objects.filter(pk__in=chat_ids)
+    while True:
+        mixtures = []
+        for modality_id, parent_id, modality_type, text in level.values_list(
+                'id', 'mixed_modality_id', 'modality_type', 'text'):
+            if parent_id is not None:
+                chat_ids[modality_id] = chat_ids[parent_id]
+            if modality_type == "text":
+                documents.append(("text", modality_id, chat_ids[modality_id], "", text or ""))
+            elif modality_type == "mixture":
+                mixtures.append(modality_id)
 
-        return list(res_dict.values())
+        if not mixtures:
+            return documents
+        level = Modality.objects.filter(mixed_modality_id__in=mixtures)
 
-    src_tree = []
-    for message in revision.message.get_history():
-        rev = message.revisions.first()
-        if rev:
-            src_tree = updated_tree(src_tree, rev.src_tree)
 
-    return [entry for entry in src_tree if 'snippet' not in entry]
+def reduce_source_tree(revision):
+    return revision.get_source_tree()
+
+
+def set_prefetched(obj, relation, items):
+    """Fills the prefetch cache of a related manager, so that obj.<relation>.all() runs no query"""
+    queryset = getattr(obj, relation).get_queryset()
+    queryset._result_cache = list(items)
+    queryset._prefetch_done = True
+    if not hasattr(obj, '_prefetched_objects_cache'):
+        obj._prefetched_objects_cache = {}
+    obj._prefetched_objects_cache[relation] = queryset
+
+
+def prefetch_message_trees(messages):
+    """Loads messages with all their descendants, contents, revisions and generations in bulk.
+
+    Related objects are put into the caches of the loaded instances, so traversing the
+    trees (e.g. serializing them with replies) runs no further queries.
+    """
+    messages = list(messages)
+    loaded = {message.id: message for message in messages}
+
+    chat_ids = {message.chat_id for message in messages if message.chat_id is not None}
+    for message in MultimediaMessage.objects.filter(chat_id__in=chat_ids).order_by('pk'):
+        loaded.setdefault(message.id, message)
+
+    # messages without a chat are expanded level by level
+    frontier = [message.id for message in messages if message.chat_id is None]
+    while frontier:
+        children = MultimediaMessage.objects.filter(parent_id__in=frontier).exclude(pk__in=list(loaded))
+        frontier = []
+        for message in children:
+            loaded[message.id] = message
+            frontier.append(message.id)
+
+    all_messages = sorted(loaded.values(), key=lambda message: message.id)
+    replies = {message.id: [] for message in all_messages}
+    for message in all_messages:
+        if message.parent_id in loaded:
+            message.parent = loaded[message.parent_id]
+            replies[message.parent_id].append(message)
+
+    revisions = {message.id: [] for message in all_messages}
+    revision_objects = Revision.objects.filter(message_id__in=loaded).order_by('pk').prefetch_related(
+        'threads', 'suites'
+    )
+    revisions_by_id = {}
+    for revision in Revision.prefetch_src_trees(revision_objects):
+        revision.message = loaded[revision.message_id]
+        revisions[revision.message_id].append(revision)
+        revisions_by_id[revision.id] = revision
+
+    generations = {message.id: [] for message in all_messages}
+    generation_objects = Generation.objects.filter(message_id__in=loaded).order_by('pk').select_related(
+        'generation_metadata'
+    )
+    for generation in generation_objects:
+        generations[generation.message_id].append(generation)
+
+    modalities = {}
+    level = list(Modality.objects.filter(pk__in={message.content_id for message in all_messages}))
+    while level:
+        for modality in level:
+            modalities[modality.id] = modality
+        level = list(Modality.objects.filter(
+            mixed_modality_id__in=[modality.id for modality in level]
+        ).order_by('order', 'pk'))
+
+    mixtures = {modality_id: [] for modality_id in modalities}
+    # children were loaded level by level in the order of the mixture relation
+    for modality in modalities.values():
+        if modality.mixed_modality_id in modalities:
+            mixtures[modality.mixed_modality_id].append(modality)
+    for modality in modalities.values():
+        set_prefetched(modality, 'mixture', mixtures[modality.id])
+
+    for message in all_messages:
+        set_prefetched(message, 'replies', replies[message.id])
+        set_prefetched(message, 'revisions', revisions[message.id])
+        set_prefetched(message, 'generations', generations[message.id])
+        message.content = modalities[message.content_id]
+        if message.active_revision_id in revisions_by_id:
+            message.active_revision = revisions_by_id[message.active_revision_id]
+
+    return messages
 
 
 class Modality(models.Model):
@@ -434,6 +814,7 @@ class Modality(models.Model):
     layout = models.JSONField(blank=True, null=True)
 
     order = models.PositiveSmallIntegerField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def save(self, **kwargs):
         if self.mixed_modality is not None and self.order is None:
@@ -445,8 +826,26 @@ class Modality(models.Model):
             if update_fields is not None:
                 kwargs["update_fields"] = {"order"}.union(update_fields)
 
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {"updated"}.union(update_fields)
+
         super().save(**kwargs)
 
+        if self.modality_type == "text":
+            chat_id = self.get_chat_id()
+            if chat_id is not None:
+                document = ("text", self.pk, chat_id, "", self.text or "")
+                search_backends.get_search_backend().index([document])
+
+    def get_chat_id(self):
+        """Chat of the message whose content contains the modality"""
+        modality = self
+        while modality.mixed_modality_id is not None:
+            modality = modality.mixed_modality
+        messages = MultimediaMessage.objects.filter(content_id=modality.pk)
+        return messages.values_list('chat_id', flat=True).first()
+
     def clone(self):
         # todo: write unit tests
         modality_type = self.modality_type
@@ -537,11 +936,35 @@ class Generation(models.Model):
                                 blank=True, null=True, related_name='generations')
     generation_metadata = models.OneToOneField(GenerationMetadata, blank=True, null=True,
                                                on_delete=models.SET_NULL, related_name='generation')
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_time', 'id'], name='generation_start_time_id_idx')
+        ]
 
     def __str__(self):
         return f"Generation {self.task_id} - Finished: {self.finished}"
 
 
+class DeletedObject(models.Model):
+    """Tombstone of a deleted message, modality, revision or generation of a chat, reported
+    to clients by the sync endpoint (see assistant/sync.py)"""
+    # not a foreign key: tombstones of messages are written while their chat is being deleted
+    chat_id = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat_id', 'deleted'], name='deleted_object_chat_idx')
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id} of chat {self.chat_id}"
+
+
 class SpeechSample(models.Model):
     text = models.CharField(max_length=1024)
     audio = models.FileField(upload_to="audio_samples")
@@ -0,0 +1,174 @@
+"""Per-request profiling of database queries, serialization and total time.
+
+RequestProfilerMiddleware records every request under the name of its endpoint
+("<view class>.<action>"), adds a Server-Timing header and prints slow requests with
+their most repeated SQL. QUERY_BUDGETS limits the number of queries per endpoint;
+a request over budget is reported, and fails when QUERY_BUDGETS_ENFORCED is set.
+"""
+import re
+import time
+import threading
+import contextvars
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from rest_framework import serializers
+
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+endpoint_stats = {}
+stats_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Profile:
+    def __init__(self):
+        self.queries = Counter()
+        self.query_count = 0
+        self.db_seconds = 0
+        self.serializer_seconds = 0
+        self.serializing = False
+        self.total_seconds = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.query_count += 1
+            self.queries[get_fingerprint(sql)] += 1
+
+    def get_repeated_queries(self, limit=5):
+        return [(sql, count) for sql, count in self.queries.most_common(limit) if count > 1]
+
+    def get_server_timing(self):
+        return ", ".join([
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.query_count} queries"',
+            f'ser;dur={self.serializer_seconds * 1000:.1f}',
+            f'total;dur={self.total_seconds * 1000:.1f}',
+        ])
+
+
+def get_fingerprint(sql):
+    """SQL with literals and lists of parameters collapsed, so repeated queries look the same"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)", "(...)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def get_endpoint_name(view_func, method):
+    view_cls = getattr(view_func, "cls", None)
+    if view_cls is None:
+        return f"{view_func.__module__}.{view_func.__name__}"
+    name = view_func.__name__ if view_cls.__name__ == "WrappedAPIView" else view_cls.__name__
+    actions = getattr(view_func, "actions", None) or {}
+    return f"{name}.{actions.get(method.lower(), method.lower())}"
+
+
+def install_serializer_timer():
+    """Times Serializer.data and ListSerializer.data of the outermost serializer of a request"""
+    for serializer_cls in (serializers.Serializer, serializers.ListSerializer):
+        fget = serializer_cls.data.fget
+        if getattr(fget, "profiled", False):
+            continue
+
+        def timed_data(self, fget=fget):
+            profile = current_profile.get()
+            if profile is None or profile.serializing:
+                return fget(self)
+            profile.serializing = True
+            started = time.perf_counter()
+            try:
+                return fget(self)
+            finally:
+                profile.serializer_seconds += time.perf_counter() - started
+                profile.serializing = False
+
+        timed_data.profiled = True
+        serializer_cls.data = property(timed_data)
+
+
+def record_endpoint(endpoint, profile):
+    with stats_lock:
+        stats = endpoint_stats.setdefault(endpoint, dict(
+            requests=0, queries=0, max_queries=0, db_ms=0, serializer_ms=0, total_ms=0
+        ))
+        stats["requests"] += 1
+        stats["queries"] += profile.query_count
+        stats["max_queries"] = max(stats["max_queries"], profile.query_count)
+        stats["db_ms"] += profile.db_seconds * 1000
+        stats["serializer_ms"] += profile.serializer_seconds * 1000
+        stats["total_ms"] += profile.total_seconds * 1000
+
+
+def get_endpoint_stats():
+    """Averages per request of every endpoint recorded by this process"""
+    with stats_lock:
+        result = {}
+        for endpoint, stats in endpoint_stats.items():
+            requests = stats["requests"]
+            result[endpoint] = dict(
+                requests=requests,
+                max_queries=stats["max_queries"],
+                queries=stats["queries"] / requests,
+                db_ms=stats["db_ms"] / requests,
+                serializer_ms=stats["serializer_ms"] / requests,
+                total_ms=stats["total_ms"] / requests,
+            )
+        return result
+
+
+class RequestProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_serializer_timer()
+
+    def __call__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile.record_query):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        profile.total_seconds = time.perf_counter() - started
+
+        response["Server-Timing"] = profile.get_server_timing()
+        endpoint = getattr(request, "profiler_endpoint", None)
+        if endpoint is None:
+            return response
+
+        record_endpoint(endpoint, profile)
+        if profile.total_seconds * 1000 >= settings.SLOW_REQUEST_MS:
+            self.report_slow_request(request, endpoint, profile)
+        self.check_budget(request, endpoint, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profiler_endpoint = get_endpoint_name(view_func, request.method)
+
+    def report_slow_request(self, request, endpoint, profile):
+        print(f"Slow request {request.method} {request.path} ({endpoint}): "
+              f"{profile.total_seconds * 1000:.0f} ms, {profile.query_count} queries "
+              f"in {profile.db_seconds * 1000:.0f} ms, serializers {profile.serializer_seconds * 1000:.0f} ms")
+        for sql, count in profile.get_repeated_queries():
+            print(f"  {count} x {sql}")
+
+    def check_budget(self, request, endpoint, profile):
+        budget = settings.QUERY_BUDGETS.get(endpoint)
+        if budget is None or profile.query_count <= budget:
+            return
+
+        repeated = "; ".join(f"{count} x {sql}" for sql, count in profile.get_repeated_queries())
+        msg = (f"{request.method} {request.path} ({endpoint}) ran {profile.query_count} queries, "
+               f"the budget is {budget}. Repeated queries: {repeated or 'none'}")
+        if settings.QUERY_BUDGETS_ENFORCED:
+            raise QueryBudgetExceeded(msg)
+        print(msg)
@@ -0,0 +1,157 @@
+"""Garbage collection of downloaded build artifacts in ARTIFACTS_ROOT.
+
+Each successful build has its artifacts in ARTIFACTS_ROOT/<folder>/artifacts and
+a Build.url pointing into that folder. collect_artifacts() applies the retention
+policy configured in settings:
+
+- ARTIFACTS_KEEP_PER_REVISION: only the newest successful builds of every revision
+  keep their artifacts, older and failed builds lose them (their url is cleared)
+- ARTIFACTS_MAX_BYTES: when exceeded, artifacts of the oldest builds are removed
+- ARTIFACTS_ORPHAN_AGE: folders no build refers to are removed after this many seconds
+
+Identical files in the remaining folders are then replaced with hardlinks.
+"""
+import os
+import stat
+import time
+import shutil
+import hashlib
+from collections import defaultdict
+from django.conf import settings
+from assistant.models import Build
+from assistant import versions
+
+
+def get_artifacts_folder(url):
+    """Name of the folder inside ARTIFACTS_ROOT that a Build.url points to"""
+    prefix = settings.ARTIFACTS_URL.rstrip('/') + '/'
+    if not url or not url.startswith(prefix):
+        return None
+    return url[len(prefix):].split('/', 1)[0] or None
+
+
+def hash_file(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_files(paths):
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    yield file_path, os.lstat(file_path)
+                except FileNotFoundError:
+                    pass
+
+
+def get_disk_usage(path):
+    """Bytes used by files under path, counting hardlinked files once"""
+    inodes = {(st.st_dev, st.st_ino): st.st_size for _, st in iter_files([path])}
+    return sum(inodes.values())
+
+
+def deduplicate_files(paths, min_size=1024):
+    """Replaces identical files under paths with hardlinks to one of them.
+
+    Returns the number of replaced files and the number of bytes saved.
+    """
+    by_size = defaultdict(list)
+    for file_path, st in iter_files(paths):
+        if stat.S_ISREG(st.st_mode) and st.st_size >= min_size:
+            by_size[st.st_size].append((file_path, st))
+
+    replaced = 0
+    saved = 0
+    for size, candidates in by_size.items():
+        if len(candidates) < 2:
+            continue
+
+        originals = {}
+        for file_path, st in candidates:
+            original_path, original_st = originals.setdefault(hash_file(file_path), (file_path, st))
+            if st.st_dev != original_st.st_dev or st.st_ino == original_st.st_ino:
+                continue
+
+            tmp_path = f"{file_path}.dedup"
+            try:
+                os.link(original_path, tmp_path)
+                os.replace(tmp_path, file_path)
+            except OSError as e:
+                print(f'Failed to deduplicate "{file_path}": {e!r}')
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                continue
+            replaced += 1
+            saved += size
+
+    return replaced, saved
+
+
+def collect_artifacts(root=None, now=None):
+    root = root or settings.ARTIFACTS_ROOT
+    now = now or time.time()
+    stats = dict(expired_builds=0, evicted_builds=0, removed_orphans=0)
+
+    if not os.path.isdir(root):
+        return stats
+
+    builds = Build.objects.filter(url__isnull=False).exclude(url="").order_by(
+        'operation_suite__revision', '-end_time', '-id'
+    ).values_list('id', 'url', 'success', 'operation_suite__revision')
+
+    keep_per_revision = settings.ARTIFACTS_KEEP_PER_REVISION
+    kept = defaultdict(int)
+    expired = []
+    live = {}
+    for build_id, url, success, revision_id in builds:
+        folder = get_artifacts_folder(url)
+        if folder is None:
+            continue
+        if success and kept[revision_id] < keep_per_revision:
+            kept[revision_id] += 1
+            live[build_id] = folder
+        else:
+            expired.append((build_id, folder))
+
+    for build_id, folder in expired:
+        remove_artifacts(root, build_id, folder)
+    stats["expired_builds"] = len(expired)
+
+    referenced = set(live.values())
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in referenced or not os.path.isdir(path):
+            continue
+        if now - os.stat(path).st_mtime > settings.ARTIFACTS_ORPHAN_AGE:
+            shutil.rmtree(path, ignore_errors=True)
+            stats["removed_orphans"] += 1
+
+    total = get_disk_usage(root)
+    if total > settings.ARTIFACTS_MAX_BYTES:
+        oldest_first = Build.objects.filter(pk__in=live).order_by('end_time', 'id')
+        for build_id in oldest_first.values_list('id', flat=True):
+            if total <= settings.ARTIFACTS_MAX_BYTES:
+                break
+            folder_path = os.path.join(root, live[build_id])
+            total -= get_disk_usage(folder_path)
+            remove_artifacts(root, build_id, live.pop(build_id))
+            stats["evicted_builds"] += 1
+
+    replaced, saved = deduplicate_files([os.path.join(root, folder) for folder in live.values()])
+    stats["deduplicated_files"] = replaced
+    stats["saved_bytes"] = saved
+    return stats
+
+
+def remove_artifacts(root, build_id, folder):
+    builds = Build.objects.filter(pk=build_id)
+    builds.update(url=None)
+    # bulk updates skip the post_save receivers, so the chat version is bumped here
+    versions.bump_versions(list(builds.values_list('operation_suite__revision__message__chat_id', flat=True)))
+    if folder:
+        shutil.rmtree(os.path.join(root, folder), ignore_errors=True)
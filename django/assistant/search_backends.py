@@ -0,0 +1,167 @@
+"""Full-text search over chats.
+
+Every chat is represented by several documents: one for the chat itself (name and
+description), one per text modality of its messages and one per revision (file paths
+and contents). A document is a (kind, object_id, chat_id, title, body) tuple, documents
+are replaced whenever the object they describe is saved (see models.py) and removed
+when it is deleted (see connect_receivers).
+"""
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, IntegerField
+from django.db.models.signals import post_delete
+
+
+DOCUMENT_KINDS = ("chat", "text", "revision")
+
+
+class SearchBackend:
+    def index(self, documents):
+        raise NotImplementedError
+
+    def remove(self, kind, object_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def filter_chats(self, queryset, term, ranked=False):
+        """Chats of the queryset matching the term, ordered by relevance when ranked is set"""
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    """Keeps no index, matches chat names only. For databases without FTS5"""
+
+    def index(self, documents):
+        pass
+
+    def remove(self, kind, object_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def filter_chats(self, queryset, term, ranked=False):
+        return queryset.filter(name__contains=term)
+
+
+class Fts5SearchBackend(SearchBackend):
+    """SQLite FTS5 index, the table is created by migration 0035_search_index.
+
+    Rows are addressed by rowid derived from the kind and the id of the indexed object,
+    so replacing a document never scans the table. Titles weigh more than bodies.
+    """
+    table = "assistant_search_index"
+
+    def __init__(self, max_results=1000, title_weight=10.0, body_weight=1.0):
+        self.max_results = max_results
+        self.title_weight = title_weight
+        self.body_weight = body_weight
+
+    def index(self, documents):
+        rows = [(get_rowid(kind, object_id), chat_id, title, body)
+                for kind, object_id, chat_id, title, body in documents]
+        if not rows:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [row[:1] for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, chat_id, title, body) VALUES (%s, %s, %s, %s)", rows
+            )
+
+    def remove(self, kind, object_ids):
+        rows = [(get_rowid(kind, object_id),) for object_id in object_ids]
+        if not rows:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", rows)
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+    def filter_chats(self, queryset, term, ranked=False):
+        query = make_match_query(term)
+        if not query:
+            return queryset.filter(name__contains=term)
+
+        chat_ids = self.rank(query)
+        queryset = queryset.filter(pk__in=chat_ids)
+        if ranked and chat_ids:
+            positions = [When(pk=chat_id, then=pos) for pos, chat_id in enumerate(chat_ids)]
+            queryset = queryset.order_by(Case(*positions, output_field=IntegerField()))
+        return queryset
+
+    def rank(self, query):
+        """Ids of best matching chats, a chat is as relevant as its best matching document"""
+        # bm25 can not be aggregated, documents are sorted and deduplicated instead
+        sql = (f"SELECT chat_id FROM {self.table} WHERE {self.table} MATCH %s "
+               f"ORDER BY bm25({self.table}, 0.0, %s, %s)")
+        chat_ids = {}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query, self.title_weight, self.body_weight])
+            for chat_id, in cursor:
+                chat_ids.setdefault(chat_id, None)
+                if len(chat_ids) >= self.max_results:
+                    break
+        return list(chat_ids)
+
+
+def get_rowid(kind, object_id):
+    return object_id * len(DOCUMENT_KINDS) + DOCUMENT_KINDS.index(kind)
+
+
+def make_match_query(term):
+    """FTS5 query matching documents that contain a word starting with every word of the term"""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", term))
+
+
+def on_chat_delete(sender, instance, **kwargs):
+    get_search_backend().remove("chat", [instance.pk])
+
+
+def on_message_delete(sender, instance, **kwargs):
+    # contents outlive their messages, but their texts must stop matching the chat
+    from assistant.models import get_text_documents
+    documents = get_text_documents({instance.content_id: instance.chat_id})
+    get_search_backend().remove("text", [object_id for kind, object_id, *rest in documents])
+
+
+def on_modality_delete(sender, instance, **kwargs):
+    if instance.modality_type == "text":
+        get_search_backend().remove("text", [instance.pk])
+
+
+def on_revision_delete(sender, instance, **kwargs):
+    get_search_backend().remove("revision", [instance.pk])
+
+
+def connect_receivers():
+    from assistant.models import Chat, MultimediaMessage, Modality, Revision
+    receivers = {
+        Chat: on_chat_delete,
+        MultimediaMessage: on_message_delete,
+        Modality: on_modality_delete,
+        Revision: on_revision_delete,
+    }
+    for model, receiver in receivers.items():
+        post_delete.connect(receiver, sender=model, dispatch_uid=f"search-delete-{model.__name__}")
+
+
+def get_search_backend():
+    backend_cls = backends[settings.SEARCH_BACKEND["name"]]
+    return backend_cls(**settings.SEARCH_BACKEND.get("kwargs", {}))
+
+
+backends = {
+    "simple": SimpleSearchBackend,
+    "fts5": Fts5SearchBackend,
+}
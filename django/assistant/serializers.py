@@ -10,6 +10,8 @@ from .models import (
 )
 from assistant.tasks import generate_completion, launch_operation_suite, CompletionConfig
 from assistant.utils import fix_newlines, get_multimedia_message_text
+from assistant import diffs
+from assistant import tree_cache
 
 class ServerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -45,7 +47,7 @@ class ConfigurationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'llm_model', 'description', 'system_message', 'coder_system_message', 'preset', 'llm_server',
             'build_servers', 'lint_servers', 'test_servers', 'interaction_servers',
-            'autorun', 'max_iterations'
+            'autorun', 'max_iterations', 'build_strategy', 'build_race_size'
         ]
 
 
@@ -54,7 +56,8 @@ class BuildSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Build
-        fields = ['id', 'logs', 'screenshot', 'url', 'finished', 'success', 'errors', 'start_time', 'end_time', 'state']
+        fields = ['id', 'logs', 'screenshot', 'url', 'finished', 'success', 'errors', 'start_time', 'end_time', 'state',
+                  'server_url', 'timings']
 
     def get_state(self, obj):
         if not obj.finished:
@@ -153,7 +156,25 @@ class RevisionSerializer(serializers.ModelSerializer):
         fields = ['id', 'src_tree', 'created', 'message', 'threads', 'operation_suites']
 
 
+class RevisionChangesSerializer(RevisionSerializer):
+    """Revision with the changes made to the reduced tree of the previous revision instead of src_tree"""
+    changes = serializers.SerializerMethodField()
+
+    class Meta(RevisionSerializer.Meta):
+        fields = ['id', 'changes', 'created', 'message', 'threads', 'operation_suites']
+
+    def get_changes(self, obj):
+        # lists of revisions are diffed in advance by diffs.prefetch_changes
+        changes = getattr(obj, 'changes', None)
+        if changes is None:
+            diff_format = self.context.get('diff_format', 'unified')
+            changes = diffs.diff_revisions(obj.get_previous(), obj, diff_format)
+        return changes
+
+
 class NewRevisionSerializer(serializers.ModelSerializer):
+    src_tree = serializers.JSONField()
+
     class Meta:
         model = Revision
         fields = ['id', 'src_tree', 'message']
@@ -205,10 +226,8 @@ class ModalitySerializer(serializers.ModelSerializer):
                   'mixed_modality', 'mixture', 'layout', 'order']
 
     def get_mixture(self, obj):
-        if obj.mixture.exists():
-            objs = ModalitySerializer(obj.mixture.order_by("order"), many=True).data
-            return objs
-        return []
+        # mixture is ordered by "order", all() keeps children loaded by prefetch_message_trees
+        return ModalitySerializer(obj.mixture.all(), many=True).data
 
     def validate_text(self, data):
         is_being_created = bool(self.instance is None)
@@ -351,7 +370,19 @@ class MultimediaMessageSerializer(serializers.ModelSerializer):
 
     def get_replies(self, obj):
         kwargs = dict(context=self.context) if hasattr(self, "context") else {}
-        return MultimediaMessageSerializer(obj.replies.all(), many=True, **kwargs).data
+        replies = obj.replies.all()
+        variant = kwargs.get("context", {}).get("tree_cache_variant")
+        if variant is None:
+            return MultimediaMessageSerializer(replies, many=True, **kwargs).data
+
+        # subtrees of unchanged replies are taken from the cache, see assistant/tree_cache.py
+        trees = tree_cache.get_trees([reply.id for reply in replies], variant)
+        missing = [reply for reply in replies if reply.id not in trees]
+        rendered = MultimediaMessageSerializer(missing, many=True, **kwargs).data
+        new_trees = {reply.id: (None, data) for reply, data in zip(missing, rendered)}
+        tree_cache.store_trees(new_trees, variant)
+        trees.update(new_trees)
+        return [trees[reply.id][1] for reply in replies]
 
     def get_tts_text(self, obj):
         return get_multimedia_message_text(obj)
@@ -422,7 +453,7 @@ class ChatSerializer(serializers.HyperlinkedModelSerializer):
     effective_system_message = serializers.SerializerMethodField()
 
     def get_effective_system_message(self, obj):
-        return obj.get_system_message()
+        return tree_cache.get_system_message(obj)
 
     class Meta:
         model = Chat
@@ -441,6 +472,31 @@ class GenerationSerializer(serializers.ModelSerializer):
         ]
 
 
+class SyncMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MultimediaMessage
+        fields = ['id', 'role', 'chat', 'parent', 'active_revision', 'content', 'audio',
+                  'child_index', 'created', 'updated']
+
+
+class SyncModalitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Modality
+        fields = ['id', 'modality_type', 'text', 'image', 'file_path', 'oai_item',
+                  'mixed_modality', 'layout', 'order', 'updated']
+
+
+class SyncRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Revision
+        fields = ['id', 'message', 'src_tree', 'created', 'updated']
+
+
+class SyncGenerationSerializer(GenerationSerializer):
+    class Meta(GenerationSerializer.Meta):
+        fields = GenerationSerializer.Meta.fields + ['updated']
+
+
 class NewGenerationTaskSerializer(serializers.ModelSerializer):
     model_name = serializers.CharField(max_length=255, required=False)
     params = serializers.DictField(required=False)
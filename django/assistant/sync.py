@@ -0,0 +1,116 @@
+"""Changes of a chat since a cursor, used by clients to update their copy of a conversation.
+
+A cursor is the number of microseconds since the epoch of the last change the client
+has seen. Messages, modalities, revisions and generations are returned flat, with ids
+of their parents, and only when they were created or updated after the cursor. Ids of
+objects deleted after the cursor are returned as well, from DeletedObject tombstones.
+
+The updated timestamp of a row is taken when it is saved, not when its transaction
+commits, so a row may become visible after a cursor later than its timestamp was issued.
+Every sync scans SYNC_RESCAN_WINDOW seconds before the cursor again to pick such rows
+up; clients get objects they already have again and are expected to upsert them.
+"""
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from assistant.models import Chat, MultimediaMessage, Modality, Revision, Generation, DeletedObject
+from assistant import versions
+
+
+epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(timestamp):
+    return str((timestamp - epoch) // timedelta(microseconds=1))
+
+
+def decode_cursor(cursor):
+    """Returns the timestamp of the cursor, raises ValueError for malformed cursors"""
+    return epoch + timedelta(microseconds=int(cursor))
+
+
+def get_rescan_start(since):
+    window = timedelta(seconds=settings.SYNC_RESCAN_WINDOW)
+    return max(since, epoch + window) - window
+
+
+def get_modality_ids(content_ids):
+    """Ids of the given content modalities and all their nested modalities"""
+    ids = set()
+    level = set(content_ids)
+    while level:
+        ids.update(level)
+        level = set(Modality.objects.filter(mixed_modality_id__in=level).values_list('id', flat=True)) - ids
+    return ids
+
+
+def get_chat_changes(chat, since=None):
+    """Objects of the chat changed after since (all of them when since is None), ids of
+    deleted ones by kind and a new cursor.
+
+    Modalities of changed messages are always included: they are usually created before
+    the message that attaches them to the chat.
+    """
+    after = get_rescan_start(since) if since is not None else None
+
+    def changed(queryset):
+        if after is not None:
+            queryset = queryset.filter(updated__gt=after)
+        return list(queryset.order_by('updated', 'pk'))
+
+    chat_messages = MultimediaMessage.objects.filter(chat=chat)
+    messages = changed(chat_messages)
+    modalities = Modality.objects.filter(pk__in=get_modality_ids(chat_messages.values_list('content_id', flat=True)))
+    if after is not None:
+        attached = get_modality_ids([message.content_id for message in messages])
+        modalities = modalities.filter(Q(updated__gt=after) | Q(pk__in=attached))
+
+    changes = dict(
+        messages=messages,
+        modalities=list(modalities.order_by('updated', 'pk')),
+        revisions=changed(Revision.objects.filter(message__chat=chat)),
+        generations=changed(Generation.objects.filter(Q(chat=chat) | Q(message__chat=chat)).select_related(
+            'generation_metadata'
+        ).distinct())
+    )
+
+    deleted = {kind: [] for kind in changes}
+    timestamps = [objects[-1].updated for objects in changes.values() if objects]
+    if after is not None:
+        tombstones = DeletedObject.objects.filter(chat_id=chat.pk, deleted__gt=after).order_by('deleted', 'pk')
+        for tombstone in tombstones:
+            deleted[tombstone.kind].append(tombstone.object_id)
+            timestamps.append(tombstone.deleted)
+
+    latest = max(timestamps + ([since] if since is not None else []), default=None)
+    cursor = encode_cursor(latest) if latest is not None else None
+    return changes, deleted, cursor
+
+
+sync_kinds = {
+    MultimediaMessage: "messages",
+    Modality: "modalities",
+    Revision: "revisions",
+    Generation: "generations",
+}
+
+
+def on_delete(sender, instance, **kwargs):
+    chat_ids = {chat_id for chat_id in versions.chat_lookups[sender](instance) if chat_id is not None}
+    DeletedObject.objects.bulk_create([
+        DeletedObject(chat_id=chat_id, kind=sync_kinds[sender], object_id=instance.pk) for chat_id in chat_ids
+    ])
+
+
+def on_chat_delete(sender, instance, **kwargs):
+    # messages of the chat may be deleted after it within the same cascade
+    chat_id = instance.pk
+    transaction.on_commit(lambda: DeletedObject.objects.filter(chat_id=chat_id).delete())
+
+
+def connect_receivers():
+    for model in sync_kinds:
+        post_delete.connect(on_delete, sender=model, dispatch_uid=f"sync-tombstone-{model.__name__}")
+    post_delete.connect(on_chat_delete, sender=Chat, dispatch_uid="sync-tombstone-Chat")
@@ -8,9 +8,19 @@ import re
 import tarfile
 import zipfile
 import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from typing import Dict
 import traceback
 import requests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from django.utils import timezone
 from celery import shared_task
 import redis
@@ -22,8 +32,8 @@ from assistant import text2image_backends
 from assistant import tts_backends
 from assistant import rag_backends
 from assistant.models import (
-    Chat, MultimediaMessage, Modality, Revision, Generation,
-    OperationSuite, Build, Server, SpeechSample, Resource, reduce_source_tree
+    Chat, MultimediaMessage, Modality, Revision, Generation, Configuration,
+    OperationSuite, Build, LinterCheck, TestRun, Server, SpeechSample, Resource, reduce_source_tree
 )
 from assistant.utils import (
     process_raw_message, extract_modalities, prepare_messages, prepare_build_files,
@@ -31,6 +41,7 @@ from assistant.utils import (
     get_wave_duration, join_wavs, ThinkingDetector
 )
 from assistant import serializers
+from assistant import retention
 
 
 @dataclass
@@ -413,6 +424,10 @@ def generate_chat_picture(text, chat_id, backend_name, socket_session_id):
     emitter(event_type="chat_image_generation_ended", data=dict(task_id=gen_obj.task_id))
 
 
+class BuiltInServer:
+    url = "http://builder:8888"
+
+
 @shared_task
 def launch_operation_suite(revision_id, socket_session_id, builder_id=None, **build_params):
     revision = Revision.objects.get(pk=revision_id)
@@ -427,102 +442,464 @@ def launch_operation_suite(revision_id, socket_session_id, builder_id=None, **bu
     #data.update(build_params)
 
     chat = message.get_root().chat
-    resources = chat.resources.all()
-    build_servers = chat.configuration.build_servers.all()
-    
-    class BuiltInServer:
-        url = "http://builder:8888"
+    resources = list(chat.resources.all())
+    configuration = chat.configuration
+    build_servers = list(configuration.build_servers.all()) or [BuiltInServer]
 
     server = Server.objects.filter(pk=builder_id).first()
     if server is not None:
         build_servers = [server]
-    else:
-        build_servers = [BuiltInServer]
 
     emitter = RedisEventEmitter(socket_session_id)
-    artifacts_root = settings.ARTIFACTS_ROOT
+    executor = SuiteExecutor()
+    base_build = find_base_build(revision)
+    runner = BuildRunner(suite, final_src_tree, resources, emitter,
+                         base_build_id=base_build and base_build.builder_build_id, executor=executor)
+
+    strategy = configuration.build_strategy
+    if strategy == Configuration.BuildStrategy.RACE and len(build_servers) > 1:
+        runner.start_race(build_servers[:max(1, configuration.build_race_size)])
+    elif strategy == Configuration.BuildStrategy.LEAST_LOADED:
+        runner.start_sequentially(order_by_load(build_servers))
+    else:
+        runner.start_sequentially(build_servers)
+
+    CheckRunner(suite, "lint", final_src_tree, emitter, executor).start(configuration.lint_servers.all())
+    CheckRunner(suite, "test", final_src_tree, emitter, executor).start(configuration.test_servers.all())
+
+    executor.run()
+    emitter(event_type="suite_finished", data=dict(
+        suite_id=suite.id, revision_id=revision.id, summary=suite.get_summary()
+    ))
 
-    for server in build_servers:
-        build = Build.objects.create(operation_suite=suite)
-        event_data = dict(build=serializers.BuildSerializer(build).data, revision_id=revision_id)
-        emitter(event_type="build_started", data=event_data)
 
-        url = f'{server.url}/build-spa/'
+class SuiteExecutor:
+    """Runs network calls of an operation suite concurrently.
+
+    Functions are called in a thread pool, their completion handlers are called in the
+    thread that runs the executor, so that all database writes happen there.
+    """
+
+    def __init__(self, max_workers=16):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="suite")
+        self.handlers = {}
 
+    def spawn(self, on_done, fn, *args):
+        future = self.pool.submit(fn, *args)
+        self.handlers[future] = on_done
+        return future
+
+    def discard(self, future):
+        """Stops waiting for the future, its handler will not be called"""
+        self.handlers.pop(future, None)
+        future.cancel()
+
+    def run(self):
+        """Calls completion handlers until nothing is left to wait for"""
         try:
-            response_json = post_tar(url, final_src_tree, resources)
-            build.success = response_json["success"]
-            logs = {}
-            logs["stdout"] = response_json["stdout"]
-            logs["stderr"] = response_json["stderr"]
-            build.logs = logs
+            while self.handlers:
+                done, _ = wait(list(self.handlers), return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_done = self.handlers.pop(future, None)
+                    if on_done is not None:
+                        on_done(future)
+        finally:
+            self.pool.shutdown(wait=False)
 
 
-            build_id = response_json["build_id"]
-            tar_url = f'{server.url}/app_files/{build_id}/'
+class BuildCancelled(Exception):
+    pass
 
-            artifacts_location = download_artifacts(tar_url, artifacts_root)
-            build.url = f'{settings.ARTIFACTS_URL}/{artifacts_location}/index.html'
-            break
-        except Exception as e:
-            print(traceback.format_exc())
+
+class BuildRunner:
+    """Runs the build of an operation suite on one or more build servers.
+
+    Every attempt gets its own Build row. Builds are sent and their artifacts downloaded
+    in the threads of a SuiteExecutor, all database writes happen in the executor's thread.
+    """
+
+    def __init__(self, suite, source_tree, resources, emitter, base_build_id=None, executor=None):
+        self.suite = suite
+        self.revision_id = suite.revision_id
+        self.source_tree = source_tree
+        self.resources = resources
+        self.emitter = emitter
+        self.base_build_id = base_build_id
+        self.executor = executor or SuiteExecutor()
+        self.attempts = {}
+        self.winner = None
+
+    def run_sequentially(self, servers):
+        self.start_sequentially(servers)
+        self.executor.run()
+        return self.winner
+
+    def race(self, servers):
+        self.start_race(servers)
+        self.executor.run()
+        return self.winner
+
+    def start_sequentially(self, servers):
+        """Tries servers in order until one of them responds with a build result"""
+        servers = iter(servers)
+
+        def on_finished(build, crashed):
+            if crashed:
+                try_next()
+            else:
+                self.winner = build
+
+        def try_next():
+            server = next(servers, None)
+            if server is not None:
+                self.start_attempt(server, on_finished)
+
+        try_next()
+
+    def start_race(self, servers):
+        """Submits the build to all servers at once and keeps the first successful result.
+
+        Remaining attempts are cancelled: their jobs are removed from the builder queue
+        if they have not started yet, their results are ignored otherwise.
+        """
+        def on_finished(build, crashed):
+            if build.success and self.winner is None:
+                self.winner = build
+                self.cancel_attempts()
+
+        for server in servers:
+            self.start_attempt(server, on_finished)
+
+    def start_attempt(self, server, on_finished):
+        build = self.start_build(server)
+        cancelled = threading.Event()
+
+        def on_done(future):
+            del self.attempts[future]
+            crashed = False
+            try:
+                self.complete(build, future.result())
+            except Exception:
+                print(traceback.format_exc())
+                self.crash(build)
+                crashed = True
+            finally:
+                self.finish(build)
+            on_finished(build, crashed)
+
+        future = self.executor.spawn(on_done, self.submit, server, build, cancelled)
+        self.attempts[future] = (build, cancelled)
+
+    def cancel_attempts(self):
+        for future, (build, cancelled) in list(self.attempts.items()):
+            cancelled.set()
+            self.executor.discard(future)
             build.success = False
-            build.errors = ["Operation was not completed correctly"]
-        finally:
-            build.finished = True
-            build.end_time = timezone.now()
-            build.save()
-            event_data = dict(build=serializers.BuildSerializer(build).data, revision_id=revision_id)
-            emitter(event_type="build_finished", data=event_data)
+            build.errors = ["Cancelled: another build server finished first"]
+            self.finish(build)
+        self.attempts.clear()
+
+    def start_build(self, server):
+        build = Build.objects.create(operation_suite=self.suite, server_url=server.url)
+        self.emit("build_started", build)
+        return build
+
+    def submit(self, server, build, cancelled=None):
+        """Builds the sources on the server and downloads the artifacts, does not use the database"""
+        def forward_log(stream, text):
+            self.emitter(event_type="build_log", data=dict(
+                build_id=build.id, revision_id=self.revision_id, stream=stream, text=text
+            ))
+
+        t0 = time.monotonic()
+        result = run_build_job(server.url, self.source_tree, self.resources, forward_log,
+                               base_build_id=self.base_build_id, cancelled=cancelled)
+        request_seconds = time.monotonic() - t0
+
+        t0 = time.monotonic()
+        tar_url = f'{server.url}/app_files/{result["build_id"]}/'
+        artifacts_location = download_artifacts(tar_url, settings.ARTIFACTS_ROOT)
+        return dict(result, artifacts_location=artifacts_location, request_seconds=request_seconds,
+                    download_seconds=time.monotonic() - t0)
+
+    def complete(self, build, result):
+        build.success = result["success"]
+        build.logs = dict(stdout=result["stdout"], stderr=result["stderr"])
+        build.builder_build_id = result["build_id"]
+        build.url = f'{settings.ARTIFACTS_URL}/{result["artifacts_location"]}/index.html'
+        build.timings = {
+            name: result[name] for name in
+            ("queued_seconds", "build_seconds", "request_seconds", "download_seconds")
+            if name in result
+        }
 
+    def crash(self, build):
+        build.success = False
+        build.errors = ["Operation was not completed correctly"]
 
-def post_tar(url, source_tree, resources):
-    f = io.BytesIO()
+    def finish(self, build):
+        build.finished = True
+        build.end_time = timezone.now()
+        build.save()
+        self.emit("build_finished", build)
 
-    text_files = []
-    for entry in source_tree:
-        path = entry["file_path"]
-        content = entry["content"].encode("utf-8")
-        text_files.append((path, content))
+    def emit(self, event_type, build):
+        event_data = dict(build=serializers.BuildSerializer(build).data, revision_id=self.revision_id)
+        self.emitter(event_type=event_type, data=event_data)
 
-    res_files = []
-    for res in resources:
-        with open(res.file.path, "rb") as rf:
-            content = rf.read()
-        res_files.append((res.dest_path, content))
 
-    all_files = text_files + res_files
+class CheckRunner:
+    """Runs lint checks or test runs of an operation suite, one per configured server.
 
-    with tarfile.open(fileobj=f, mode='w') as tar:
-        for path, content in all_files:
-            tarinfo = tarfile.TarInfo(name=path)
-            temp_file = io.BytesIO(content)
-            tarinfo.size = temp_file.getbuffer().nbytes
-            tar.addfile(tarinfo, temp_file)
+    Nothing runs when the configuration has no lint (test) servers. Otherwise the final
+    source tree is posted as {"source_tree": [...]} to <server url>/lint/ (<server url>/test/)
+    and the server responds with {"success": bool, "report": <any JSON>, "logs": [str, ...]}.
+    Servers that fail to respond within QA_REQUEST_TIMEOUT mark the operation as failed.
+    """
+
+    operation_models = {"lint": LinterCheck, "test": TestRun}
+
+    def __init__(self, suite, kind, source_tree, emitter, executor):
+        self.suite = suite
+        self.kind = kind
+        self.source_tree = source_tree
+        self.emitter = emitter
+        self.executor = executor
+
+    def start(self, servers):
+        model = self.operation_models[self.kind]
+        for server in servers:
+            operation = model.objects.create(operation_suite=self.suite)
+            self.emit(f"{self.kind}_started", operation)
+            self.executor.spawn(partial(self.on_done, operation), post_json,
+                                f'{server.url}/{self.kind}/', dict(source_tree=self.source_tree),
+                                settings.QA_REQUEST_TIMEOUT)
+
+    def on_done(self, operation, future):
+        try:
+            result = future.result()
+            operation.success = bool(result.get("success"))
+            operation.report = result.get("report")
+            operation.logs = result.get("logs")
+        except Exception:
+            print(traceback.format_exc())
+            operation.success = False
+            operation.errors = ["Operation was not completed correctly"]
+
+        operation.finished = True
+        operation.end_time = timezone.now()
+        operation.save()
+        self.emit(f"{self.kind}_finished", operation)
+
+    def emit(self, event_type, operation):
+        serializer_class = {
+            "lint": serializers.LinterCheckSerializer, "test": serializers.TestRunSerializer
+        }[self.kind]
+        event_data = {self.kind: serializer_class(operation).data, "revision_id": self.suite.revision_id}
+        self.emitter(event_type=event_type, data=event_data)
+
+
+def get_server_load(server):
+    """Number of queued and running jobs per worker reported by the build server"""
+    try:
+        response = requests.get(f'{server.url}/queue/', timeout=settings.BUILD_QUEUE_STATS_TIMEOUT)
+        stats = response.json() if response else None
+    except (requests.RequestException, ValueError):
+        stats = None
+
+    if not stats:
+        return float('inf')
+    return (stats["queued"] + stats["running"]) / max(1, stats["workers"])
+
+
+def order_by_load(servers):
+    if len(servers) < 2:
+        return servers
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        loads = list(executor.map(get_server_load, servers))
+    return [server for _, server in sorted(zip(loads, servers), key=lambda pair: pair[0])]
+
+
+@shared_task
+def collect_artifacts_garbage():
+    stats = retention.collect_artifacts()
+    print("Artifacts GC:", stats)
+    return stats
 
-    f.seek(0)
-    files = {'src': f}
-    response = requests.post(url, files=files)
+
+def find_base_build(revision):
+    """Latest successful build of this revision or of an earlier revision in the same
+    conversation branch. Its workspace is passed to the builder as a starting point."""
+    history = revision.message.get_history()
+    return Build.objects.filter(
+        success=True, builder_build_id__isnull=False,
+        operation_suite__revision__message__in=history
+    ).order_by('-end_time', '-id').first()
+
+
+def run_build_job(server_url, source_tree, resources, on_log, base_build_id=None, cancelled=None):
+    """Submits a build job and follows its logs until it is done, returns the build result.
+
+    Falls back to the blocking /build-spa/ endpoint for servers without job support.
+    Setting the cancelled event stops following the job and asks the server to cancel it.
+    """
+    manifest = upload_resources(server_url, resources)
+    response = post_sources(f'{server_url}/jobs/', server_url, source_tree, resources, manifest,
+                            base_build_id)
+    if response.status_code in (404, 405):
+        return post_tar(f'{server_url}/build-spa/', source_tree, resources, manifest,
+                        base_build_id)
+
+    if not response:
+        raise Exception(f'Bad status code: {response.status_code}. Response: {response.text}')
+
+    job_id = response.json()["job_id"]
+    logs_url = f'{server_url}/jobs/{job_id}/logs/'
+    job = None
+    with requests.get(logs_url, stream=True, timeout=settings.BUILD_LOG_READ_TIMEOUT) as response:
+        if not response:
+            raise Exception(f'Bad status code: {response.status_code}. Response: {response.text}')
+
+        for line in response.iter_lines(decode_unicode=True):
+            if cancelled is not None and cancelled.is_set():
+                requests.delete(f'{server_url}/jobs/{job_id}/')
+                raise BuildCancelled(f'Build job {job_id} was cancelled')
+
+            if not line:
+                continue  # heartbeat
+
+            entry = json.loads(line)
+            if "job_id" in entry:
+                job = entry
+            else:
+                on_log(entry["stream"], entry["text"])
+
+    if job is None:
+        raise Exception(f'Log stream of build job {job_id} ended before the job finished')
+
+    if job["status"] != "finished":
+        raise Exception(f'Build job {job_id} failed: {job["error"]}')
+    return job["result"]
+
+
+def post_tar(url, source_tree, resources, manifest=None, base_build_id=None):
+    server_url = url.rsplit('/build-spa/', 1)[0]
+    response = post_sources(url, server_url, source_tree, resources, manifest, base_build_id)
 
     if response:
         return response.json()
     raise Exception(f'Bad status code: {response.status_code}. Response: {response.json()}')
 
 
+def post_sources(url, server_url, source_tree, resources, manifest, base_build_id=None):
+    """Posts a tar of the source tree with resources either inside the tar or,
+    when a manifest is given, as references to blobs already stored on the server.
+
+    Blobs removed on the server in the meantime are uploaded again once.
+    """
+    for attempt in range(2):
+        if manifest is None:
+            files = {'src': make_source_tar(source_tree, resources)}
+            data = {}
+        else:
+            files = {'src': make_source_tar(source_tree)}
+            data = {'manifest': json.dumps(manifest)}
+
+        if base_build_id:
+            data['base_build_id'] = base_build_id
+
+        response = requests.post(url, files=files, data=data)
+        if response.status_code != 409 or attempt > 0:
+            return response
+        manifest = upload_resources(server_url, resources)
+    return response
+
+
+def upload_resources(server_url, resources):
+    """Uploads resource files that the build server does not have yet.
+
+    Returns a manifest with the path and sha256 of every resource, or None if the
+    server has no blob store.
+    """
+    paths = {}
+    manifest = []
+    for res in resources:
+        sha256 = hash_file(res.file.path)
+        paths[sha256] = res.file.path
+        manifest.append(dict(path=res.dest_path, sha256=sha256))
+
+    if not manifest:
+        return manifest
+
+    response = requests.post(f'{server_url}/blobs/missing/', json=dict(hashes=list(paths)))
+    if response.status_code in (404, 405):
+        return None
+    if not response:
+        raise Exception(f'Bad status code: {response.status_code}. Response: {response.text}')
+
+    for sha256 in response.json()["missing"]:
+        with open(paths[sha256], "rb") as f:
+            upload_response = requests.put(f'{server_url}/blobs/{sha256}/', data=f)
+        if not upload_response:
+            raise Exception(f'Failed to upload blob {sha256}: {upload_response.text}')
+
+    return manifest
+
+
+def hash_file(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_source_tar(source_tree, resources=()):
+    f = io.BytesIO()
+
+    with tarfile.open(fileobj=f, mode='w') as tar:
+        for entry in source_tree:
+            content = entry["content"].encode("utf-8")
+            tarinfo = tarfile.TarInfo(name=entry["file_path"])
+            tarinfo.size = len(content)
+            tar.addfile(tarinfo, io.BytesIO(content))
+
+        for res in resources:
+            tar.add(res.file.path, arcname=res.dest_path)
+
+    f.seek(0)
+    return f
+
+
 def download_artifacts(url, save_root_dir):
+    """Extracts the artifacts tar while it is being downloaded.
+
+    Asks for a zstd (or gzip) compressed archive; builders that ignore the
+    compression parameter send a plain tar, which is detected as well.
+    """
     # todo: get rid of hardcoded subfolder names
     artifacts_folder = "artifacts"
     subfolder_name, subfolder_path = create_unique_subfolder(save_root_dir)
-    full_save_path = os.path.join(subfolder_path, artifacts_folder)
 
-    response = requests.get(url)
-    if response:
-        fileobj = io.BytesIO(response.content)
-        with tarfile.open(fileobj=fileobj, mode="r") as tar:
-            # expects tar to contain "artifacts" folder
-            tar.extractall(path=subfolder_path)
-            return os.path.join(subfolder_name, artifacts_folder)
-    raise Exception(f'Bad status code: {response.status_code}. Response: {response.json()}')
+    compression = "gzip" if zstandard is None else "zstd"
+    with requests.get(url, params=dict(compression=compression), stream=True) as response:
+        if not response:
+            raise Exception(f'Bad status code: {response.status_code}. Response: {response.text}')
+
+        response.raw.decode_content = True
+        fileobj = response.raw
+        if response.headers.get("Content-Type") == "application/zstd":
+            fileobj = zstandard.ZstdDecompressor().stream_reader(response.raw)
+
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+                # expects tar to contain "artifacts" folder
+                tar.extractall(path=subfolder_path, filter="data")
+        except Exception:
+            shutil.rmtree(subfolder_path, ignore_errors=True)
+            raise
+
+    return os.path.join(subfolder_name, artifacts_folder)
 
 
 def save_artifacts_with_resources(root_folder: str, artifacts: Dict[str, str], resources) -> str:
@@ -581,11 +958,11 @@ def save_resource(root, resource):
     shutil.copyfile(resource.file.path, full_dest_path)
 
 
-def post_json(url, data):
+def post_json(url, data, timeout=None):
     headers = {
         'Content-type': 'application/json'
     }
-    response = requests.post(url, data=json.dumps(data), headers=headers)
+    response = requests.post(url, data=json.dumps(data), headers=headers, timeout=timeout)
     if response:
         return response.json()
     raise Exception(f'Bad status code: {response.status_code}. Response: {response.json()}')
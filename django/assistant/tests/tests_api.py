@@ -1,10 +1,27 @@
-from io import BytesIO
+import json
+from io import BytesIO, StringIO
+from datetime import timedelta
+from contextlib import redirect_stdout
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from rest_framework.test import APITestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from assistant.tests import utils
-from assistant.models import Generation, Chat
+from assistant.models import (
+    Generation, GenerationMetadata, Chat, Modality, MultimediaMessage, Revision, Server,
+    OperationSuite, Build, DeletedObject
+)
+from assistant.serializers import MultimediaMessageSerializer
+from assistant import tree_cache
+from assistant import profiling
+from assistant import sync
 
 
 class ModalityOrderingTests(APITestCase):
@@ -382,6 +399,627 @@ class GenerationCreationTests(APITestCase):
         self.assertEqual(response.data['chat'], self.chat_id)
 
 
+class RevisionDiffTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+        self.first = self.add_revision([
+            {"file_path": "main.js", "content": "a\nb\nc\n"},
+            {"file_path": "style.css", "content": "body {}\n"},
+        ])
+        self.second = self.add_revision([
+            {"file_path": "main.js", "content": "a\nB\nc\n"},
+            {"file_path": "style.css", "deleted": True},
+            {"file_path": "utils.js", "content": "x\n"},
+        ], parent=self.first.message)
+
+    def add_revision(self, src_tree, parent=None):
+        content = Modality.objects.create(modality_type="text", text="")
+        chat_id = None if parent else self.chat_id
+        message = MultimediaMessage.objects.create(role="assistant", content=content,
+                                                   parent=parent, chat_id=chat_id)
+        return Revision.objects.create(message=message, src_tree=src_tree)
+
+    def get_diff(self, revision, **params):
+        return self.client.get(reverse('revision-diff', args=[revision.id]), params)
+
+    def test_diff_with_previous_revision(self):
+        response = self.get_diff(self.second)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.first.id, response.data["base"])
+
+        files = {entry["file_path"]: entry for entry in response.data["files"]}
+        self.assertEqual(["main.js", "utils.js", "style.css"], list(files))
+        self.assertEqual("modified", files["main.js"]["status"])
+        self.assertIn("-b\n+B\n", files["main.js"]["delta"])
+        self.assertEqual("added", files["utils.js"]["status"])
+        self.assertEqual("removed", files["style.css"]["status"])
+
+    def test_diff_in_ranges_format_against_explicit_base(self):
+        response = self.get_diff(self.first, base=self.second.id, delta="ranges")
+        self.assertEqual(200, response.status_code)
+
+        files = {entry["file_path"]: entry for entry in response.data["files"]}
+        self.assertEqual([dict(start=1, end=2, lines=["b"])], files["main.js"]["delta"])
+        self.assertEqual([dict(start=0, end=0, lines=["body {}"])], files["style.css"]["delta"])
+        self.assertEqual("removed", files["utils.js"]["status"])
+
+    def test_first_revision_is_diffed_against_empty_tree(self):
+        response = self.get_diff(self.first)
+        self.assertIsNone(response.data["base"])
+        self.assertEqual(["added", "added"], [entry["status"] for entry in response.data["files"]])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(400, self.get_diff(self.second, base=9999).status_code)
+        self.assertEqual(400, self.get_diff(self.second, delta="html").status_code)
+
+    def test_chat_revisions_with_changes_only(self):
+        url = reverse('chat-revisions', args=[self.chat_id])
+        response = self.client.get(url, {"changes_only": "1"})
+        self.assertEqual(200, response.status_code)
+
+        revisions = {revision["id"]: revision for revision in response.data}
+        self.assertNotIn("src_tree", revisions[self.second.id])
+        self.assertEqual(3, len(revisions[self.second.id]["changes"]))
+        self.assertEqual(2, len(revisions[self.first.id]["changes"]))
+
+    def test_changes_only_takes_constant_number_of_queries(self):
+        url = reverse('chat-revisions', args=[self.chat_id])
+        parent = self.second.message
+        for i in range(2):
+            for j in range(5):
+                revision = self.add_revision([{"file_path": f"file{j}.js", "content": f"{i}\n"}], parent=parent)
+                parent = revision.message
+            Chat.objects.get(pk=self.chat_id).update_active_path()
+            with self.assertNumQueries(9):  # builds and saves missing snapshots
+                self.client.get(url, {"changes_only": "1"})
+
+            with self.assertNumQueries(8):
+                response = self.client.get(url, {"changes_only": "1"})
+            self.assertEqual(2 + 5 * (i + 1), len(response.data))
+
+        changes = {revision["id"]: revision["changes"] for revision in response.data}
+        self.assertEqual(changes[revision.id], [
+            dict(file_path="file4.js", status="modified", delta="--- a/file4.js\n+++ b/file4.js\n@@ -1 +1 @@\n-0\n+1\n")
+        ])
+
+
+class MessageTreeSerializationTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+        self.root_id = self.add_message("Make an app", chat_id=self.chat_id)
+
+    def add_message(self, text, role="user", file_path=None, **kwargs):
+        mixture_id = utils.create_mixed_modality(self.client, layout_type="vertical").data["id"]
+        utils.create_text_modality(self.client, text=text, parent=mixture_id)
+        src_tree = None
+        if file_path:
+            utils.create_code_modality(self.client, file_path=file_path, parent=mixture_id)
+            src_tree = [{"file_path": file_path, "content": f"// {text}"}]
+        response = utils.create_message(self.client, mixture_id, role=role, src_tree=src_tree, **kwargs)
+        return response.data["id"]
+
+    def add_branches(self, parent_id, depth, width):
+        if depth == 0:
+            return
+        for i in range(width):
+            role = "assistant" if depth % 2 else "user"
+            message_id = self.add_message(f"reply {depth}.{i}", role=role, file_path=f"file{i}.js",
+                                          parent_id=parent_id)
+            self.add_branches(message_id, depth - 1, width)
+
+    def get_tree(self):
+        url = reverse('multimediamessage-detail', args=[self.root_id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return response.json(), len(queries)
+
+    def test_output_matches_recursive_serialization(self):
+        self.add_branches(self.root_id, depth=3, width=2)
+        server = Server.objects.first()
+        for model_name in ("first", "second"):
+            metadata = GenerationMetadata.objects.create(server=server, model_name=model_name)
+            Generation.objects.create(task_id=model_name, message_id=self.root_id,
+                                      generation_metadata=metadata)
+
+        data, _ = self.get_tree()
+        request = APIRequestFactory().get(reverse('multimediamessage-detail', args=[self.root_id]))
+        root = MultimediaMessage.objects.get(pk=self.root_id)
+        expected = MultimediaMessageSerializer(root, context={'request': Request(request)}).data
+        self.assertEqual(json.loads(json.dumps(expected)), data)
+        # metadata of replies comes from the generation selected by the parent's child_index
+        self.assertEqual("second", data["replies"][0]["metadata"]["model_name"])
+
+    def test_number_of_queries_does_not_grow_with_tree_size(self):
+        self.add_branches(self.root_id, depth=1, width=1)
+        _, small_tree_queries = self.get_tree()
+
+        self.add_branches(self.root_id, depth=4, width=2)
+        _, large_tree_queries = self.get_tree()
+        self.assertEqual(small_tree_queries, large_tree_queries)
+
+
+@override_settings(SYNC_RESCAN_WINDOW=0)
+class ChatSyncTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+        self.url = reverse('chat-sync', args=[self.chat_id])
+        modality_id = utils.create_text_modality(self.client, text="Make an app").data["id"]
+        self.root_id = utils.create_message(self.client, modality_id, chat_id=self.chat_id).data["id"]
+
+    def add_reply(self):
+        mixture_id = utils.create_mixed_modality(self.client, layout_type="vertical").data["id"]
+        text_id = utils.create_text_modality(self.client, text="Done", parent=mixture_id).data["id"]
+        code_id = utils.create_code_modality(self.client, file_path="main.js", parent=mixture_id).data["id"]
+        response = utils.create_message(self.client, mixture_id, parent_id=self.root_id, role="assistant",
+                                        src_tree=[{"file_path": "main.js", "content": "x = 1"}])
+        return response.data["id"], {mixture_id, text_id, code_id}
+
+    def test_full_sync_then_incremental(self):
+        response = self.client.get(self.url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.root_id], [message["id"] for message in response.data["messages"]])
+        self.assertEqual(1, len(response.data["modalities"]))
+        cursor = response.data["cursor"]
+
+        response = self.client.get(self.url, {"since": cursor})
+        self.assertEqual(cursor, response.data["cursor"])
+        for kind in ("messages", "modalities", "revisions", "generations"):
+            self.assertEqual([], response.data[kind])
+
+        reply_id, modality_ids = self.add_reply()
+        response = self.client.get(self.url, {"since": cursor})
+        messages = {message["id"]: message for message in response.data["messages"]}
+        # the parent is updated too since its child_index changed
+        self.assertEqual({self.root_id, reply_id}, set(messages))
+        self.assertEqual(self.root_id, messages[reply_id]["parent"])
+        self.assertTrue(modality_ids <= {modality["id"] for modality in response.data["modalities"]})
+        revision, = response.data["revisions"]
+        self.assertEqual([{"file_path": "main.js", "content": "x = 1"}], revision["src_tree"])
+        self.assertGreater(int(response.data["cursor"]), int(cursor))
+
+        response = self.client.get(self.url, {"since": response.data["cursor"]})
+        self.assertEqual([], response.data["messages"])
+
+    def test_other_chats_are_not_included(self):
+        response = self.client.get(self.url)
+        other_chat = Chat.objects.create(name="Other", configuration=Chat.objects.get(pk=self.chat_id).configuration)
+        modality_id = utils.create_text_modality(self.client, text="Hi").data["id"]
+        utils.create_message(self.client, modality_id, chat_id=other_chat.id)
+
+        response = self.client.get(self.url, {"since": response.data["cursor"]})
+        self.assertEqual([], response.data["messages"])
+        self.assertEqual([], response.data["modalities"])
+
+    def test_modalities_created_before_the_cursor_are_sent_with_their_message(self):
+        modality_id = utils.create_text_modality(self.client, text="Written offline").data["id"]
+        cursor = self.client.get(self.url).data["cursor"]
+        MultimediaMessage.objects.filter(pk=self.root_id).update(updated=timezone.now())
+        cursor = self.client.get(self.url, {"since": cursor}).data["cursor"]
+
+        reply_id = utils.create_message(self.client, modality_id, parent_id=self.root_id).data["id"]
+        response = self.client.get(self.url, {"since": cursor})
+        self.assertIn(reply_id, [message["id"] for message in response.data["messages"]])
+        self.assertIn(modality_id, [modality["id"] for modality in response.data["modalities"]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(400, self.client.get(self.url, {"since": "yesterday"}).status_code)
+
+    def test_rows_committed_after_the_cursor_are_rescanned(self):
+        cursor = self.client.get(self.url).data["cursor"]
+        reply_id, modality_ids = self.add_reply()
+        # saved before the cursor was issued, committed after it
+        late = sync.decode_cursor(cursor) - timedelta(seconds=1)
+        MultimediaMessage.objects.filter(pk=reply_id).update(updated=late)
+
+        with override_settings(SYNC_RESCAN_WINDOW=5):
+            response = self.client.get(self.url, {"since": cursor})
+            self.assertIn(reply_id, [message["id"] for message in response.data["messages"]])
+            self.assertTrue(modality_ids <= {modality["id"] for modality in response.data["modalities"]})
+            self.assertEqual(self.client.get(self.url, {"since": "0"}).status_code, 200)
+
+        response = self.client.get(self.url, {"since": cursor})
+        self.assertNotIn(reply_id, [message["id"] for message in response.data["messages"]])
+
+    def test_deleted_objects_are_reported(self):
+        reply_id, modality_ids = self.add_reply()
+        revision_id = Revision.objects.get(message_id=reply_id).pk
+        response = self.client.get(self.url)
+        self.assertEqual(dict(messages=[], modalities=[], revisions=[], generations=[]), response.data["deleted"])
+        cursor = response.data["cursor"]
+
+        self.assertEqual(204, self.client.delete(reverse('multimediamessage-detail', args=[reply_id])).status_code)
+        response = self.client.get(self.url, {"since": cursor})
+        self.assertEqual([reply_id], response.data["deleted"]["messages"])
+        self.assertEqual([revision_id], response.data["deleted"]["revisions"])
+        self.assertGreater(int(response.data["cursor"]), int(cursor))
+
+        response = self.client.get(self.url, {"since": response.data["cursor"]})
+        self.assertEqual([], response.data["deleted"]["messages"])
+
+    def test_tombstones_are_removed_with_their_chat(self):
+        reply_id, _ = self.add_reply()
+        MultimediaMessage.objects.get(pk=reply_id).delete()
+        self.assertTrue(DeletedObject.objects.filter(chat_id=self.chat_id).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Chat.objects.get(pk=self.chat_id).delete()
+        self.assertFalse(DeletedObject.objects.filter(chat_id=self.chat_id).exists())
+
+
+class ChatGenerationsTests(APITestCase):
+    def test_generations_of_all_messages_in_one_query(self):
+        chat_id = utils.create_default_chat(self.client)
+        modality_id = utils.create_text_modality(self.client, text="Make an app").data["id"]
+        message_id = utils.create_message(self.client, modality_id, chat_id=chat_id).data["id"]
+        for i in range(3):
+            modality_id = utils.create_text_modality(self.client, text="Reply").data["id"]
+            message_id = utils.create_message(self.client, modality_id, parent_id=message_id).data["id"]
+            Generation.objects.create(task_id=f"message {i}", message_id=message_id, finished=True)
+        Generation.objects.create(task_id="title", chat_id=chat_id)
+
+        url = reverse('chat-generations', args=[chat_id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"status": "finished"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["message 0", "message 1", "message 2"], [g["task_id"] for g in response.data])
+        self.assertEqual(2, len(queries))
+
+
+class ChatSearchTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+        self.configuration = Chat.objects.get(pk=self.chat_id).configuration
+        self.url = reverse('chat-list')
+
+    def add_chat(self, name, text, src_tree=None):
+        chat = Chat.objects.create(name=name, configuration=self.configuration)
+        if src_tree:
+            modality_id = utils.create_mixed_modality(self.client, layout_type="vertical").data["id"]
+            utils.create_text_modality(self.client, text=text, parent=modality_id)
+            for entry in src_tree:
+                utils.create_code_modality(self.client, file_path=entry["file_path"], parent=modality_id)
+        else:
+            modality_id = utils.create_text_modality(self.client, text=text).data["id"]
+        response = utils.create_message(self.client, modality_id, chat_id=chat.id, src_tree=src_tree)
+        self.assertEqual(201, response.status_code)
+        return chat.id
+
+    def search(self, term, **params):
+        response = self.client.get(self.url, dict(term=term, **params))
+        self.assertEqual(200, response.status_code)
+        return [chat["id"] for chat in response.data["results"]]
+
+    def test_matches_names_texts_and_files(self):
+        by_name = self.add_chat("Weather widget", "Hello")
+        by_text = self.add_chat("Untitled", "Show the weather forecast")
+        by_path = self.add_chat("Files", "Hi", src_tree=[{"file_path": "src/Weather.js", "content": "x"}])
+        by_code = self.add_chat("Code", "Hi", src_tree=[{"file_path": "App.js", "content": "fetchWeather()"}])
+        self.add_chat("Calculator", "Add numbers")
+
+        self.assertEqual({by_name, by_text, by_path}, set(self.search("weather")))
+        self.assertEqual([by_code], self.search("fetchWeather"))
+        self.assertEqual([by_text], self.search("weather fore"))
+
+    def test_names_rank_above_texts(self):
+        by_text = self.add_chat("Untitled", "A clock app, with a clock face and more")
+        by_name = self.add_chat("Clock", "Hello")
+        self.assertEqual([by_name, by_text], self.search("clock"))
+        self.assertEqual([by_name, by_text], self.search("clock", sortby="newest"))
+        self.assertEqual([by_text, by_name], self.search("clock", sortby="oldest"))
+
+    def test_index_follows_edits(self):
+        chat_id = self.add_chat("Untitled", "Old text")
+        modality = Modality.objects.get(content_message__chat_id=chat_id)
+        modality.text = "New text"
+        modality.save()
+        self.assertEqual([], self.search("old"))
+        self.assertEqual([chat_id], self.search("new"))
+
+        chat = Chat.objects.get(pk=chat_id)
+        chat.name = "Renamed"
+        chat.save()
+        self.assertEqual([chat_id], self.search("renamed"))
+
+    def test_deleted_objects_stop_matching(self):
+        chat_id = self.add_chat("Untitled", "Draw a rocket",
+                                src_tree=[{"file_path": "Rocket.js", "content": "launch()"}])
+        other_id = self.add_chat("Untitled", "Draw a planet")
+        self.assertEqual([chat_id], self.search("launch"))
+
+        MultimediaMessage.objects.get(chat_id=chat_id).delete()
+        self.assertEqual([], self.search("rocket"))
+        self.assertEqual([], self.search("launch"))
+
+        Modality.objects.get(content_message__chat_id=other_id).delete()
+        self.assertEqual([], self.search("planet"))
+
+        Chat.objects.filter(pk=chat_id).delete()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM assistant_search_index WHERE chat_id = %s", [chat_id])
+            self.assertEqual(0, cursor.fetchone()[0])
+
+    def test_results_are_paginated_and_filtered(self):
+        ids = [self.add_chat(f"Todo {i}", "Hi") for i in range(10)]
+        response = self.client.get(self.url, {"term": "todo", "page": 2})
+        self.assertEqual(10, response.data["count"])
+        self.assertEqual(2, len(response.data["results"]))
+
+        code_id = self.add_chat("Todo app", "Hi", src_tree=[{"file_path": "App.js", "content": "x"}])
+        self.assertEqual([code_id], self.search("todo", filter="withCode"))
+        self.assertEqual(set(ids), set(self.search("todo", filter="noCode", page_size=20)))
+
+    def test_rebuild_search_index(self):
+        chat_id = self.add_chat("Untitled", "Make a game", src_tree=[{"file_path": "game.js", "content": "x"}])
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM assistant_search_index")
+        self.assertEqual([], self.search("game"))
+
+        out = StringIO()
+        call_command("rebuild_search_index", batch_size=1, stdout=out)
+        self.assertEqual([chat_id], self.search("game"))
+        self.assertIn('Indexed "2" out of "2" chats', out.getvalue())
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        chat_id = utils.create_default_chat(self.client)
+        configuration = Chat.objects.get(pk=chat_id).configuration
+        created = Chat.objects.get(pk=chat_id).created
+        for i in range(4):
+            Chat.objects.create(name=f"Chat {i}", configuration=configuration)
+        # rows with equal timestamps are ordered by id
+        Chat.objects.update(created=created)
+        self.ids = list(Chat.objects.order_by('-id').values_list('id', flat=True))
+        self.configuration = configuration
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(200, response.status_code)
+        return [item["id"] for item in response.data["results"]], response.data
+
+    def test_pages_follow_cursors(self):
+        url = reverse('chat-list')
+        first, data = self.get_page(url, page_size=2)
+        self.assertEqual(self.ids[:2], first)
+        self.assertIsNone(data["links"]["previous"])
+        self.assertIsNone(data["count"])
+
+        # a new chat does not shift the following pages
+        Chat.objects.create(name="New chat", configuration=self.configuration)
+        second, data = self.get_page(data["links"]["next"])
+        self.assertEqual(self.ids[2:4], second)
+        third, data = self.get_page(data["links"]["next"])
+        self.assertEqual(self.ids[4:], third)
+        self.assertIsNone(data["links"]["next"])
+
+        previous, data = self.get_page(data["links"]["previous"])
+        self.assertEqual(self.ids[2:4], previous)
+
+    def test_oldest_first(self):
+        ids, data = self.get_page(reverse('chat-list'), sortby="oldest", page_size=3)
+        self.assertEqual(list(reversed(self.ids))[:3], ids)
+        ids, data = self.get_page(data["links"]["next"])
+        self.assertEqual(list(reversed(self.ids))[3:], ids)
+
+    def test_count_is_cached(self):
+        url = reverse('chat-list')
+        self.assertEqual(5, self.get_page(url, with_count=1)[1]["count"])
+        Chat.objects.create(name="New chat", configuration=self.configuration)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(5, self.get_page(url, with_count=1)[1]["count"])
+        self.assertFalse(any("COUNT" in query["sql"] for query in queries.captured_queries))
+
+    def test_page_numbers_are_still_supported(self):
+        response = self.client.get(reverse('chat-list'), {"page": 1})
+        self.assertEqual(5, response.data["count"])
+        self.assertEqual(1, response.data["num_pages"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('chat-list'), {"cursor": "nonsense"})
+        self.assertEqual(400, response.status_code)
+
+    def test_generations_are_paginated(self):
+        ids = [Generation.objects.create(task_id=f"task {i}").id for i in range(3)]
+        url = reverse('generation-list')
+        first, data = self.get_page(url, page_size=2)
+        self.assertEqual([ids[2], ids[1]], first)
+        second, data = self.get_page(data["links"]["next"])
+        self.assertEqual([ids[0]], second)
+
+
+class ChatVersionETagTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+        modality_id = utils.create_text_modality(self.client, text="Make an app").data["id"]
+        self.message_id = utils.create_message(self.client, modality_id, chat_id=self.chat_id).data["id"]
+        self.chat_url = reverse('chat-detail', args=[self.chat_id])
+        self.message_url = reverse('multimediamessage-detail', args=[self.message_id])
+
+    def get(self, url, etag):
+        return self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_unchanged_chat_answers_not_modified_with_one_query(self):
+        for url in (self.chat_url, self.message_url, reverse('chat-revisions', args=[self.chat_id])):
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            etag = response["ETag"]
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(url, etag)
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(etag, response["ETag"])
+            self.assertLessEqual(len(queries), 1)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get(self.message_url)["ETag"]
+
+        modality = Modality.objects.get(content_message__id=self.message_id)
+        modality.text = "Make a game"
+        modality.save()
+        response = self.get(self.message_url, etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Make a game", response.data["content_ro"]["text"])
+        etag = response["ETag"]
+
+        modality_id = utils.create_text_modality(self.client, text="Reply").data["id"]
+        utils.create_message(self.client, modality_id, parent_id=self.message_id)
+        self.assertEqual(200, self.get(self.message_url, etag).status_code)
+        etag = self.client.get(self.chat_url)["ETag"]
+
+        Generation.objects.create(task_id="title", chat_id=self.chat_id)
+        self.assertEqual(200, self.get(self.chat_url, etag).status_code)
+
+    def test_stale_chat_copies_do_not_reset_the_version(self):
+        chat = Chat.objects.get(pk=self.chat_id)
+        etag = self.client.get(self.chat_url)["ETag"]
+        Generation.objects.create(task_id="title", chat_id=self.chat_id)
+        chat.description = "Edited"
+        chat.save()
+        response = self.get(self.chat_url, etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Edited", response.data["description"])
+
+    def test_operation_suite_etag_follows_operations(self):
+        modality_id = utils.create_mixed_modality(self.client, layout_type="vertical").data["id"]
+        utils.create_code_modality(self.client, file_path="main.js", parent=modality_id)
+        message_id = utils.create_message(self.client, modality_id, parent_id=self.message_id, role="assistant",
+                                          src_tree=[{"file_path": "main.js", "content": "x"}]).data["id"]
+        suite = OperationSuite.objects.create(revision=Revision.objects.get(message_id=message_id))
+        url = reverse('operation-suite-detail', args=[suite.id])
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(304, self.get(url, etag).status_code)
+
+        build = Build.objects.create(operation_suite=suite)
+        self.assertEqual(200, self.get(url, etag).status_code)
+        etag = self.client.get(url)["ETag"]
+        build.finished = True
+        build.save()
+        self.assertEqual(200, self.get(url, etag).status_code)
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "trees": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tree-cache-tests"}
+})
+class TreeCacheTests(APITestCase):
+    def setUp(self):
+        tree_cache.get_cache().clear()
+        self.chat_id = utils.create_default_chat(self.client)
+        modality_id = utils.create_text_modality(self.client, text="Make an app").data["id"]
+        self.root_id = utils.create_message(self.client, modality_id, chat_id=self.chat_id).data["id"]
+        self.replies = []
+        for text in ["First", "Second"]:
+            modality_id = utils.create_text_modality(self.client, text=text).data["id"]
+            self.replies.append(utils.create_message(self.client, modality_id, parent_id=self.root_id,
+                                                     role="assistant").data["id"])
+        modality_id = utils.create_text_modality(self.client, text="Nested").data["id"]
+        self.nested_id = utils.create_message(self.client, modality_id, parent_id=self.replies[0]).data["id"]
+        self.url = reverse('multimediamessage-detail', args=[self.root_id])
+
+    def is_cached(self, message_id):
+        return tree_cache.get_cache().get(tree_cache.message_key(message_id)) is not None
+
+    def test_hits_run_no_queries(self):
+        expected = self.client.get(self.url).data
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(0, len(queries))
+        self.assertEqual(json.loads(json.dumps(expected)), json.loads(json.dumps(response.data)))
+
+        stats = self.client.get(reverse('tree-cache-stats')).data
+        self.assertEqual(1, stats["rebuilds"])
+        self.assertGreater(stats["hit_ratio"], 0)
+
+    def test_writes_invalidate_ancestors_only(self):
+        self.client.get(self.url)
+        self.assertTrue(all(map(self.is_cached, [self.root_id, self.nested_id] + self.replies)))
+
+        modality = Modality.objects.get(content_message__id=self.nested_id)
+        modality.text = "Edited"
+        modality.save()
+        self.assertFalse(any(map(self.is_cached, [self.root_id, self.replies[0], self.nested_id])))
+        self.assertTrue(self.is_cached(self.replies[1]))
+
+        response = self.client.get(self.url)
+        nested = response.data["replies"][0]["replies"][0]
+        self.assertEqual("Edited", nested["content_ro"]["text"])
+
+        Revision.objects.create(message_id=self.replies[1], src_tree=[])
+        self.assertFalse(self.is_cached(self.root_id))
+        self.assertTrue(self.is_cached(self.replies[0]))
+        self.assertEqual(1, len(self.client.get(self.url).data["replies"][1]["revisions"]))
+
+    def test_lite_variant(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {"lite": "true"})
+        self.assertNotIn("replies", response.data)
+        self.assertIn("replies", self.client.get(self.url).data)
+
+    def test_switching_branches_invalidates_reply_metadata(self):
+        server = Server.objects.first()
+        for model_name in ("first", "second"):
+            metadata = GenerationMetadata.objects.create(server=server, model_name=model_name)
+            Generation.objects.create(task_id=model_name, message_id=self.root_id,
+                                      generation_metadata=metadata)
+        reply_url = reverse('multimediamessage-detail', args=[self.replies[0]])
+        self.assertEqual("second", self.client.get(reply_url).data["metadata"]["model_name"])
+        self.assertTrue(self.is_cached(self.replies[0]))
+
+        response = self.client.patch(self.url, {"child_index": 0}, format='json')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(self.is_cached(self.replies[0]))
+        self.assertEqual("first", self.client.get(reply_url).data["metadata"]["model_name"])
+
+    def test_system_message_is_invalidated_by_configuration_writes(self):
+        chat = Chat.objects.get(pk=self.chat_id)
+        configuration = chat.configuration
+        configuration.system_message = "Old"
+        configuration.save()
+        self.assertEqual("Old", tree_cache.get_system_message(chat))
+
+        configuration.system_message = "New"
+        configuration.save()
+        chat = Chat.objects.get(pk=self.chat_id)
+        self.assertEqual("New", tree_cache.get_system_message(chat))
+
+
+class RequestProfilerTests(APITestCase):
+    def setUp(self):
+        self.chat_id = utils.create_default_chat(self.client)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('chat-list'))
+        self.assertRegex(response["Server-Timing"],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", ser;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_requests_are_grouped_by_view_and_action(self):
+        self.client.get(reverse('chat-list'))
+        self.client.get(reverse('chat-detail', args=[self.chat_id]))
+        stats = self.client.get(reverse('profiler-stats')).data
+        self.assertIn("ChatViewSet.list", stats)
+        self.assertIn("ChatViewSet.retrieve", stats)
+        self.assertGreater(stats["ChatViewSet.list"]["max_queries"], 0)
+
+    @override_settings(QUERY_BUDGETS={"ChatViewSet.list": 0})
+    def test_exceeded_budget_fails(self):
+        with self.assertRaises(profiling.QueryBudgetExceeded):
+            self.client.get(reverse('chat-list'))
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_reported_with_repeated_queries(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            self.client.get(reverse('chat-list'))
+        self.assertIn("Slow request GET /api/chats/ (ChatViewSet.list)", out.getvalue())
+
+    def test_fingerprints_collapse_literals_and_lists(self):
+        self.assertEqual(
+            'SELECT "id" FROM "chat" WHERE "id" IN (...) AND "name" = ? LIMIT ?',
+            profiling.get_fingerprint('SELECT "id" FROM "chat" WHERE "id" IN (%s, %s, %s) AND "name" = \'x\' LIMIT 21')
+        )
+
+
 def exclude_field(mapping, field):
     mapping = dict(mapping)
     del mapping[field]
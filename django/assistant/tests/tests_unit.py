@@ -1,8 +1,22 @@
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
 import unittest
-from unittest.mock import Mock
-from django.test import TestCase
+import threading
+import requests
+from unittest.mock import Mock, MagicMock, patch, ANY
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
 from rest_framework.test import APITestCase
-from assistant.models import Chat, MultimediaMessage, Modality, Revision
+from assistant.models import (
+    Chat, Configuration, MultimediaMessage, Modality, Revision, FileBlob, OperationSuite, Build, LinterCheck,
+    Server, reduce_source_tree
+)
 from assistant.tests.utils import create_default_chat, create_message, create_text_modality
 from assistant.utils import (
     process_raw_message, prepare_messages, convert_modality, MessageSegment,
@@ -764,3 +778,547 @@ class PrepareMessagesTests(TestCase):
         result_with_system = prepare_messages([], system_message=system_message)
         expected_with_system = [{"role": "system", "content": system_message}]
         self.assertEqual(result_with_system, expected_with_system)
+
+
+def make_response(status_code=200, json_data=None, lines=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.__bool__.return_value = status_code < 400
+    response.json.return_value = json_data
+    response.iter_lines.return_value = lines or []
+    response.__enter__.return_value = response
+    return response
+
+
+class RunBuildJobTests(TestCase):
+    source_tree = [{"file_path": "main.js", "content": "console.log(1);"}]
+
+    def finished_job(self, status="finished", result=None, error=None):
+        return json.dumps(dict(job_id="abc", status=status, result=result, error=error))
+
+    @patch("assistant.tasks.requests")
+    def test_forwards_log_lines_and_returns_result(self, requests_mock):
+        from assistant.tasks import run_build_job
+        result = dict(success=True, stdout="compiled successfully", stderr="", build_id="b1")
+        lines = [
+            json.dumps(dict(stream="stdout", text="10% building")),
+            "",
+            json.dumps(dict(stream="stderr", text="warning")),
+            self.finished_job(result=result)
+        ]
+        requests_mock.post.return_value = make_response(202, dict(job_id="abc", status="queued"))
+        requests_mock.get.return_value = make_response(lines=lines)
+
+        on_log = Mock()
+        self.assertEqual(run_build_job("http://builder", self.source_tree, [], on_log), result)
+
+        self.assertEqual(requests_mock.post.call_args[0][0], "http://builder/jobs/")
+        self.assertEqual(requests_mock.get.call_args[0][0], "http://builder/jobs/abc/logs/")
+        self.assertEqual(on_log.call_args_list, [(("stdout", "10% building"),), (("stderr", "warning"),)])
+
+    @patch("assistant.tasks.requests")
+    def test_raises_when_job_failed(self, requests_mock):
+        from assistant.tasks import run_build_job
+        requests_mock.post.return_value = make_response(202, dict(job_id="abc", status="queued"))
+        requests_mock.get.return_value = make_response(lines=[self.finished_job("failed", error="boom")])
+
+        with self.assertRaises(Exception):
+            run_build_job("http://builder", self.source_tree, [], Mock())
+
+    @patch("assistant.tasks.requests")
+    def test_falls_back_to_blocking_endpoint(self, requests_mock):
+        from assistant.tasks import run_build_job
+        result = dict(success=True, stdout="", stderr="", build_id="b1")
+        requests_mock.post.side_effect = [make_response(404), make_response(200, result)]
+
+        self.assertEqual(run_build_job("http://builder", self.source_tree, [], Mock()), result)
+        self.assertEqual(requests_mock.post.call_args[0][0], "http://builder/build-spa/")
+        requests_mock.get.assert_not_called()
+
+    @patch("assistant.tasks.requests")
+    def test_uploads_only_missing_resource_blobs(self, requests_mock):
+        from assistant.tasks import upload_resources
+        resources = []
+        hashes = []
+        for content in [b"first image", b"second image"]:
+            f = tempfile.NamedTemporaryFile(delete=False)
+            f.write(content)
+            f.close()
+            self.addCleanup(os.remove, f.name)
+            resources.append(Mock(dest_path=f"static/{len(resources)}.png", file=Mock(path=f.name)))
+            hashes.append(hashlib.sha256(content).hexdigest())
+
+        requests_mock.post.return_value = make_response(200, dict(missing=[hashes[1]]))
+        requests_mock.put.return_value = make_response(201)
+
+        manifest = upload_resources("http://builder", resources)
+
+        self.assertEqual(manifest, [dict(path="static/0.png", sha256=hashes[0]),
+                                    dict(path="static/1.png", sha256=hashes[1])])
+        self.assertEqual(requests_mock.post.call_args[1]["json"], dict(hashes=hashes))
+        requests_mock.put.assert_called_once()
+        self.assertEqual(requests_mock.put.call_args[0][0], f"http://builder/blobs/{hashes[1]}/")
+
+
+class FindBaseBuildTests(APITestCase):
+    def setUp(self):
+        chat_id = create_default_chat(self.client)
+        self.root = self.create_message("Make an app", chat_id=chat_id)
+        self.reply = self.create_message("Here it is", parent_id=self.root.id)
+        self.other_reply = self.create_message("Another one", parent_id=self.root.id)
+
+    def create_message(self, text, chat_id=None, parent_id=None):
+        mod_id = create_text_modality(self.client, text=text).data['id']
+        msg_data = create_message(
+            self.client, modality_id=mod_id, chat_id=chat_id, parent_id=parent_id, role="user"
+        ).data
+        return MultimediaMessage.objects.get(id=msg_data['id'])
+
+    def create_build(self, message, success=True, builder_build_id="a" * 32):
+        revision = Revision.objects.create(message=message, src_tree=[])
+        suite = OperationSuite.objects.create(revision=revision)
+        build = Build.objects.create(operation_suite=suite, success=success, finished=True,
+                                     builder_build_id=builder_build_id)
+        return revision, build
+
+    def test_no_builds(self):
+        from assistant.tasks import find_base_build
+        revision = Revision.objects.create(message=self.reply, src_tree=[])
+        self.assertIsNone(find_base_build(revision))
+
+    def test_uses_latest_successful_build_from_history(self):
+        from assistant.tasks import find_base_build
+        _, root_build = self.create_build(self.root)
+        self.create_build(self.root, success=False)
+        self.create_build(self.other_reply, builder_build_id="b" * 32)
+        revision = Revision.objects.create(message=self.reply, src_tree=[])
+
+        self.assertEqual(find_base_build(revision), root_build)
+
+        _, reply_build = self.create_build(self.reply, builder_build_id="c" * 32)
+        self.assertEqual(find_base_build(revision), reply_build)
+
+
+class CollectArtifactsTests(APITestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        chat_id = create_default_chat(self.client)
+        mod_id = create_text_modality(self.client, text="Make an app").data['id']
+        msg_id = create_message(self.client, modality_id=mod_id, chat_id=chat_id, role="user").data['id']
+        self.revision = Revision.objects.create(message_id=msg_id, src_tree=[])
+        self.suite = OperationSuite.objects.create(revision=self.revision)
+
+    def create_build(self, name, success=True, content=b"bundle" * 1000):
+        folder = os.path.join(self.root, name, "artifacts")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "main.bundle.js"), "wb") as f:
+            f.write(content)
+        return Build.objects.create(operation_suite=self.suite, success=success, finished=True,
+                                    url=f"/artifacts/{name}/artifacts/index.html")
+
+    def test_keeps_newest_successful_builds_of_revision(self):
+        from assistant.retention import collect_artifacts
+        oldest = self.create_build("b1")
+        failed = self.create_build("b2", success=False)
+        second = self.create_build("b3")
+        newest = self.create_build("b4")
+
+        with override_settings(ARTIFACTS_KEEP_PER_REVISION=2):
+            stats = collect_artifacts(self.root)
+
+        self.assertEqual(stats["expired_builds"], 2)
+        self.assertEqual(sorted(os.listdir(self.root)), ["b3", "b4"])
+        self.assertIsNone(Build.objects.get(pk=oldest.pk).url)
+        self.assertIsNone(Build.objects.get(pk=failed.pk).url)
+        self.assertIsNotNone(Build.objects.get(pk=newest.pk).url)
+
+        # identical bundles of the kept builds share one inode
+        self.assertEqual(stats["deduplicated_files"], 1)
+        st = os.stat(os.path.join(self.root, "b3", "artifacts", "main.bundle.js"))
+        self.assertEqual(st.st_nlink, 2)
+
+    def test_removes_old_orphans_and_evicts_oldest_over_quota(self):
+        from assistant.retention import collect_artifacts
+        os.makedirs(os.path.join(self.root, "orphan"))
+        os.makedirs(os.path.join(self.root, "fresh_orphan"))
+        old = time.time() - 3600
+        os.utime(os.path.join(self.root, "orphan"), (old, old))
+        first = self.create_build("b1", content=os.urandom(4000))
+        self.create_build("b2", content=os.urandom(4000))
+
+        with override_settings(ARTIFACTS_ORPHAN_AGE=60, ARTIFACTS_MAX_BYTES=6000):
+            stats = collect_artifacts(self.root)
+
+        self.assertEqual(stats["removed_orphans"], 1)
+        self.assertEqual(stats["evicted_builds"], 1)
+        self.assertEqual(sorted(os.listdir(self.root)), ["b2", "fresh_orphan"])
+        self.assertIsNone(Build.objects.get(pk=first.pk).url)
+
+    def test_removed_artifacts_change_the_etag(self):
+        from assistant.retention import remove_artifacts
+        build = self.create_build("b1")
+        url = reverse('operation-suite-detail', args=[self.suite.id])
+        etag = self.client.get(url)["ETag"]
+
+        remove_artifacts(self.root, build.id, "b1")
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertIsNone(Build.objects.get(pk=build.pk).url)
+
+
+class BuildRunnerTests(APITestCase):
+    def setUp(self):
+        chat_id = create_default_chat(self.client)
+        mod_id = create_text_modality(self.client, text="Make an app").data['id']
+        msg_id = create_message(self.client, modality_id=mod_id, chat_id=chat_id, role="user").data['id']
+        revision = Revision.objects.create(message_id=msg_id, src_tree=[])
+        self.suite = OperationSuite.objects.create(revision=revision)
+        self.emitter = Mock()
+        self.release_slow = threading.Event()
+        self.addCleanup(self.release_slow.set)
+
+    def make_runner(self):
+        from assistant.tasks import BuildRunner
+        return BuildRunner(self.suite, [], [], self.emitter)
+
+    def fake_build_job(self, server_url, source_tree, resources, on_log, base_build_id=None, cancelled=None):
+        name = server_url.split("//")[1]
+        if name == "slow":
+            self.release_slow.wait(5)
+            raise Exception("cancelled")
+        if name == "broken":
+            raise Exception("Connection refused")
+        return dict(success=name != "failing", stdout="", stderr="", build_id=name,
+                    queued_seconds=0, build_seconds=1)
+
+    def servers(self, *names):
+        return [Mock(url=f"http://{name}") for name in names]
+
+    @patch("assistant.tasks.download_artifacts", return_value="folder/artifacts")
+    def test_race_keeps_first_success_and_cancels_stragglers(self, download_mock):
+        with patch("assistant.tasks.run_build_job", side_effect=self.fake_build_job):
+            winner = self.make_runner().race(self.servers("slow", "failing", "fast"))
+
+        self.assertEqual(winner.server_url, "http://fast")
+        builds = {build.server_url: build for build in self.suite.builds.all()}
+        self.assertEqual(len(builds), 3)
+        self.assertTrue(all(build.finished for build in builds.values()))
+        self.assertTrue(builds["http://fast"].success)
+        self.assertIn("download_seconds", builds["http://fast"].timings)
+        self.assertFalse(builds["http://failing"].success)
+        self.assertFalse(builds["http://slow"].success)
+        self.assertIn("Cancelled", builds["http://slow"].errors[0])
+        download_mock.assert_any_call("http://fast/app_files/fast/", ANY)
+
+        finished_events = [c for c in self.emitter.call_args_list if c[1]["event_type"] == "build_finished"]
+        self.assertEqual(len(finished_events), 3)
+
+    @patch("assistant.tasks.download_artifacts", return_value="folder/artifacts")
+    def test_sequential_moves_on_after_crash(self, download_mock):
+        with patch("assistant.tasks.run_build_job", side_effect=self.fake_build_job):
+            build = self.make_runner().run_sequentially(self.servers("broken", "fast", "failing"))
+
+        self.assertEqual(build.server_url, "http://fast")
+        self.assertEqual([b.server_url for b in self.suite.builds.order_by('id')],
+                         ["http://broken", "http://fast"])
+        self.assertEqual(self.suite.builds.get(server_url="http://broken").errors,
+                         ["Operation was not completed correctly"])
+
+    @patch("assistant.tasks.requests")
+    def test_order_by_load(self, requests_mock):
+        from assistant.tasks import order_by_load
+        stats = {
+            "http://busy/queue/": dict(queued=4, running=2, workers=2),
+            "http://idle/queue/": dict(queued=0, running=1, workers=2),
+        }
+
+        def get(url, timeout=None):
+            if url not in stats:
+                raise requests.RequestException("down")
+            return make_response(json_data=stats[url])
+
+        requests_mock.get.side_effect = get
+        requests_mock.RequestException = requests.RequestException
+        ordered = order_by_load(self.servers("busy", "down", "idle"))
+        self.assertEqual([server.url for server in ordered], ["http://idle", "http://busy", "http://down"])
+
+
+class OperationSuiteExecutionTests(APITestCase):
+    def setUp(self):
+        chat_id = create_default_chat(self.client)
+        mod_id = create_text_modality(self.client, text="Make an app").data['id']
+        msg_id = create_message(self.client, modality_id=mod_id, chat_id=chat_id, role="user").data['id']
+        self.revision = Revision.objects.create(message_id=msg_id, src_tree=[])
+
+        configuration = Chat.objects.get(pk=chat_id).configuration
+        configuration.build_servers.set([Server.objects.create(name="builder", url="http://builder")])
+        configuration.lint_servers.set([Server.objects.create(name="linter", url="http://linter")])
+        configuration.test_servers.set([
+            Server.objects.create(name="tester", url="http://tester"),
+            Server.objects.create(name="broken tester", url="http://broken-tester")
+        ])
+
+        self.emitter = Mock()
+        patcher = patch("assistant.tasks.RedisEventEmitter", return_value=self.emitter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # every operation waits for the others to start, so running them one by one breaks the barrier
+        self.barrier = threading.Barrier(4, timeout=5)
+
+    def fake_build_job(self, server_url, source_tree, resources, on_log, base_build_id=None, cancelled=None):
+        self.barrier.wait()
+        return dict(success=True, stdout="", stderr="", build_id="b1")
+
+    def fake_post_json(self, url, data, timeout=None):
+        self.barrier.wait()
+        if "broken" in url:
+            raise Exception("Bad status code: 500")
+        return dict(success="lint" in url, report={"url": url}, logs=["checked"])
+
+    @patch("assistant.tasks.download_artifacts", return_value="folder")
+    def test_operations_run_concurrently(self, download_mock):
+        from assistant.tasks import launch_operation_suite
+        with patch("assistant.tasks.run_build_job", side_effect=self.fake_build_job), \
+                patch("assistant.tasks.post_json", side_effect=self.fake_post_json):
+            launch_operation_suite(self.revision.id, "session")
+
+        suite = OperationSuite.objects.get(revision=self.revision)
+        self.assertTrue(suite.complete)
+        self.assertEqual(suite.get_summary(), {
+            "builds": dict(total=1, running=0, successful=1, failed=0),
+            "lints": dict(total=1, running=0, successful=1, failed=0),
+            "tests": dict(total=2, running=0, successful=0, failed=2),
+        })
+        self.assertEqual(suite.lints.get().report, {"url": "http://linter/lint/"})
+        self.assertEqual(suite.tests.get(errors__isnull=False).errors,
+                         ["Operation was not completed correctly"])
+
+        event_types = [c[1]["event_type"] for c in self.emitter.call_args_list]
+        for event_type in ("build_started", "build_finished", "lint_started", "lint_finished"):
+            self.assertEqual(event_types.count(event_type), 1)
+        self.assertEqual(event_types.count("test_started"), 2)
+        self.assertEqual(event_types.count("test_finished"), 2)
+        self.assertEqual(event_types[-1], "suite_finished")
+
+    @patch("assistant.tasks.download_artifacts", return_value="folder")
+    def test_checks_are_skipped_without_servers(self, download_mock):
+        from assistant.tasks import launch_operation_suite
+        configuration = self.revision.message.chat.configuration
+        configuration.lint_servers.clear()
+        configuration.test_servers.clear()
+
+        build_result = dict(success=True, stdout="", stderr="", build_id="b1")
+        with patch("assistant.tasks.run_build_job", return_value=build_result), \
+                patch("assistant.tasks.post_json") as post_json_mock:
+            launch_operation_suite(self.revision.id, "session")
+
+        post_json_mock.assert_not_called()
+        summary = OperationSuite.objects.get(revision=self.revision).get_summary()
+        self.assertEqual(summary["lints"]["total"] + summary["tests"]["total"], 0)
+        event_types = [c[1]["event_type"] for c in self.emitter.call_args_list]
+        self.assertEqual(event_types, ["build_started", "build_finished", "suite_finished"])
+
+    def test_summary_counts_running_operations(self):
+        suite = OperationSuite.objects.create(revision=self.revision)
+        Build.objects.create(operation_suite=suite)
+        Build.objects.create(operation_suite=suite, finished=True, success=True)
+        LinterCheck.objects.create(operation_suite=suite, finished=True, success=False)
+
+        summary = suite.get_summary()
+        self.assertEqual(summary["builds"], dict(total=2, running=1, successful=1, failed=0))
+        self.assertEqual(summary["lints"], dict(total=1, running=0, successful=0, failed=1))
+        self.assertEqual(summary["tests"], dict(total=0, running=0, successful=0, failed=0))
+        self.assertFalse(suite.complete)
+
+
+class RevisionSnapshotTests(TestCase):
+    def add_message(self, parent=None, src_tree=None):
+        message = MultimediaMessage.objects.create(
+            role="assistant", parent=parent, content=Modality.objects.create(modality_type="text", text="")
+        )
+        if src_tree is not None:
+            Revision.objects.create(message=message, src_tree=src_tree)
+        return message
+
+    def file(self, path, content, **kwargs):
+        return dict(file_path=path, content=content, **kwargs)
+
+    def test_source_tree_merges_revisions_of_ancestors(self):
+        root = self.add_message(src_tree=[self.file("a.js", "1"), self.file("b.css", "2")])
+        question = self.add_message(parent=root)
+        answer = self.add_message(parent=question, src_tree=[
+            self.file("a.js", "3"), self.file("b.css", "", deleted=True), self.file("c.js", "4")
+        ])
+        snippet = self.add_message(parent=answer, src_tree=[self.file("c.js", "...", snippet=True)])
+
+        revision = answer.revisions.get()
+        self.assertEqual(revision.get_source_tree(), [self.file("a.js", "3"), self.file("c.js", "4")])
+        self.assertEqual(snippet.revisions.get().get_source_tree(), [self.file("a.js", "3")])
+
+        root_snapshot = Revision.objects.get(pk=root.revisions.get().pk).snapshot
+        self.assertEqual([ref["file_path"] for ref in root_snapshot], ["a.js", "b.css"])
+        snapshot = Revision.objects.get(pk=revision.pk).snapshot
+        self.assertEqual(snapshot, [ref for ref in revision.files if "deleted" not in ref])
+
+    def test_revisions_added_to_ancestors_later_are_included(self):
+        root = self.add_message()
+        question = self.add_message(parent=root)
+        answer = self.add_message(parent=question, src_tree=[self.file("b.js", "2")])
+        revision = answer.revisions.get()
+        self.assertEqual(reduce_source_tree(revision), [self.file("b.js", "2")])
+
+        first = Revision.objects.create(message=root, src_tree=[self.file("a.js", "1")])
+        revision = Revision.objects.get(pk=revision.pk)
+        self.assertIsNone(revision.snapshot)
+        self.assertEqual(reduce_source_tree(revision), [self.file("a.js", "1"), self.file("b.js", "2")])
+
+        first.delete()
+        revision = Revision.objects.get(pk=revision.pk)
+        self.assertEqual(reduce_source_tree(revision), [self.file("b.js", "2")])
+
+    def test_lookup_takes_constant_number_of_queries(self):
+        message = None
+        for i in range(100):
+            message = self.add_message(parent=message)
+            message = self.add_message(parent=message, src_tree=[self.file(f"file{i % 10}.js", str(i))])
+
+        revision = message.revisions.get()
+        revision.get_source_tree()
+
+        revision = Revision.objects.get(pk=revision.pk)
+        with self.assertNumQueries(1):
+            tree = revision.get_source_tree()
+        self.assertEqual(len(tree), 10)
+        self.assertEqual(tree[0], self.file("file0.js", "90"))
+
+        message = self.add_message(parent=self.add_message(parent=message), src_tree=[self.file("new.js", "")])
+        with self.assertNumQueries(5):
+            tree = message.revisions.get().get_source_tree()
+        self.assertEqual(len(tree), 11)
+
+
+class FileBlobTests(TestCase):
+    def setUp(self):
+        content = Modality.objects.create(modality_type="text", text="")
+        self.message = MultimediaMessage.objects.create(role="assistant", content=content)
+
+    def test_identical_files_share_blobs(self):
+        src_tree = [dict(file_path="main.js", content="x = 1"), dict(file_path="old.js", deleted=True)]
+        first = Revision.objects.create(message=self.message, src_tree=src_tree)
+        second = Revision.objects.create(message=self.message, src_tree=[dict(file_path="copy.js", content="x = 1")])
+
+        self.assertEqual(FileBlob.objects.count(), 1)
+        sha256 = FileBlob.objects.get().sha256
+        self.assertEqual(first.files, [dict(file_path="main.js", sha256=sha256),
+                                       dict(file_path="old.js", deleted=True)])
+        self.assertEqual(second.files, [dict(file_path="copy.js", sha256=sha256)])
+        self.assertEqual(Revision.objects.get(pk=first.pk).src_tree, src_tree)
+
+    def test_prefetch_src_trees_uses_one_query(self):
+        for i in range(5):
+            Revision.objects.create(message=self.message, src_tree=[dict(file_path="a.js", content=str(i))])
+
+        revisions = list(Revision.objects.all())
+        with self.assertNumQueries(1):
+            Revision.prefetch_src_trees(revisions)
+            contents = [revision.src_tree[0]["content"] for revision in revisions]
+        self.assertEqual(contents, ["0", "1", "2", "3", "4"])
+
+
+class GroupMessagesByChatTests(APITestCase):
+    def add_message(self, parent=None, chat=None):
+        content = Modality.objects.create(modality_type="text", text="")
+        return MultimediaMessage.objects.create(role="user", content=content, parent=parent, chat=chat)
+
+    def test_backfills_chat_of_descendants(self):
+        chat = Chat.objects.get(pk=create_default_chat(self.client))
+        root = self.add_message(chat=chat)
+        message = root
+        for i in range(5):
+            message = self.add_message(parent=message)
+        branch = self.add_message(parent=root)
+        orphan = self.add_message(parent=self.add_message())
+        MultimediaMessage.objects.exclude(pk=root.pk).update(chat=None)
+        version = Chat.objects.get(pk=chat.pk).version
+
+        out = io.StringIO()
+        call_command("group_messages_by_chat", batch_size=2, stdout=out)
+        self.assertIn('Processed "6" out of "6" messages', out.getvalue())
+        self.assertGreater(Chat.objects.get(pk=chat.pk).version, version)
+
+        self.assertEqual(7, MultimediaMessage.objects.filter(chat=chat).count())
+        self.assertIsNone(MultimediaMessage.objects.get(pk=orphan.pk).chat_id)
+
+        out = io.StringIO()
+        call_command("group_messages_by_chat", stdout=out)
+        self.assertNotIn("Processed", out.getvalue())
+
+
+class ActiveBranchTests(APITestCase):
+    def setUp(self):
+        self.chat = Chat.objects.get(pk=create_default_chat(self.client))
+        self.root = self.add_message("root", chat=self.chat)
+
+    def add_message(self, text, parent=None, chat=None):
+        content = Modality.objects.create(modality_type="mixture")
+        Modality.objects.create(modality_type="text", text=text, mixed_modality=content)
+        message = MultimediaMessage.objects.create(role="user", content=content, parent=parent, chat=chat)
+        if parent is not None:
+            parent.child_index = parent.replies.count() - 1
+            parent.save()
+        return message
+
+    def get_chat(self):
+        return Chat.objects.get(pk=self.chat.pk)
+
+    def test_saving_a_stale_chat_keeps_the_path(self):
+        stale_chat = self.get_chat()
+        reply = self.add_message("reply", parent=self.root)
+        stale_chat.name = "Renamed"
+        stale_chat.save()
+        chat = self.get_chat()
+        self.assertEqual("Renamed", chat.name)
+        self.assertEqual([self.root.id, reply.id], chat.active_path)
+
+    def test_path_follows_new_replies_and_child_index(self):
+        first = self.add_message("first", parent=self.root)
+        second = self.add_message("second", parent=self.root)
+        answer = self.add_message("answer", parent=second)
+        self.assertEqual([self.root.id, second.id, answer.id], self.get_chat().active_path)
+        self.assertEqual("answer", self.get_chat().get_last_text())
+
+        response = self.client.patch(reverse('multimediamessage-detail', args=[self.root.id]),
+                                     {"child_index": 0}, format="json")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.root.id, first.id], self.get_chat().active_path)
+        self.assertEqual("first", self.get_chat().get_last_text())
+
+        first.delete()
+        self.assertEqual([self.root.id, second.id, answer.id], self.get_chat().active_path)
+
+    def test_lookups_read_the_stored_path(self):
+        message = self.root
+        for i in range(20):
+            message = self.add_message(f"message {i}", parent=message)
+        Revision.objects.create(message=message, src_tree=[])
+
+        chat = self.get_chat()
+        with self.assertNumQueries(2):
+            self.assertEqual("message 19", chat.get_last_text())
+        with self.assertNumQueries(1):
+            self.assertEqual(1, len(chat.get_revisions()))
+
+        message = MultimediaMessage.objects.get(pk=message.pk)
+        with self.assertNumQueries(2):
+            history = message.get_history()
+        self.assertEqual(self.get_chat().active_path, [m.id for m in history])
+
+    def test_missing_path_is_computed_on_access(self):
+        reply = self.add_message("reply", parent=self.root)
+        Chat.objects.filter(pk=self.chat.pk).update(active_path=None)
+        self.assertEqual([self.root.id, reply.id], self.get_chat().get_message_ids())
+        self.assertEqual([self.root.id, reply.id], self.get_chat().active_path)
@@ -0,0 +1,403 @@
+import os
+import json
+import signal
+import socket
+import asyncio
+import unittest
+from unittest.mock import patch
+import websockets
+import websocket_server
+from websocket_server import (
+    SendQueue, SlowConsumerError, RelayStats, Frame, parse_delta, protocols, select_subprotocol,
+    EventProtocol, CompactJsonProtocol, MsgpackProtocol
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def make_event(event_type="generation_started", task_id="task"):
+    return json.dumps(dict(event_type=event_type, data=dict(task_id=task_id)))
+
+
+def make_delta(text, item_id="item", task_id="task", output_index=0, **fields):
+    response_event = dict(type="response.output_text.delta", item_id=item_id, output_index=output_index,
+                          delta=text, **fields)
+    return json.dumps(dict(event_type="response_event",
+                           data=dict(response_event=response_event, task_id=task_id)))
+
+
+def make_frame(payload):
+    event, delta_key = parse_delta(payload)
+    return Frame(payload, event, delta_key)
+
+
+def decode(protocol, messages):
+    """Decodes messages the way a client does: events are returned as dicts and compact
+    deltas as (task id, output index, text) tuples"""
+    handles = {}
+    decoded = []
+    for message in messages:
+        if isinstance(message, bytes):
+            obj = msgpack.unpackb(message)
+        else:
+            obj = json.loads(message)
+
+        if isinstance(obj, list):
+            handle, output_index, text = obj
+            decoded.append((handles[handle], output_index, text))
+        elif obj["event_type"] == "generation_handle":
+            handles[obj["data"]["handle"]] = obj["data"]["task_id"]
+        else:
+            decoded.append(obj)
+    return decoded
+
+
+class FakePubSub:
+    """Yields queued payloads on the session channel, then idles"""
+
+    def __init__(self, payloads=()):
+        self.payloads = list(payloads)
+        self.channel = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def subscribe(self, channel):
+        self.channel = channel
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        if not self.payloads:
+            await asyncio.sleep(0.01)
+            return None
+        await asyncio.sleep(0)
+        return dict(channel=self.channel.encode(), data=self.payloads.pop(0).encode())
+
+
+class FakeRedis:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def pubsub(self):
+        return self._pubsub
+
+
+class FakeWebSocket:
+    """Sends block until the test opens the gate, like a client that stopped reading"""
+
+    def __init__(self, subprotocol=None):
+        self.subprotocol = subprotocol
+        self.gate = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.sent = []
+        self.close_code = None
+
+    async def recv(self):
+        return "session"
+
+    async def send(self, message):
+        await self.gate.wait()
+        self.sent.append(message)
+
+    async def wait_closed(self):
+        await self.closed.wait()
+
+    async def close(self, code=1000, reason=""):
+        self.close_code = code
+        self.closed.set()
+
+
+class SendQueueTests(unittest.IsolatedAsyncioTestCase):
+    async def test_frames_are_returned_in_order(self):
+        queue = SendQueue()
+        queue.put(make_event("generation_started"))
+        queue.put(make_event("generation_ended"))
+
+        self.assertEqual(json.loads((await queue.get()).get_payload())["event_type"], "generation_started")
+        self.assertEqual(json.loads((await queue.get()).get_payload())["event_type"], "generation_ended")
+        self.assertEqual(len(queue), 0)
+
+    async def test_get_waits_for_put(self):
+        queue = SendQueue()
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(getter.done())
+
+        queue.put(make_event())
+        frame = await asyncio.wait_for(getter, timeout=1)
+        self.assertEqual(frame.get_payload(), make_event())
+
+    async def test_pending_deltas_of_same_item_are_merged(self):
+        stats = RelayStats()
+        queue = SendQueue(stats=stats)
+        queue.put(make_delta("Hel"))
+        queue.put(make_delta("lo"))
+        queue.put(make_delta("!", item_id="other"))
+        queue.put(make_event("generation_ended"))
+        queue.put(make_delta(" again"))
+
+        self.assertEqual(len(queue), 4)
+        self.assertEqual((stats.received_frames, stats.merged_frames), (5, 1))
+        first = json.loads((await queue.get()).get_payload())
+        self.assertEqual(first["data"]["response_event"]["delta"], "Hello")
+        second = json.loads((await queue.get()).get_payload())
+        self.assertEqual(second["data"]["response_event"]["delta"], "!")
+
+    def test_deltas_merge_into_a_full_queue(self):
+        queue = SendQueue(max_size=1)
+        queue.put(make_delta("a"))
+        queue.put(make_delta("b"))
+        self.assertEqual(len(queue), 1)
+
+        with self.assertRaises(SlowConsumerError):
+            queue.put(make_event())
+
+    def test_lagging_queue_rejects_frames(self):
+        queue = SendQueue(max_lag=5)
+        queue.put(make_event())
+        self.assertFalse(queue.lagging())
+
+        queue.frames[0].enqueued_at -= 10
+        self.assertTrue(queue.lagging())
+        with self.assertRaises(SlowConsumerError):
+            queue.put(make_delta("late"))
+
+
+class HandlerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.stats = RelayStats()
+        for name, value in [("stats", self.stats), ("queue_size", 1000), ("max_lag", 10.0)]:
+            patcher = patch.object(websocket_server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def serve(self, payloads, websocket=None):
+        websocket = websocket or FakeWebSocket()
+        with patch.object(websocket_server, "r", FakeRedis(FakePubSub(payloads))):
+            await asyncio.wait_for(websocket_server.handler(websocket), timeout=5)
+        return websocket
+
+    async def wait_until(self, condition):
+        for i in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Condition was not met in time")
+
+    async def test_client_that_stopped_reading_is_disconnected_on_overflow(self):
+        payloads = [make_event(task_id=str(i)) for i in range(5)]
+        websocket_server.queue_size = 3
+        websocket = await self.serve(payloads)
+
+        self.assertEqual(websocket.close_code, 1013)
+        self.assertEqual(self.stats.slow_disconnects, 1)
+        self.assertEqual(websocket_server.connections, {})
+        self.assertEqual(self.stats.connections, 0)
+
+    async def test_lagging_client_is_disconnected_while_producer_is_idle(self):
+        websocket_server.max_lag = 0.05
+        websocket = await self.serve([make_event(), make_event()])
+
+        self.assertEqual(websocket.close_code, 1013)
+        self.assertEqual(self.stats.slow_disconnects, 1)
+
+    async def test_deltas_queued_for_a_slow_client_are_sent_merged(self):
+        websocket = FakeWebSocket()
+        payloads = [make_event()] + [make_delta(text) for text in ("a", "b", "c")]
+        task = asyncio.create_task(self.serve(payloads, websocket))
+        await self.wait_until(lambda: self.stats.received_frames == len(payloads) or task.done())
+
+        websocket.gate.set()
+        await self.wait_until(lambda: len(websocket.sent) == 2 or task.done())
+        websocket.closed.set()
+        await task
+
+        self.assertIsNone(websocket.close_code)
+        self.assertEqual(len(websocket.sent), 2)
+        self.assertEqual(json.loads(websocket.sent[1])["data"]["response_event"]["delta"], "abc")
+        self.assertEqual(self.stats.slow_disconnects, 0)
+
+
+class EventProtocolTests(unittest.TestCase):
+    payloads = [
+        make_event("generation_started", task_id="first"),
+        make_delta("Hel", task_id="first"),
+        make_delta("lo", task_id="second", output_index=1),
+        make_delta("!", task_id="first"),
+        make_event("generation_ended", task_id="first"),
+    ]
+
+    def encode(self, protocol, payloads):
+        return [message for payload in payloads for message in protocol.encode(make_frame(payload))]
+
+    def test_default_protocol_relays_published_frames(self):
+        messages = self.encode(EventProtocol(), self.payloads)
+        self.assertEqual(messages, self.payloads)
+
+    def test_compact_protocol_round_trip(self):
+        protocol = CompactJsonProtocol()
+        messages = self.encode(protocol, self.payloads)
+
+        self.assertTrue(all(isinstance(message, str) for message in messages))
+        self.assertEqual(decode(protocol, messages), [
+            json.loads(self.payloads[0]),
+            ("first", 0, "Hel"),
+            ("second", 1, "lo"),
+            ("first", 0, "!"),
+            json.loads(self.payloads[4]),
+        ])
+
+    def test_handles_are_announced_once_per_task(self):
+        protocol = CompactJsonProtocol()
+        messages = self.encode(protocol, self.payloads[1:4])
+
+        announcements = [json.loads(message) for message in messages if message.startswith("{")]
+        self.assertEqual(announcements, [
+            dict(event_type="generation_handle", data=dict(task_id="first", handle=0)),
+            dict(event_type="generation_handle", data=dict(task_id="second", handle=1)),
+        ])
+        self.assertEqual(json.loads(messages[0])["data"]["handle"], json.loads(messages[1])[0])
+        self.assertEqual(messages[-1], '[0,0,"!"]')
+
+    def test_deltas_with_content_or_summary_index_use_regular_encoding(self):
+        protocol = CompactJsonProtocol()
+        for payload in [make_delta("a", content_index=1), make_delta("b", summary_index=0),
+                        make_delta("c").replace("output_text", "function_call_arguments")]:
+            with self.subTest(payload=payload):
+                self.assertEqual(protocol.encode(make_frame(payload)), [json.dumps(json.loads(payload))])
+        self.assertEqual(protocol.handles, {})
+
+        self.assertEqual(decode(protocol, protocol.encode(make_frame(make_delta("d", content_index=0)))),
+                         [("task", 0, "d")])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_protocol_sends_binary_frames(self):
+        protocol = MsgpackProtocol()
+        messages = self.encode(protocol, self.payloads)
+
+        self.assertTrue(all(isinstance(message, bytes) for message in messages))
+        self.assertEqual(msgpack.unpackb(messages[0]), json.loads(self.payloads[0]))
+        self.assertEqual(msgpack.unpackb(messages[-2]), [0, 0, "!"])
+        self.assertEqual(decode(protocol, messages), decode(CompactJsonProtocol(), self.encode(
+            CompactJsonProtocol(), self.payloads)))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_encodes_merged_frames(self):
+        frame = make_frame(make_delta("a", content_index=1))
+        frame.merge(json.loads(make_delta("b", content_index=1)))
+        message, = MsgpackProtocol().encode(frame)
+        self.assertEqual(msgpack.unpackb(message)["data"]["response_event"]["delta"], "ab")
+
+
+class SubprotocolNegotiationTests(unittest.IsolatedAsyncioTestCase):
+    def test_first_supported_subprotocol_is_selected(self):
+        self.assertEqual(select_subprotocol(None, ["unknown", "events.compact.json", "events.msgpack"]),
+                         "events.compact.json")
+        self.assertEqual(select_subprotocol(None, ["unknown"]), None)
+        self.assertEqual(select_subprotocol(None, []), None)
+        self.assertIs(protocols[None], EventProtocol)
+
+    async def connect(self, payloads, subprotocols):
+        with patch.object(websocket_server, "r", FakeRedis(FakePubSub(payloads))), \
+                patch.object(websocket_server, "stats", RelayStats()):
+            server = await websockets.serve(
+                websocket_server.handler, "127.0.0.1", 0, select_subprotocol=select_subprotocol,
+                subprotocols=[name for name in protocols if name]
+            )
+            try:
+                port = server.sockets[0].getsockname()[1]
+                async with websockets.connect(f"ws://127.0.0.1:{port}", subprotocols=subprotocols) as client:
+                    await client.send("session")
+                    messages = [await asyncio.wait_for(client.recv(), timeout=5) for _ in range(2)]
+                    return client.subprotocol, messages
+            finally:
+                server.close()
+                await server.wait_closed()
+
+    async def test_compact_client_gets_handle_announcement_and_arrays(self):
+        subprotocol, messages = await self.connect([make_delta("a", task_id="t1")],
+                                                   ["unknown", "events.compact.json"])
+
+        self.assertEqual(subprotocol, "events.compact.json")
+        self.assertEqual(json.loads(messages[0]),
+                         dict(event_type="generation_handle", data=dict(task_id="t1", handle=0)))
+        self.assertEqual(json.loads(messages[1]), [0, 0, "a"])
+
+    async def test_client_without_subprotocol_gets_published_events(self):
+        payloads = [make_event(), make_delta("a")]
+        subprotocol, messages = await self.connect(payloads, None)
+
+        self.assertIsNone(subprotocol)
+        self.assertEqual(messages, payloads)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    async def test_msgpack_client_gets_binary_frames(self):
+        subprotocol, messages = await self.connect([make_event(), make_delta("a")], ["events.msgpack"])
+
+        self.assertEqual(subprotocol, "events.msgpack")
+        self.assertEqual(msgpack.unpackb(messages[0]), json.loads(make_event()))
+        self.assertEqual(msgpack.unpackb(messages[1])["event_type"], "generation_handle")
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class DrainTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch.object(websocket_server, "stats", RelayStats())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, websocket):
+        task = asyncio.create_task(websocket_server.handler(websocket))
+        self.addCleanup(task.cancel)
+        for i in range(100):
+            if websocket in websocket_server.connections:
+                return task
+            await asyncio.sleep(0.01)
+        self.fail("Client was not connected")
+
+    async def test_clients_are_asked_to_reconnect_and_closed(self):
+        reading = FakeWebSocket()
+        reading.gate.set()
+        stuck = FakeWebSocket()
+        with patch.object(websocket_server, "r", FakeRedis(FakePubSub())):
+            tasks = [await self.connect(reading), await self.connect(stuck)]
+            await asyncio.wait_for(websocket_server.drain(timeout=0.1), timeout=5)
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout=5)
+
+        self.assertEqual(json.loads(reading.sent[0]),
+                         dict(event_type="reconnect", data=dict(reason="server_restart")))
+        self.assertEqual((reading.close_code, stuck.close_code), (1012, 1012))
+        self.assertEqual(websocket_server.connections, {})
+
+    async def test_stats_server_is_closed_before_draining(self):
+        port, stats_port = get_free_port(), get_free_port()
+        drained = asyncio.Event()
+
+        async def fake_drain(timeout):
+            with self.assertRaises(OSError):
+                await asyncio.open_connection("127.0.0.1", stats_port)
+            drained.set()
+
+        with patch.object(websocket_server, "drain", fake_drain):
+            worker = asyncio.create_task(websocket_server.main("127.0.0.1", port, stats_port=stats_port))
+            for i in range(100):
+                try:
+                    _, writer = await asyncio.open_connection("127.0.0.1", stats_port)
+                    writer.close()
+                    break
+                except OSError:
+                    await asyncio.sleep(0.01)
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(worker, timeout=5)
+
+        self.assertTrue(drained.is_set())
@@ -0,0 +1,237 @@
+"""Cache of serialized message subtrees and chat system messages, kept in Redis.
+
+A message entry holds the serialized subtree of the message (the message, its content,
+revisions and all replies) per variant: scheme and host of hyperlinks and whether
+replies were left out (lite). Entries of replies are reused when a parent is rendered
+again, so after a change only the changed message and its ancestors are serialized.
+
+Writes to messages, modalities, revisions, generations, threads and operation suites
+delete the entries of the affected message and of all its ancestors, writes to messages
+and generations also those of the replies (their metadata depends on the parent). Writes to chats,
+resources and configurations delete cached system messages.
+"""
+import time
+import functools
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from assistant.models import (
+    Chat, Configuration, Resource, MultimediaMessage, Modality, Revision, Generation,
+    GenerationMetadata, OperationSuite, Thread
+)
+
+CACHE_ALIAS = "trees"
+
+STATS_KEYS = ("hits", "misses", "rebuilds", "rebuild_ms")
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def message_key(message_id):
+    return f"message-tree:{message_id}"
+
+
+def system_message_key(chat_id):
+    return f"chat-system-message:{chat_id}"
+
+
+def stats_key(name):
+    return f"tree-cache-stats:{name}"
+
+
+def get_variant(request, lite=False):
+    variant = f"{request.scheme}://{request.get_host()}"
+    return f"{variant}|lite" if lite else variant
+
+
+def get_trees(message_ids, variant):
+    """Maps ids of cached messages to (etag, data) of their subtrees"""
+    entries = get_cache().get_many([message_key(message_id) for message_id in message_ids])
+    trees = {}
+    for message_id in message_ids:
+        tree = entries.get(message_key(message_id), {}).get(variant)
+        if tree is not None:
+            trees[message_id] = tree
+    count_stats(hits=len(trees), misses=len(message_ids) - len(trees))
+    return trees
+
+
+def store_trees(trees, variant):
+    """trees maps message ids to (etag, data) of their subtrees"""
+    if not trees:
+        return
+    cache = get_cache()
+    keys = {message_id: message_key(message_id) for message_id in trees}
+    entries = cache.get_many(keys.values())
+    new_entries = {}
+    for message_id, tree in trees.items():
+        entry = entries.get(keys[message_id], {})
+        entry[variant] = tree
+        new_entries[keys[message_id]] = entry
+    cache.set_many(new_entries)
+
+
+def get_system_message(chat):
+    cache = get_cache()
+    key = system_message_key(chat.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0]
+    message = chat.get_system_message()
+    cache.set(key, (message,))
+    return message
+
+
+def count_stats(**counts):
+    cache = get_cache()
+    for name, count in counts.items():
+        if not count:
+            continue
+        key = stats_key(name)
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            if not cache.add(key, count, timeout=None):
+                cache.incr(key, count)
+
+
+def get_stats():
+    values = get_cache().get_many([stats_key(name) for name in STATS_KEYS])
+    stats = {name: values.get(stats_key(name), 0) for name in STATS_KEYS}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else None
+    stats["average_rebuild_ms"] = stats["rebuild_ms"] / stats["rebuilds"] if stats["rebuilds"] else None
+    return stats
+
+
+def cached_message_tree(method):
+    """Decorator of message detail views, serves cached subtrees without database queries"""
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        try:
+            message_id = int(kwargs.get('pk'))
+        except (TypeError, ValueError):
+            return method(view, request, *args, **kwargs)
+
+        variant = get_variant(request, lite=bool(request.query_params.get('lite')))
+        tree = get_trees([message_id], variant).get(message_id)
+        if tree is not None:
+            etag, data = tree
+            if etag is not None and etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            headers = {'ETag': etag} if etag is not None else None
+            return Response(data, headers=headers)
+
+        started = time.monotonic()
+        response = method(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            count_stats(rebuilds=1, rebuild_ms=round((time.monotonic() - started) * 1000))
+            store_trees({message_id: (response.get('ETag'), response.data)}, variant)
+        return response
+    return wrapper
+
+
+def get_ancestor_ids(message_id, parent_id=None, chat_id=None):
+    """Ids of the message and of all its ancestors"""
+    if parent_id is None and chat_id is None:
+        row = MultimediaMessage.objects.filter(pk=message_id).values_list('parent_id', 'chat_id').first()
+        if row is None:
+            return [message_id]
+        parent_id, chat_id = row
+
+    parents = {}
+    if chat_id is not None:
+        parents = dict(MultimediaMessage.objects.filter(chat_id=chat_id).values_list('id', 'parent_id'))
+
+    ids = [message_id]
+    while parent_id is not None and parent_id not in ids:
+        ids.append(parent_id)
+        if parent_id not in parents:
+            parents[parent_id] = MultimediaMessage.objects.filter(
+                pk=parent_id).values_list('parent_id', flat=True).first()
+        parent_id = parents[parent_id]
+    return ids
+
+
+def invalidate_messages(message_ids):
+    get_cache().delete_many([message_key(message_id) for message_id in message_ids])
+
+
+def invalidate_message(message_id):
+    if message_id is not None:
+        invalidate_messages(get_ancestor_ids(message_id))
+
+
+def on_message_write(sender, instance, **kwargs):
+    invalidate_messages(get_ancestor_ids(instance.pk, instance.parent_id, instance.chat_id))
+    # metadata of replies is chosen by child_index of their parent
+    invalidate_messages(MultimediaMessage.objects.filter(parent_id=instance.pk).values_list('id', flat=True))
+
+
+def on_modality_write(sender, instance, **kwargs):
+    modality = instance
+    while modality.mixed_modality_id is not None:
+        modality = Modality.objects.filter(pk=modality.mixed_modality_id).first()
+        if modality is None:
+            return
+    message_id = MultimediaMessage.objects.filter(content_id=modality.pk).values_list('id', flat=True).first()
+    invalidate_message(message_id)
+
+
+def on_revision_write(sender, instance, **kwargs):
+    invalidate_message(instance.message_id)
+
+
+def on_revision_child_write(sender, instance, **kwargs):
+    invalidate_message(Revision.objects.filter(pk=instance.revision_id).values_list('message_id', flat=True).first())
+
+
+def on_generation_write(sender, instance, **kwargs):
+    if instance.message_id is None:
+        return
+    # metadata of generated replies is rendered from generations of their parent
+    invalidate_message(instance.message_id)
+    invalidate_messages(MultimediaMessage.objects.filter(parent_id=instance.message_id).values_list('id', flat=True))
+
+
+def on_metadata_write(sender, instance, **kwargs):
+    for generation in Generation.objects.filter(generation_metadata_id=instance.pk):
+        on_generation_write(Generation, generation)
+
+
+def on_chat_write(sender, instance, **kwargs):
+    get_cache().delete(system_message_key(instance.pk))
+
+
+def on_resource_write(sender, instance, **kwargs):
+    if instance.chat_id is not None:
+        get_cache().delete(system_message_key(instance.chat_id))
+
+
+def on_configuration_write(sender, instance, **kwargs):
+    chat_ids = Chat.objects.filter(configuration_id=instance.pk).values_list('id', flat=True)
+    get_cache().delete_many([system_message_key(chat_id) for chat_id in chat_ids])
+
+
+receivers = {
+    MultimediaMessage: on_message_write,
+    Modality: on_modality_write,
+    Revision: on_revision_write,
+    Thread: on_revision_child_write,
+    OperationSuite: on_revision_child_write,
+    Generation: on_generation_write,
+    GenerationMetadata: on_metadata_write,
+    Chat: on_chat_write,
+    Resource: on_resource_write,
+    Configuration: on_configuration_write,
+}
+
+
+def connect_receivers():
+    for model, receiver in receivers.items():
+        post_save.connect(receiver, sender=model, dispatch_uid=f"tree-cache-save-{model.__name__}")
+        post_delete.connect(receiver, sender=model, dispatch_uid=f"tree-cache-delete-{model.__name__}")
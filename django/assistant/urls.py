@@ -23,5 +23,7 @@ urlpatterns = [
     path('checks/<int:pk>/', views.LinterCheckDetailView.as_view(), name='lintercheck-detail'),
     path('tests/<int:pk>/', views.TestRunDetailView.as_view(), name='testrun-detail'),
     path('operation-suites/', views.OperationSuiteListView.as_view(), name='operation-suite-list'),
-    path('operation-suites/<int:pk>/', views.OperationSuiteDetailView.as_view(), name='operation-suite-detail')
+    path('operation-suites/<int:pk>/', views.OperationSuiteDetailView.as_view(), name='operation-suite-detail'),
+    path('tree-cache/stats/', views.tree_cache_stats, name='tree-cache-stats'),
+    path('profiler/stats/', views.profiler_stats, name='profiler-stats')
 ]
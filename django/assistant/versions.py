@@ -0,0 +1,108 @@
+"""Per-chat version counters, used as ETags of chat related endpoints.
+
+Every write to a chat or to an object shown by its endpoints bumps Chat.version. A
+conditional GET compares If-None-Match with the current version of the chat, so polling
+an unchanged chat costs a single query and no serialization (see chat_version_etag).
+"""
+import functools
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from assistant.models import (
+    Chat, Configuration, Resource, MultimediaMessage, Modality, Revision, Generation,
+    GenerationMetadata, OperationSuite, Build, LinterCheck, TestRun, Thread, Comment
+)
+
+
+def bump_versions(chat_ids):
+    """chat_ids is a list or a queryset of chat ids"""
+    if isinstance(chat_ids, list):
+        chat_ids = [chat_id for chat_id in chat_ids if chat_id is not None]
+        if not chat_ids:
+            return
+    Chat.objects.filter(pk__in=chat_ids).update(version=F('version') + 1)
+
+
+def get_revision_chats(revision_id):
+    return Revision.objects.filter(pk=revision_id).values_list('message__chat_id', flat=True)
+
+
+def get_suite_chats(suite_id):
+    return OperationSuite.objects.filter(pk=suite_id).values_list('revision__message__chat_id', flat=True)
+
+
+def get_generation_chats(generation):
+    if generation.chat_id is not None:
+        return [generation.chat_id]
+    return MultimediaMessage.objects.filter(pk=generation.message_id).values_list('chat_id', flat=True)
+
+
+chat_lookups = {
+    Chat: lambda chat: [chat.pk],
+    Configuration: lambda conf: Chat.objects.filter(configuration_id=conf.pk).values_list('id', flat=True),
+    Resource: lambda resource: [resource.chat_id],
+    MultimediaMessage: lambda message: [message.chat_id],
+    Modality: lambda modality: [modality.get_chat_id()],
+    Revision: lambda revision: MultimediaMessage.objects.filter(
+        pk=revision.message_id).values_list('chat_id', flat=True),
+    Generation: get_generation_chats,
+    GenerationMetadata: lambda meta: Generation.objects.filter(
+        generation_metadata_id=meta.pk).values_list('message__chat_id', flat=True),
+    OperationSuite: lambda suite: get_revision_chats(suite.revision_id),
+    Build: lambda build: get_suite_chats(build.operation_suite_id),
+    LinterCheck: lambda check: get_suite_chats(check.operation_suite_id),
+    TestRun: lambda run: get_suite_chats(run.operation_suite_id),
+    Thread: lambda thread: get_revision_chats(thread.revision_id),
+    Comment: lambda comment: Thread.objects.filter(
+        pk=comment.thread_id).values_list('revision__message__chat_id', flat=True),
+}
+
+
+def on_write(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    bump_versions(chat_lookups[sender](instance))
+
+
+def connect_receivers():
+    for model in chat_lookups:
+        post_save.connect(on_write, sender=model, dispatch_uid=f"chat-version-save-{model.__name__}")
+        post_delete.connect(on_write, sender=model, dispatch_uid=f"chat-version-delete-{model.__name__}")
+
+
+def get_chat_version(queryset, chat_path=""):
+    """(chat id, version) of the chat of the only object of the queryset or None"""
+    prefix = f"{chat_path}__" if chat_path else ""
+    try:
+        row = queryset.values_list(f"{prefix}id", f"{prefix}version").first()
+    except (ValueError, TypeError):
+        return None
+    if row is None or row[0] is None:
+        return None
+    return row
+
+
+def chat_version_etag(model, chat_path=""):
+    """Decorator of detail views, answers 304 when If-None-Match has the version of the chat.
+
+    chat_path is the lookup from model to Chat, e.g. "revision__message__chat".
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            row = get_chat_version(model.objects.filter(pk=kwargs.get('pk')), chat_path)
+            if row is None:
+                return method(view, request, *args, **kwargs)
+
+            etag = '"chat-%s-v%s"' % row
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
@@ -1,5 +1,7 @@
 import math
 import json
+import base64
+import hashlib
 from rest_framework.decorators import api_view
 from rest_framework import viewsets
 from rest_framework import generics, mixins
@@ -7,26 +9,38 @@ from rest_framework import decorators
 from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.shortcuts import get_object_or_404
+from django.db.models import Q, Exists, OuterRef
 
 
 from .models import (
     Configuration, Server, Preset, Build, LinterCheck, TestRun, OperationSuite,
     Comment, Thread, Chat, MultimediaMessage, Modality, Generation, GenerationMetadata,
-    Revision, SpeechSample, Resource, reduce_source_tree
+    Revision, SpeechSample, Resource, reduce_source_tree, prefetch_message_trees
 )
 from .serializers import (
     ConfigurationSerializer, ServerSerializer, PresetSerializer,
     BuildSerializer, LinterCheckSerializer, TestRunSerializer, OperationSuiteSerializer,
     ThreadSerializer, ChatSerializer, MultimediaMessageSerializer, ModalitySerializer,
-    RevisionSerializer, NewRevisionSerializer, CommentSerializer, ModalitiesOrderingSerializer,
+    RevisionSerializer, RevisionChangesSerializer, NewRevisionSerializer, CommentSerializer, ModalitiesOrderingSerializer,
     GenerationSerializer, GenerationMetadataSerializer, NewGenerationTaskSerializer,
-    BuildLaunchSerializer, MakeRevisionSerializer, SpeechSampleSerializer, ResourceSerializer
+    BuildLaunchSerializer, MakeRevisionSerializer, SpeechSampleSerializer, ResourceSerializer,
+    SyncMessageSerializer, SyncModalitySerializer, SyncRevisionSerializer, SyncGenerationSerializer
 )
 
 from .tasks import summarize_text, generate_chat_picture
+from . import diffs
+from . import sync
+from . import search_backends
+from .versions import chat_version_etag
+from . import tree_cache
+from . import profiling
 from .utils import fix_newlines
 
 
@@ -52,6 +66,13 @@ class SpeechSampleViewSet(viewsets.ReadOnlyModelViewSet):
         return super().retrieve(request, *args, **kwargs)
 
 
+def get_diff_format(request):
+    diff_format = request.query_params.get('delta', 'unified')
+    if diff_format not in diffs.DIFF_FORMATS:
+        raise ValidationError({"delta": f"Expected one of {', '.join(diffs.DIFF_FORMATS)}"})
+    return diff_format
+
+
 class RevisionViewSet(viewsets.GenericViewSet):
     queryset = Revision.objects.all()
     serializer_class = RevisionSerializer
@@ -62,6 +83,27 @@ class RevisionViewSet(viewsets.GenericViewSet):
         source_tree = reduce_source_tree(revision)
         return Response(source_tree)
 
+    @decorators.action(methods=['get'], detail=True, url_path="diff")
+    def diff(self, request, pk=None):
+        revision = self.get_object()
+        diff_format = get_diff_format(request)
+
+        base_id = request.query_params.get('base')
+        if base_id is None:
+            base = revision.get_previous()
+        else:
+            base = Revision.objects.filter(pk=base_id).first() if base_id.isdigit() else None
+            if base is None:
+                return Response({"base": f"Revision {base_id} does not exist"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "revision": revision.id,
+            "base": base and base.id,
+            "delta": diff_format,
+            "files": diffs.diff_revisions(base, revision, diff_format)
+        })
+
     @decorators.action(methods=['post'], detail=True, url_path="launch-build")
     def launch_build(self, request, pk=None):
         build_server = request.data.get('build_server')
@@ -126,6 +168,10 @@ class OperationSuiteDetailView(generics.RetrieveAPIView):
     queryset = OperationSuite.objects.all()
     serializer_class = OperationSuiteSerializer
 
+    @chat_version_etag(OperationSuite, "revision__message__chat")
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 # todo: prevent updates
 class ThreadViewSet(viewsets.ModelViewSet):
@@ -158,6 +204,120 @@ class StandardResultsSetPagination(PageNumberPagination):
         })
 
 
+class KeysetPagination(BasePagination):
+    """Pages through a queryset ordered by (field, id), both descending or both ascending.
+
+    Pages start after the row encoded in an opaque cursor, so there is no COUNT(*) or
+    OFFSET and pages do not shift when rows are added. The total count is returned only
+    for ?with_count=1 and is cached for count_cache_timeout seconds. Requests with a page
+    number and querysets in any other order (e.g. ranked search results) are paginated
+    by StandardResultsSetPagination instead.
+    """
+    field = 'created'
+    page_size = 8
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    count_cache_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        order_by = tuple(queryset.query.order_by)
+        if order_by not in [(f'-{self.field}', '-id'), (self.field, 'id')] or 'page' in request.query_params:
+            self.fallback = StandardResultsSetPagination()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.fallback = None
+        self.request = request
+        self.queryset = queryset
+        descending = order_by[0].startswith('-')
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        backwards = False
+        if cursor is not None:
+            value, pk, backwards = cursor
+            lookup = 'lt' if descending != backwards else 'gt'
+            queryset = queryset.filter(**{f'{self.field}__{lookup}e': value}).filter(
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{f'id__{lookup}': pk})
+            )
+        if backwards:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        self.page = rows[:page_size]
+        if backwards:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk, backwards = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = self.queryset.model._meta.get_field(self.field).to_python(value)
+            return value, int(pk), bool(backwards)
+        except (TypeError, ValueError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor"})
+
+    def encode_cursor(self, obj, backwards):
+        value = self.queryset.model._meta.get_field(self.field).value_to_string(obj)
+        data = json.dumps([value, obj.pk, int(backwards)])
+        encoded = base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], backwards=True)
+
+    def get_count(self):
+        """Total number of rows, computed lazily once the cached value expires"""
+        key = 'keyset-count:' + hashlib.sha1(str(self.queryset.query).encode('utf-8')).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(key, count, timeout=self.count_cache_timeout)
+        return count
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        with_count = self.request.query_params.get(self.count_query_param) in ('1', 'true')
+        return Response({
+            'links': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link()
+            },
+            'count': self.get_count() if with_count else None,
+            'results': data
+        })
+
+
+class GenerationPagination(KeysetPagination):
+    field = 'start_time'
+
+
 
 class ResourceViewSet(mixins.CreateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     queryset = Resource.objects.all()
@@ -167,9 +327,13 @@ class ResourceViewSet(mixins.CreateModelMixin, mixins.DestroyModelMixin, viewset
 class ChatViewSet(viewsets.ModelViewSet):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetPagination
     # todo: fix tests if any were broken by this
 
+    @chat_version_etag(Chat)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @decorators.action(methods=['get'], detail=True)
     def last_text(self, request, pk=None):
         chat = self.get_object()
@@ -177,12 +341,43 @@ class ChatViewSet(viewsets.ModelViewSet):
         return Response({'last_text': text})
 
     @decorators.action(methods=['get'], detail=True, url_path="revisions")
+    @chat_version_etag(Chat)
     def revisions(self, request, pk=None):
         chat = self.get_object()
-        revisions = chat.get_revisions()
+        revisions = chat.get_revisions().prefetch_related('threads', 'suites')
+        if request.query_params.get('changes_only') in ('1', 'true'):
+            diff_format = get_diff_format(request)
+            revisions = diffs.prefetch_changes(revisions, diff_format)
+            context = {'request': request, 'diff_format': diff_format}
+            ser = RevisionChangesSerializer(revisions, many=True, context=context)
+            return Response(ser.data)
+
+        revisions = Revision.prefetch_src_trees(revisions)
         ser = RevisionSerializer(revisions, many=True, context={'request': request})
         return Response(ser.data)
 
+    @decorators.action(methods=['get'], detail=True)
+    def sync(self, request, pk=None):
+        chat = self.get_object()
+        cursor = request.query_params.get('since')
+        try:
+            since = sync.decode_cursor(cursor) if cursor else None
+        except (ValueError, OverflowError):
+            return Response({"since": f"Invalid cursor: {cursor}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes, deleted, new_cursor = sync.get_chat_changes(chat, since)
+        context = {'request': request}
+        return Response({
+            "cursor": new_cursor or cursor,
+            "messages": SyncMessageSerializer(changes["messages"], many=True, context=context).data,
+            "modalities": SyncModalitySerializer(changes["modalities"], many=True, context=context).data,
+            "revisions": SyncRevisionSerializer(
+                Revision.prefetch_src_trees(changes["revisions"]), many=True, context=context
+            ).data,
+            "generations": SyncGenerationSerializer(changes["generations"], many=True, context=context).data,
+            "deleted": deleted
+        })
+
     @decorators.action(methods=['post'], detail=False, url_path="start-new-chat")
     def start_new_chat(self, request):
         serializer = ChatSerializer(data=request.data, context={'request': request}) # todo: need to use new serializer with prompt field
@@ -218,49 +413,43 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         term = self.request.query_params.get("term", "")
-        sortby = self.request.query_params.get("sortby", "newest")
-        ordering = "created" if sortby == "oldest" else "-created"
+        sortby = self.request.query_params.get("sortby", "relevance" if term else "newest")
+        ordering = ("created", "id") if sortby == "oldest" else ("-created", "-id")
         filter = self.request.query_params.get("filter", "all")
 
         queryset = self.queryset
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.select_related('configuration').prefetch_related('messages', 'resources')
         if filter != "all":
-            revision_chat_ids = Revision.objects.all().values_list('message__chat__id', flat=True)
+            has_code = Exists(Revision.objects.filter(message__chat=OuterRef('pk')))
 
             if filter == "withCode":
-                queryset = self.queryset.filter(id__in=revision_chat_ids)
+                queryset = queryset.filter(has_code)
             elif filter == "noCode":
-                queryset = self.queryset.exclude(id__in=revision_chat_ids)
+                queryset = queryset.exclude(has_code)
+
+        if not term:
+            return queryset.order_by(*ordering)
 
-        return queryset.filter(name__contains=term).order_by(ordering).distinct()
+        ranked = sortby == "relevance"
+        queryset = search_backends.get_search_backend().filter_chats(queryset, term, ranked=ranked)
+        if ranked and queryset.ordered:
+            return queryset
+        return queryset.order_by(*ordering)
 
     @decorators.action(methods=['get'], detail=True)
     def generations(self, request, pk=None):
         chat = self.get_object()
 
-        chat_messages = self.get_all_messages(chat)
-
-        ids = list(chat_messages.values_list('id', flat=True))
-    
-        result_queryset = Generation.objects.filter(message__id__in=ids) | Generation.objects.filter(chat=chat)
+        result_queryset = Generation.objects.filter(
+            Q(chat=chat) | Q(message__chat=chat)
+        ).select_related('generation_metadata').order_by('pk')
 
         status_filter = self.request.query_params.get('status')
         result_queryset = filter_generations(result_queryset, status_filter)
 
         return Response(GenerationSerializer(result_queryset, many=True).data)
 
-    def get_all_messages(self, chat):
-        all_messages_queryset = MultimediaMessage.objects.none()
-        def collect(msg):
-            nonlocal all_messages_queryset
-            all_messages_queryset = all_messages_queryset | msg.replies.all()
-            for reply in msg.replies.all():
-                collect(reply)
-
-        for root in chat.messages.all():
-            collect(root)
-
-        return all_messages_queryset
-
 
 class MultimediaMessageViewSet(viewsets.ModelViewSet):
     queryset = MultimediaMessage.objects.all()
@@ -272,6 +461,25 @@ class MultimediaMessageViewSet(viewsets.ModelViewSet):
             kwargs["with_replies"] = False
         return super().get_serializer(*args, **kwargs)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ['list', 'retrieve']:
+            context["tree_cache_variant"] = tree_cache.get_variant(self.request)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        messages = prefetch_message_trees(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(messages, many=True)
+        return Response(serializer.data)
+
+    @tree_cache.cached_message_tree
+    @chat_version_etag(MultimediaMessage, "chat")
+    def retrieve(self, request, *args, **kwargs):
+        message = self.get_object()
+        prefetch_message_trees([message])
+        serializer = self.get_serializer(message)
+        return Response(serializer.data)
+
 
     @decorators.action(methods=['post'], detail=True)
     def regenerate(self, request, pk=None):
@@ -351,9 +559,10 @@ class GenerationViewSet(mixins.CreateModelMixin,
                         viewsets.GenericViewSet):
     queryset = Generation.objects.all()
     serializer_class = GenerationSerializer
+    pagination_class = GenerationPagination
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().order_by('-start_time', '-id')
         status_filter = self.request.query_params.get('status')
         return filter_generations(queryset, status_filter)
 
@@ -379,3 +588,13 @@ def filter_generations(queryset, status_filter):
             queryset = queryset.filter(finished=True, errors__isnull=True)
     
     return queryset
+
+
+@api_view(['GET'])
+def tree_cache_stats(request):
+    return Response(tree_cache.get_stats())
+
+
+@api_view(['GET'])
+def profiler_stats(request):
+    return Response(profiling.get_endpoint_stats())
@@ -0,0 +1,254 @@
+"""Local OpenAI-compatible streaming server with a configurable token rate.
+
+Serves streaming /v1/chat/completions (used by the "openai_compatible" backend) and
+/v1/responses (used by the "openai_compatible_mcp" backend). Only the stdlib is needed:
+
+    python -m benchmarks.fake_openai --port 8089 --tokens-per-second 50 --ttft 0.5
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+words = ("const App = () => { return <div className=\"app\">Hello</div>; }; "
+         "export default App; import React from 'react'; the component renders a list").split()
+
+
+@dataclass
+class Scenario:
+    tokens_per_second: float = 50.0
+    ttft: float = 0.5
+    num_tokens: int = 200
+    reasoning_tokens: int = 0
+    reasoning_tag: str = "think"
+    tool_calls: bool = False
+    tool_name: str = "get_weather"
+    seed: int = None
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+    def make_tokens(self, count):
+        rng = random.Random(self.seed)
+        return [rng.choice(words) + " " for _ in range(count)]
+
+    def tool_arguments(self):
+        return json.dumps({"city": "Paris"})
+
+
+def iter_paced(tokens, scenario):
+    """Yields tokens after the time to first token, then at the configured rate"""
+    time.sleep(scenario.ttft)
+    delay = scenario.token_delay()
+    for i, token in enumerate(tokens):
+        if i > 0 and delay:
+            time.sleep(delay)
+        yield token
+
+
+def chat_completion_chunks(scenario, model):
+    """Chunks of a streamed chat completion; reasoning is wrapped in <think>-like tags"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    tokens = scenario.make_tokens(scenario.num_tokens)
+    if scenario.reasoning_tokens:
+        tag = scenario.reasoning_tag
+        thoughts = scenario.make_tokens(scenario.reasoning_tokens)
+        tokens = [f"<{tag}>"] + thoughts + [f"</{tag}>"] + tokens
+
+    first = True
+    for token in iter_paced(tokens, scenario):
+        delta = {"content": token}
+        if first:
+            delta["role"] = "assistant"
+            first = False
+        yield chunk(delta)
+
+    if scenario.tool_calls:
+        tool_call = {
+            "index": 0,
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": scenario.tool_name, "arguments": scenario.tool_arguments()}
+        }
+        yield chunk({"tool_calls": [tool_call]})
+        yield chunk({}, finish_reason="tool_calls")
+    else:
+        yield chunk({}, finish_reason="stop")
+
+
+def has_tool_output(input_items):
+    return any(isinstance(item, dict) and item.get("type") == "function_call_output"
+               for item in input_items or [])
+
+
+def response_events(scenario, model, input_items=None):
+    """Events of a streamed Responses API call.
+
+    A function call is only emitted while the input has no function call output,
+    otherwise a client that runs tools would loop forever.
+    """
+    response_id = f"resp_{uuid.uuid4().hex}"
+    seq = 0
+    output = []
+
+    def event(event_type, **kwargs):
+        nonlocal seq
+        seq += 1
+        return {"type": event_type, "sequence_number": seq, **kwargs}
+
+    def response(status):
+        return {"id": response_id, "object": "response", "created_at": int(time.time()),
+                "model": model, "status": status, "output": list(output), "error": None}
+
+    yield event("response.created", response=response("in_progress"))
+
+    paced = iter_paced(scenario.make_tokens(scenario.reasoning_tokens + scenario.num_tokens), scenario)
+
+    if scenario.reasoning_tokens:
+        index = len(output)
+        item_id = f"rs_{uuid.uuid4().hex}"
+        item = {"id": item_id, "type": "reasoning", "summary": [], "content": []}
+        yield event("response.output_item.added", output_index=index, item=item)
+        thoughts = ""
+        for _ in range(scenario.reasoning_tokens):
+            token = next(paced)
+            thoughts += token
+            yield event("response.reasoning_text.delta", item_id=item_id, output_index=index,
+                        content_index=0, delta=token)
+        yield event("response.reasoning_text.done", item_id=item_id, output_index=index,
+                    content_index=0, text=thoughts)
+        item = dict(item, content=[{"type": "reasoning_text", "text": thoughts}])
+        output.append(item)
+        yield event("response.output_item.done", output_index=index, item=item)
+
+    index = len(output)
+    item_id = f"msg_{uuid.uuid4().hex}"
+    item = {"id": item_id, "type": "message", "role": "assistant", "status": "in_progress", "content": []}
+    yield event("response.output_item.added", output_index=index, item=item)
+    part = {"type": "output_text", "text": "", "annotations": []}
+    yield event("response.content_part.added", item_id=item_id, output_index=index,
+                content_index=0, part=part)
+    text = ""
+    for token in paced:
+        text += token
+        yield event("response.output_text.delta", item_id=item_id, output_index=index,
+                    content_index=0, delta=token, logprobs=[])
+    yield event("response.output_text.done", item_id=item_id, output_index=index,
+                content_index=0, text=text, logprobs=[])
+    part = dict(part, text=text)
+    yield event("response.content_part.done", item_id=item_id, output_index=index,
+                content_index=0, part=part)
+    item = dict(item, status="completed", content=[part])
+    output.append(item)
+    yield event("response.output_item.done", output_index=index, item=item)
+
+    if scenario.tool_calls and not has_tool_output(input_items):
+        index = len(output)
+        arguments = scenario.tool_arguments()
+        item = {"id": f"fc_{uuid.uuid4().hex}", "type": "function_call", "status": "completed",
+                "call_id": f"call_{uuid.uuid4().hex[:12]}", "name": scenario.tool_name,
+                "arguments": arguments}
+        yield event("response.output_item.added", output_index=index, item=dict(item, arguments=""))
+        yield event("response.function_call_arguments.delta", item_id=item["id"], output_index=index,
+                    delta=arguments)
+        yield event("response.function_call_arguments.done", item_id=item["id"], output_index=index,
+                    arguments=arguments)
+        output.append(item)
+        yield event("response.output_item.done", output_index=index, item=item)
+
+    yield event("response.completed", response=response("completed"))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    scenario = Scenario()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self.send_json({"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model") or "fake-model"
+        path = self.path.rstrip("/")
+
+        if path == "/v1/chat/completions":
+            chunks = chat_completion_chunks(self.scenario, model)
+            self.send_stream(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks)
+        elif path == "/v1/responses":
+            events = response_events(self.scenario, model, body.get("input"))
+            self.send_stream(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events)
+        else:
+            self.send_error(404)
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, messages):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for message in messages:
+            self.write_chunk(message.encode())
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host, port, scenario):
+    handler_class = type("ScenarioHandler", (FakeOpenAIHandler,), {"scenario": scenario})
+    return ThreadingHTTPServer((host, port), handler_class)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start a fake OpenAI-compatible streaming server")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--ttft", type=float, default=0.5, help="Time to first token in seconds")
+    parser.add_argument("--num-tokens", type=int, default=200)
+    parser.add_argument("--reasoning-tokens", type=int, default=0,
+                        help="Number of tokens streamed as reasoning before the answer")
+    parser.add_argument("--reasoning-tag", type=str, default="think")
+    parser.add_argument("--tool-calls", action="store_true",
+                        help="End every first turn with a function call")
+    args = parser.parse_args()
+
+    scenario = Scenario(tokens_per_second=args.tokens_per_second, ttft=args.ttft,
+                        num_tokens=args.num_tokens, reasoning_tokens=args.reasoning_tokens,
+                        reasoning_tag=args.reasoning_tag, tool_calls=args.tool_calls)
+    server = make_server(args.host, args.port, scenario)
+    print(f"Fake OpenAI server is listening on {args.host}:{args.port}")
+    server.serve_forever()
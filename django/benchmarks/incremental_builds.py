@@ -0,0 +1,105 @@
+"""Compares full and incremental builds of the react builder.
+
+Every round builds a generated app from scratch, then rebuilds it with one component
+changed, passing the first build as base_build_id so that the builder reuses its
+workspace and webpack cache. Sources differ between rounds, so the build cache of the
+builder is never hit. Run from the django directory against a running builder:
+
+    python -m benchmarks.incremental_builds --builder http://localhost:8888 --components 50 --rounds 5
+
+Reports build_seconds as measured by the builder (webpack only, without queueing).
+"""
+import argparse
+import io
+import statistics
+import tarfile
+import uuid
+import requests
+
+
+def make_sources(num_components, marker, changed=None):
+    """index.js rendering num_components components, one module per component"""
+    files = {}
+    imports = []
+    elements = []
+    for i in range(num_components):
+        name = f"Component{i}"
+        body = (f"import React from 'react';\n\n"
+                f"export default function {name}(props) {{\n"
+                f"    const items = [1, 2, 3].map(n => <li key={{n}}>{name} item {{n}}</li>);\n"
+                f"    return <ul className=\"{name.lower()}\">{{items}}</ul>;\n"
+                f"}}\n")
+        if i == changed:
+            body += f"// changed in {marker}\n"
+        files[f"components/{name}.js"] = body
+        imports.append(f"import {name} from './components/{name}';")
+        elements.append(f"        <{name} />")
+
+    files["index.js"] = "\n".join([
+        "import React from 'react';",
+        "import { createRoot } from 'react-dom/client';",
+        *imports,
+        "",
+        f"// {marker}",
+        "function App() {",
+        "    return <div>",
+        *elements,
+        "    </div>;",
+        "}",
+        "",
+        "createRoot(document.getElementById('root') || document.body).render(<App />);",
+        ""
+    ])
+    return files
+
+
+def make_tar(files):
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode="w") as tar:
+        for path, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name=path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    f.seek(0)
+    return f
+
+
+def post_build(builder_url, files, base_build_id=None):
+    data = {"base_build_id": base_build_id} if base_build_id else {}
+    response = requests.post(f"{builder_url}/build-spa/", files={"src": make_tar(files)}, data=data)
+    response.raise_for_status()
+    result = response.json()
+    if not result["success"]:
+        raise Exception(f"Build failed: {result['stderr'] or result['stdout']}")
+    return result
+
+
+def run(builder_url, num_components, rounds):
+    full = []
+    incremental = []
+    for i in range(rounds):
+        marker = uuid.uuid4().hex
+        base = post_build(builder_url, make_sources(num_components, marker))
+        rebuild = post_build(builder_url, make_sources(num_components, marker, changed=0),
+                             base_build_id=base["build_id"])
+        if not rebuild.get("incremental"):
+            print(f"round {i}: the builder did not reuse the base workspace")
+
+        full.append(base["build_seconds"])
+        incremental.append(rebuild["build_seconds"])
+        print(f"round {i}: full {base['build_seconds']:.2f} s, incremental {rebuild['build_seconds']:.2f} s")
+
+    full_median = statistics.median(full)
+    incremental_median = statistics.median(incremental)
+    print(f"median of {rounds} rounds with {num_components} components: full {full_median:.2f} s, "
+          f"incremental {incremental_median:.2f} s, speedup {full_median / incremental_median:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full and incremental builds of the react builder")
+    parser.add_argument("--builder", default="http://localhost:8888")
+    parser.add_argument("--components", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    run(args.builder, args.components, args.rounds)
@@ -0,0 +1,282 @@
+"""End-to-end streaming load test: HTTP API -> Celery -> _generate -> Redis -> websocket relay -> clients.
+
+Start the fake LLM server (benchmarks/fake_openai.py) somewhere reachable from the Celery
+worker, run Django with GENERATION_BACKEND = "openai_compatible" and (optionally) start the
+worker with BENCHMARK_TASK_STATS=1 to get DB query counts. Then:
+
+    python -m benchmarks.streaming --api http://localhost/api --ws ws://localhost/ws_chat/ \\
+        --llm-url http://172.17.0.1:8089 --clients 10 --generations 20 --concurrency 4
+
+Reports time to first token, inter-token latency percentiles, DB queries and Redis
+operations per generation. --output saves the report as JSON for regression comparisons.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import httpx
+import redis
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from benchmarks.task_stats import stats_key
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(values, scale=1000):
+    """Percentiles of a list of seconds, in milliseconds"""
+    if not values:
+        return dict(count=0)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50) * scale,
+        "p90": percentile(values, 90) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale
+    }
+
+
+class StreamClient:
+    """A websocket client recording arrival times of token deltas per generation"""
+
+    def __init__(self, url, subprotocol=None):
+        self.url = url
+        self.subprotocol = subprotocol
+        self.deltas = {}
+        self.ended = {}
+        self.handles = {}
+        self.bytes_received = 0
+        self.connection = None
+
+    async def connect(self):
+        kwargs = dict(subprotocols=[self.subprotocol]) if self.subprotocol else {}
+        self.connection = await websockets.connect(self.url, max_size=None, **kwargs)
+        await self.connection.send("0")
+
+    async def listen(self):
+        try:
+            async for message in self.connection:
+                self.bytes_received += len(message)
+                self.on_message(self.decode(message), time.monotonic())
+        except websockets.ConnectionClosed:
+            pass
+
+    def decode(self, message):
+        if isinstance(message, bytes):
+            return msgpack.unpackb(message)
+        return json.loads(message)
+
+    def on_message(self, event, now):
+        if isinstance(event, list):
+            # compact delta: [generation handle, item index, text]
+            task_id = self.handles.get(event[0])
+            self.deltas.setdefault(task_id, []).append(now)
+            return
+
+        event_type = event.get("event_type")
+        data = event.get("data") or {}
+        task_id = data.get("task_id")
+
+        if event_type == "generation_handle":
+            self.handles[data["handle"]] = task_id
+        elif event_type == "response_event":
+            response_event = data.get("response_event") or {}
+            if response_event.get("type", "").endswith(".delta"):
+                self.deltas.setdefault(task_id, []).append(now)
+        elif event_type == "generation_ended":
+            self.ended[task_id] = now
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.api = args.api.rstrip("/")
+        self.started = {}
+        self.errors = []
+
+    async def setup(self, http):
+        """Creates a server pointing at the fake LLM, a configuration, a chat and its first message"""
+        suffix = uuid.uuid4().hex[:8]
+
+        async def post(path, data):
+            response = await http.post(f"{self.api}/{path}/", json=data)
+            response.raise_for_status()
+            return response.json()
+
+        await post("servers", dict(name=f"bench-llm-{suffix}", url=self.args.llm_url))
+        await post("presets", dict(name=f"bench-{suffix}", temperature=0.7, top_k=40, top_p=0.9,
+                                   min_p=0.1, repeat_penalty=1.1, n_predict=512))
+        config = await post("configs", dict(name=f"bench-{suffix}", preset=f"bench-{suffix}",
+                                            llm_server=f"bench-llm-{suffix}", build_servers=[],
+                                            lint_servers=[], test_servers=[], interaction_servers=[]))
+        chat = await post("chats", dict(name=f"benchmark {suffix}",
+                                        configuration=f"{self.api}/configs/{config['id']}/"))
+        modality = await post("modalities", dict(modality_type="text", text=self.args.prompt))
+        message = await post("multimedia-messages", dict(role="user", content=modality["id"],
+                                                         chat=chat["id"]))
+        return message["id"]
+
+    async def start_generation(self, http, message_id, semaphore):
+        async with semaphore:
+            t0 = time.monotonic()
+            response = await http.post(f"{self.api}/generations/", json=dict(
+                message=message_id, model_name=self.args.model, params={}
+            ))
+            if response.status_code != 201:
+                self.errors.append(f"{response.status_code}: {response.text[:200]}")
+                return None
+            task_id = response.json()["task_id"]
+            self.started[task_id] = t0
+            return task_id
+
+    async def wait_for_completion(self, client):
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline:
+            if self.started and all(task_id in client.ended for task_id in self.started):
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+    async def run(self):
+        redis_client = redis.Redis.from_url(self.args.redis) if self.args.redis else None
+
+        async with httpx.AsyncClient(timeout=60) as http:
+            message_id = await self.setup(http)
+
+            clients = [StreamClient(self.args.ws, self.args.subprotocol) for _ in range(self.args.clients)]
+            await asyncio.gather(*[client.connect() for client in clients])
+            listeners = [asyncio.create_task(client.listen()) for client in clients]
+
+            redis_before = get_command_calls(redis_client)
+            t0 = time.monotonic()
+
+            semaphore = asyncio.Semaphore(self.args.concurrency)
+            await asyncio.gather(*[self.start_generation(http, message_id, semaphore)
+                                   for _ in range(self.args.generations)])
+            completed = await self.wait_for_completion(clients[0])
+            elapsed = time.monotonic() - t0
+
+            redis_after = get_command_calls(redis_client)
+
+            await asyncio.gather(*[client.close() for client in clients])
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+        return self.make_report(clients, completed, elapsed, redis_client, redis_before, redis_after)
+
+    def make_report(self, clients, completed, elapsed, redis_client, redis_before, redis_after):
+        ttfts = []
+        inter_token = []
+        tokens = 0
+        for client in clients:
+            for task_id, t0 in self.started.items():
+                arrivals = client.deltas.get(task_id, [])
+                tokens += len(arrivals)
+                if arrivals:
+                    ttfts.append(arrivals[0] - t0)
+                    inter_token.extend(b - a for a, b in zip(arrivals, arrivals[1:]))
+
+        num_generations = len(self.started)
+        report = {
+            "completed": completed,
+            "generations": num_generations,
+            "clients": len(clients),
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "frames_received": tokens,
+            "bytes_received": sum(client.bytes_received for client in clients),
+            "ttft_ms": summarize(ttfts),
+            "inter_token_ms": summarize(inter_token)
+        }
+
+        if redis_client is not None and num_generations:
+            delta = {name: redis_after.get(name, 0) - calls for name, calls in redis_before.items()}
+            delta.update({name: calls for name, calls in redis_after.items() if name not in redis_before})
+            report["redis_ops_per_generation"] = sum(delta.values()) / num_generations
+            report["redis_publish_per_generation"] = delta.get("publish", 0) / num_generations
+            report["db"] = get_query_stats(redis_client, self.started)
+
+        return report
+
+
+def get_command_calls(redis_client):
+    if redis_client is None:
+        return {}
+    stats = redis_client.info("commandstats")
+    return {name[len("cmdstat_"):]: entry["calls"] for name, entry in stats.items()}
+
+
+def get_query_stats(redis_client, task_ids):
+    records = redis_client.hmget(stats_key, list(task_ids))
+    records = [json.loads(record) for record in records if record]
+    if not records:
+        return {"note": "no data, start the Celery worker with BENCHMARK_TASK_STATS=1"}
+
+    queries = [record["queries"] for record in records]
+    db_time = [record["db_time_ms"] for record in records]
+    return {
+        "generations": len(records),
+        "queries_per_generation": sum(queries) / len(records),
+        "max_queries": max(queries),
+        "db_time_ms_per_generation": sum(db_time) / len(records)
+    }
+
+
+def print_report(report):
+    print(f"Generations: {report['generations']} (completed: {report['completed']}), "
+          f"clients: {report['clients']}, elapsed: {report['elapsed_s']:.2f} s")
+    print(f"Frames received: {report['frames_received']}, bytes received: {report['bytes_received']}")
+    for name in ("ttft_ms", "inter_token_ms"):
+        stats = report[name]
+        if stats["count"]:
+            print(f"{name:<16} p50={stats['p50']:.1f} p90={stats['p90']:.1f} "
+                  f"p99={stats['p99']:.1f} max={stats['max']:.1f} (n={stats['count']})")
+    if "redis_ops_per_generation" in report:
+        print(f"Redis ops per generation: {report['redis_ops_per_generation']:.1f} "
+              f"(publish: {report['redis_publish_per_generation']:.1f})")
+        print(f"DB: {report['db']}")
+    for error in report["errors"]:
+        print("Error:", error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an end-to-end streaming benchmark")
+    parser.add_argument("--api", type=str, default="http://localhost/api")
+    parser.add_argument("--ws", type=str, default="ws://localhost/ws_chat/")
+    parser.add_argument("--redis", type=str, default="redis://localhost:6379",
+                        help="Redis URL used for operation counts and DB stats (empty to skip)")
+    parser.add_argument("--llm-url", type=str, default="http://172.17.0.1:8089",
+                        help="URL of the fake OpenAI server as seen from the Celery worker")
+    parser.add_argument("--model", type=str, default="fake-model")
+    parser.add_argument("--prompt", type=str, default="Write a React counter component")
+    parser.add_argument("--clients", type=int, default=1, help="Number of websocket clients")
+    parser.add_argument("--generations", type=int, default=1, help="Number of generations to start")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Max number of in-flight generation requests")
+    parser.add_argument("--subprotocol", type=str, default=None,
+                        help="Websocket subprotocol to negotiate (e.g. events.compact.json)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", type=str, default=None, help="Save the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(Benchmark(args).run())
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
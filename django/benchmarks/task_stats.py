@@ -0,0 +1,54 @@
+"""Counts DB queries made by each generate_completion task and stores them in Redis.
+
+The handlers are connected by mysite/celery.py when the Celery worker is started with
+the BENCHMARK_TASK_STATS environment variable set. benchmarks/streaming.py reads the results.
+"""
+import json
+import time
+import redis
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.db import connection
+
+
+stats_key = "benchmark:generation_queries"
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.monotonic() - start
+
+
+counters = {}
+
+
+@task_prerun.connect
+def start_counting(task_id=None, task=None, **kwargs):
+    counter = QueryCounter()
+    counters[task_id] = counter
+    connection.execute_wrappers.append(counter)
+
+
+@task_postrun.connect
+def stop_counting(task_id=None, task=None, args=None, kwargs=None, **extra):
+    counter = counters.pop(task_id, None)
+    if counter is None:
+        return
+
+    connection.execute_wrappers.remove(counter)
+
+    if not task.name.endswith("generate_completion"):
+        return
+
+    config = args[0] if args else kwargs["completion_config"]
+    record = dict(queries=counter.count, db_time_ms=counter.duration * 1000)
+    redis.Redis(settings.REDIS_HOST).hset(stats_key, config["task_id"], json.dumps(record))
@@ -0,0 +1,94 @@
+"""Measures bytes on the wire per 1k streamed tokens for every websocket event protocol.
+
+Run from the django directory:
+
+    python -m benchmarks.ws_encoding --tokens 1000
+"""
+import argparse
+import json
+import random
+import uuid
+from websockets.frames import Frame as WireFrame, Opcode
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+import websocket_server
+from websocket_server import Frame, parse_delta, protocols
+
+
+words = ("the quick brown fox jumps over a lazy dog while react renders "
+         "components with hooks state props and effects").split()
+
+
+def make_events(num_tokens, seed=0):
+    rng = random.Random(seed)
+    task_id = uuid.uuid4().hex
+    item_id = f"msg_{uuid.uuid4().hex}"
+
+    events = [dict(event_type="generation_started", data=dict(task_id=task_id))]
+    for seq in range(num_tokens):
+        response_event = {
+            "type": "response.output_text.delta",
+            "output_index": 0,
+            "sequence_number": seq + 3,
+            "item_id": item_id,
+            "content_index": 0,
+            "delta": rng.choice(words) + " "
+        }
+        events.append(dict(event_type="response_event",
+                           data=dict(response_event=response_event, task_id=task_id)))
+    events.append(dict(event_type="generation_ended", data=dict(task_id=task_id)))
+    return [json.dumps(event) for event in events]
+
+
+def header_size(length):
+    # server to client frames are not masked
+    if length < 126:
+        return 2
+    if length < 65536:
+        return 4
+    return 10
+
+
+def measure(payloads, protocol_cls, deflate):
+    protocol = protocol_cls()
+    extension = None
+    if deflate:
+        extension = PerMessageDeflate(False, False, 12, 12, {"memLevel": 5})
+
+    total = 0
+    messages = 0
+    for payload in payloads:
+        event, delta_key = parse_delta(payload)
+        for message in protocol.encode(Frame(payload, event, delta_key)):
+            if isinstance(message, str):
+                wire_frame = WireFrame(Opcode.TEXT, message.encode())
+            else:
+                wire_frame = WireFrame(Opcode.BINARY, message)
+
+            if extension:
+                wire_frame = extension.encode(wire_frame)
+
+            total += header_size(len(wire_frame.data)) + len(wire_frame.data)
+            messages += 1
+    return total, messages
+
+
+def run(num_tokens):
+    payloads = make_events(num_tokens)
+    per_1k = 1000 / num_tokens
+
+    print(f"{'protocol':<22}{'compression':<14}{'frames':>8}{'bytes':>12}{'bytes/1k tokens':>18}")
+    for name, protocol_cls in protocols.items():
+        for deflate in (False, True):
+            total, messages = measure(payloads, protocol_cls, deflate)
+            print(f"{name or 'json (default)':<22}{'deflate' if deflate else 'none':<14}"
+                  f"{messages:>8}{total:>12}{total * per_1k:>18.0f}")
+
+    if websocket_server.msgpack is None:
+        print("msgpack is not installed, binary protocol was skipped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark websocket event encodings")
+    parser.add_argument("--tokens", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.tokens)
@@ -16,6 +16,10 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+if os.environ.get('BENCHMARK_TASK_STATS'):
+    # count DB queries per generation for benchmarks/streaming.py
+    import benchmarks.task_stats  # noqa: F401
+
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
@@ -0,0 +1 @@
+SECRET_KEY="k@0oz)+yqi5q26&@30cl=$x)42y!ts4bp8dy3_sk0%kdo+y47o"
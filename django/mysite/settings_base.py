@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'assistant.profiling.RequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -125,6 +126,51 @@ ARTIFACTS_ROOT = '/data/artifacts'
 
 ARTIFACTS_URL = '/artifacts'
 
+# seconds without any data (builders send heartbeats) before a build log stream is abandoned
+BUILD_LOG_READ_TIMEOUT = 60
+
+# seconds to wait for a build server to report its queue length (least loaded build strategy)
+BUILD_QUEUE_STATS_TIMEOUT = 2
+
+# seconds to wait for a lint or test server to check the sources of an operation suite
+QA_REQUEST_TIMEOUT = 600
+
+# retention of downloaded build artifacts, see assistant/retention.py
+ARTIFACTS_KEEP_PER_REVISION = 2
+
+ARTIFACTS_MAX_BYTES = 10 * 1024 ** 3
+
+ARTIFACTS_ORPHAN_AGE = 24 * 3600
+
+# seconds before a sync cursor that are scanned again: rows saved before the cursor was
+# issued but committed after it are picked up by the next sync, see assistant/sync.py
+SYNC_RESCAN_WINDOW = 5
+
+# requests slower than this are printed with their most repeated queries, see assistant/profiling.py
+SLOW_REQUEST_MS = 1000
+
+# maximum number of database queries per request of an endpoint ("<view>.<action>"),
+# requests over budget are printed, or fail when QUERY_BUDGETS_ENFORCED is set (tests)
+QUERY_BUDGETS = {
+    "ChatViewSet.list": 6,
+    "ChatViewSet.retrieve": 5,
+    "ChatViewSet.sync": 13,
+    "ChatViewSet.generations": 3,
+    "ChatViewSet.revisions": 9,
+    "MultimediaMessageViewSet.list": 8,
+    "MultimediaMessageViewSet.retrieve": 12,
+    "GenerationViewSet.list": 2,
+    "OperationSuiteDetailView.get": 14,
+    "RevisionViewSet.diff": 10,
+}
+
+QUERY_BUDGETS_ENFORCED = False
+
+# full-text search over chats, see assistant/search_backends.py ("simple" for databases without FTS5)
+SEARCH_BACKEND = {
+    "name": "fts5"
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -132,8 +178,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REDIS_HOST = "redis"
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # serialized message subtrees shared by all processes, see assistant/tree_cache.py
+    "trees": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:6379/1",
+        "TIMEOUT": 24 * 3600,
+    }
+}
+
 CELERY_RESULT_BACKEND = "rpc://"
 
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
 CELERY_BROKER_URL = "redis://redis:6379"
+
+CELERY_BEAT_SCHEDULE = {
+    "collect-artifacts": {
+        "task": "assistant.tasks.collect_artifacts_garbage",
+        "schedule": 3600
+    }
+}
@@ -3,3 +3,15 @@ from mysite.settings_base import *
 GENERATION_BACKEND = "dummy"
 SUMMARIZATION_BACKEND = "dummy"
 TEXT_TO_IMAGE_BACKEND = "dummy"
+
+QUERY_BUDGETS_ENFORCED = True
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # ids are reused between tests, tree cache tests enable it with override_settings
+    "trees": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+}
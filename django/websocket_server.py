@@ -1,12 +1,318 @@
+import os
+import signal
 import asyncio
 import json
+import time
 import argparse
+from collections import deque
 import websockets
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 import redis.asyncio as redis
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 main_events_stream = "main_events_stream"
 
+# per-process state, (re)initialized by run_worker after a fork
+r = None
+queue_size = 1000
+max_lag = 10.0
+worker_index = 0
+connections = {}
+
+# delta event types that can be sent as compact frames, keyed by their text field
+COMPACT_DELTA_TYPES = {"response.output_text.delta", "response.reasoning_text.delta"}
+
+
+class SlowConsumerError(Exception):
+    pass
+
+
+class RelayStats:
+    def __init__(self):
+        self.connections = 0
+        self.received_frames = 0
+        self.queued_frames = 0
+        self.merged_frames = 0
+        self.sent_frames = 0
+        self.slow_disconnects = 0
+        self.max_queue_depth = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.queues = set()
+        self.messages_per_second = 0.0
+        self.sent_per_second = 0.0
+
+    def record_enqueue(self, depth):
+        self.queued_frames += 1
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_send(self, seconds_in_queue):
+        self.sent_frames += 1
+        self.queue_time_total += seconds_in_queue
+        self.queue_time_max = max(self.queue_time_max, seconds_in_queue)
+
+    def snapshot(self):
+        depths = [len(queue) for queue in self.queues]
+        avg_queue_time = self.queue_time_total / self.sent_frames if self.sent_frames else 0.0
+        return {
+            "connections": self.connections,
+            "messages_per_second": self.messages_per_second,
+            "sent_per_second": self.sent_per_second,
+            "received_frames": self.received_frames,
+            "queued_frames": self.queued_frames,
+            "merged_frames": self.merged_frames,
+            "sent_frames": self.sent_frames,
+            "slow_disconnects": self.slow_disconnects,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_peak": self.max_queue_depth,
+            "queue_time_avg_ms": avg_queue_time * 1000,
+            "queue_time_max_ms": self.queue_time_max * 1000
+        }
+
+
+stats = RelayStats()
+
+
+def get_delta_key(event):
+    """Returns a key identifying the stream a text delta event belongs to, None for other events"""
+    if event.get("event_type") != "response_event":
+        return None
+
+    data = event.get("data") or {}
+    response_event = data.get("response_event") or {}
+    event_type = response_event.get("type", "")
+    if not event_type.endswith(".delta") or not isinstance(response_event.get("delta"), str):
+        return None
+
+    return (data.get("task_id"), event_type, response_event.get("item_id"),
+            response_event.get("output_index"), response_event.get("content_index"),
+            response_event.get("summary_index"))
+
+
+def parse_delta(payload):
+    # cheap substring test spares us from decoding every frame
+    if '.delta"' not in payload:
+        return None, None
+
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return None, None
+
+    key = get_delta_key(event) if isinstance(event, dict) else None
+    return (event, key) if key else (None, None)
+
+
+class Frame:
+    def __init__(self, payload, event=None, delta_key=None):
+        self.payload = payload
+        self.event = event
+        self.delta_key = delta_key
+        self.enqueued_at = time.monotonic()
+
+    def merge(self, event):
+        """Appends a text of a subsequent delta event; other fields are taken from that event"""
+        delta = self.event["data"]["response_event"]["delta"] + event["data"]["response_event"]["delta"]
+        event["data"]["response_event"]["delta"] = delta
+        self.event = event
+        self.payload = None
+
+    def get_payload(self):
+        if self.payload is None:
+            self.payload = json.dumps(self.event)
+        return self.payload
+
+
+class SendQueue:
+    """Bounded buffer of outgoing frames for a single websocket connection.
+
+    Pending text deltas of the same response item are merged into one frame,
+    all other events are kept as is. Nothing is ever dropped: when the buffer is full
+    or its oldest frame has been waiting for longer than max_lag seconds,
+    SlowConsumerError is raised and the client is expected to be disconnected.
+    """
+
+    def __init__(self, max_size=1000, max_lag=10.0, stats=None):
+        self.max_size = max_size
+        self.max_lag = max_lag
+        self.stats = stats
+        self.frames = deque()
+        self.not_empty = asyncio.Event()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, payload):
+        if self.stats:
+            self.stats.received_frames += 1
+
+        if self.lagging():
+            raise SlowConsumerError(f"Oldest frame is waiting for more than {self.max_lag} seconds")
+
+        event, delta_key = parse_delta(payload)
+
+        tail = self.frames[-1] if self.frames else None
+        if delta_key and tail and tail.delta_key == delta_key:
+            tail.merge(event)
+            if self.stats:
+                self.stats.merged_frames += 1
+            return
+
+        if len(self.frames) >= self.max_size:
+            raise SlowConsumerError(f"Send queue is full ({self.max_size} frames)")
+
+        self.frames.append(Frame(payload, event, delta_key))
+        self.not_empty.set()
+        if self.stats:
+            self.stats.record_enqueue(len(self.frames))
+
+    async def get(self):
+        while not self.frames:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        frame = self.frames.popleft()
+        if self.stats:
+            self.stats.record_send(time.monotonic() - frame.enqueued_at)
+        return frame
+
+    def lagging(self):
+        if not self.frames or not self.max_lag:
+            return False
+        return time.monotonic() - self.frames[0].enqueued_at > self.max_lag
+
+
+class EventProtocol:
+    """Default protocol: every event is relayed as the JSON text frame published to Redis"""
+    subprotocol = None
+    compact = False
+
+    def __init__(self):
+        self.handles = {}
+
+    def encode(self, frame):
+        """Returns a list of websocket messages carrying the frame"""
+        if self.compact and frame.delta_key:
+            messages = self.encode_compact_delta(frame.event)
+            if messages:
+                return messages
+
+        return [self.encode_event(frame)]
+
+    def encode_event(self, frame):
+        return frame.get_payload()
+
+    def encode_compact_delta(self, event):
+        """Encodes a delta as a [generation handle, item index, text] array.
+
+        A handle is a small per-connection integer standing for a task id, it is announced
+        with a "generation_handle" event before its first use. Deltas which cannot be
+        identified by an item index alone are left to the regular encoding.
+        """
+        data = event["data"]
+        response_event = data["response_event"]
+        if response_event["type"] not in COMPACT_DELTA_TYPES:
+            return None
+
+        if response_event.get("content_index") or "summary_index" in response_event:
+            return None
+
+        messages = []
+        task_id = data.get("task_id")
+        handle = self.handles.get(task_id)
+        if handle is None:
+            handle = self.handles[task_id] = len(self.handles)
+            announcement = dict(event_type="generation_handle", data=dict(task_id=task_id, handle=handle))
+            messages.append(self.dump(announcement))
+
+        messages.append(self.dump([handle, response_event.get("output_index", 0), response_event["delta"]]))
+        return messages
+
+    def dump(self, obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+
+class CompactJsonProtocol(EventProtocol):
+    subprotocol = "events.compact.json"
+    compact = True
+
+
+class MsgpackProtocol(EventProtocol):
+    """Sends binary msgpack frames, text deltas use the compact encoding"""
+    subprotocol = "events.msgpack"
+    compact = True
+
+    def encode_event(self, frame):
+        event = frame.event if frame.event is not None else json.loads(frame.get_payload())
+        return self.dump(event)
+
+    def dump(self, obj):
+        return msgpack.packb(obj)
+
+
+protocols = {
+    cls.subprotocol: cls for cls in [EventProtocol, CompactJsonProtocol, MsgpackProtocol]
+    if cls is not MsgpackProtocol or msgpack is not None
+}
+
+
+def select_subprotocol(connection, subprotocols):
+    """Picks the first supported subprotocol offered by the client.
+
+    Clients that do not offer any (or only unknown ones) get the default JSON protocol.
+    """
+    for name in subprotocols:
+        if name in protocols:
+            return name
+    return None
+
+
+def get_compression_kwargs(compression):
+    if compression == "none":
+        return dict(compression=None)
+
+    # context takeover lets zlib reuse the keys repeated in every event;
+    # smaller windows and memLevel keep per-connection memory low
+    deflate = ServerPerMessageDeflateFactory(
+        server_max_window_bits=12,
+        client_max_window_bits=12,
+        compress_settings={"memLevel": 5}
+    )
+    return dict(compression=None, extensions=[deflate])
+
+
+async def relay_from_pubsub(pubsub, listening_channel, queue):
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+
+        if not message:
+            # an idle producer must not hide a stuck consumer
+            if queue.lagging():
+                raise SlowConsumerError(f"Oldest frame is waiting for more than {queue.max_lag} seconds")
+            continue
+
+        payload = message["data"].decode()
+        channel = message["channel"].decode()
+
+        if channel != listening_channel:
+            print("Unknown channel:", channel)
+            continue
+
+        queue.put(payload)
+
+
+async def relay_to_websocket(websocket, queue, protocol):
+    while True:
+        frame = await queue.get()
+        for message in protocol.encode(frame):
+            await websocket.send(message)
+
 
 async def handler(websocket):
     async with r.pubsub() as pubsub:
@@ -16,31 +322,217 @@ async def handler(websocket):
         listening_channel = f'{main_events_stream}:{socket_session_id}'
 
         await pubsub.subscribe(listening_channel)
-        
-        while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True)
 
-            if not message:
-                await asyncio.sleep(0.1)
-                continue
+        protocol = protocols[websocket.subprotocol]()
+        queue = SendQueue(max_size=queue_size, max_lag=max_lag, stats=stats)
+        stats.queues.add(queue)
+        stats.connections += 1
+        connections[websocket] = queue
 
-            payload = message["data"].decode()
-            channel = message["channel"].decode()
+        reader = asyncio.create_task(relay_from_pubsub(pubsub, listening_channel, queue))
+        writer = asyncio.create_task(relay_to_websocket(websocket, queue, protocol))
+        closed = asyncio.create_task(websocket.wait_closed())
 
-            if channel != listening_channel:
-                print("Unknown channel:", channel)
-                continue
+        try:
+            done, pending = await asyncio.wait([reader, writer, closed],
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+
+            for task in done:
+                exc = task.exception()
+                if isinstance(exc, SlowConsumerError):
+                    print(f"Disconnecting slow client: {exc}")
+                    stats.slow_disconnects += 1
+                    await websocket.close(code=1013, reason="Client is too slow")
+                elif task is closed or isinstance(exc, websockets.ConnectionClosed):
+                    print("Connection closed by the client. Quitting")
+                elif exc is not None:
+                    raise exc
+        finally:
+            connections.pop(websocket, None)
+            stats.queues.discard(queue)
+            stats.connections -= 1
+
+
+async def drain(timeout):
+    """Asks every client to reconnect, flushes their queues and closes connections.
+
+    Clients reconnecting right away land on another worker sharing the port.
+    """
+    reconnect_event = json.dumps(dict(event_type="reconnect", data=dict(reason="server_restart")))
+
+    for websocket, queue in list(connections.items()):
+        try:
+            queue.put(reconnect_event)
+        except SlowConsumerError:
+            pass
+
+    deadline = time.monotonic() + timeout
+    while any(len(queue) for queue in connections.values()) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    await asyncio.gather(
+        *[websocket.close(code=1012, reason="Server restart") for websocket in list(connections)],
+        return_exceptions=True
+    )
+
+
+async def report_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        print("Relay stats:", json.dumps(stats.snapshot()))
+
+
+async def track_rates(interval=1.0):
+    while True:
+        received, sent = stats.received_frames, stats.sent_frames
+        await asyncio.sleep(interval)
+        stats.messages_per_second = (stats.received_frames - received) / interval
+        stats.sent_per_second = (stats.sent_frames - sent) / interval
+
+
+async def stats_handler(reader, writer):
+    try:
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+        writer.close()
+        return
+
+    body = json.dumps(dict(worker=worker_index, pid=os.getpid(), **stats.snapshot())).encode()
+    headers = (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    writer.write(headers.encode() + body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def main(host, port, stats_interval=0, stats_port=None, reuse_port=False, drain_timeout=5.0,
+               compression="deflate"):
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+    background = [asyncio.create_task(track_rates())]
+    if stats_interval > 0:
+        background.append(asyncio.create_task(report_stats(stats_interval)))
+
+    stats_server = None
+    if stats_port:
+        stats_server = await asyncio.start_server(stats_handler, host, stats_port,
+                                                  reuse_port=reuse_port)
+
+    compression_kwargs = get_compression_kwargs(compression)
+    async with websockets.serve(handler, host, port, reuse_port=reuse_port,
+                                select_subprotocol=select_subprotocol,
+                                subprotocols=[name for name in protocols if name],
+                                **compression_kwargs) as server:
+        await stop
+        # a replacement worker binds the same stats port, stop answering for this one
+        if stats_server:
+            stats_server.close()
+        print(f"Worker {worker_index} is draining {len(connections)} connections")
+        server.close(close_connections=False)
+        await drain(drain_timeout)
+        await server.wait_closed()
+
+    for task in background:
+        task.cancel()
+
+
+def run_worker(args, index=0, reuse_port=False):
+    global r, queue_size, max_lag, worker_index
+    r = redis.from_url(f"redis://{args.redis_host}")
+    queue_size = args.queue_size
+    max_lag = args.max_lag
+    worker_index = index
+
+    stats_port = args.stats_port + index if args.stats_port else None
+    asyncio.run(main(args.host, args.port, args.stats_interval, stats_port=stats_port,
+                     reuse_port=reuse_port, drain_timeout=args.drain_timeout,
+                     compression=args.compression))
+
+
+class Supervisor:
+    """Forks worker processes that share the listening port through SO_REUSEPORT.
+
+    SIGTERM/SIGINT drain and stop all workers. SIGHUP performs a rolling restart:
+    a replacement is started before the old worker is asked to drain, so the port
+    is never left without a listener. Crashed workers are restarted.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}
+        self.stopping = False
+        self.restart_requested = False
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            try:
+                run_worker(self.args, index, reuse_port=True)
+            finally:
+                os._exit(0)
+
+        print(f"Started worker {index} with pid {pid}")
+        self.workers[pid] = index
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.workers):
+            self.kill(pid)
+
+    def request_restart(self, signum=None, frame=None):
+        self.restart_requested = True
+
+    def kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def rolling_restart(self):
+        self.restart_requested = False
+        for old_pid, index in list(self.workers.items()):
+            self.spawn(index)
+            self.kill(old_pid)
+            self.workers.pop(old_pid, None)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.request_restart)
+
+        for index in range(self.args.workers):
+            self.spawn(index)
+
+        while self.workers or not self.stopping:
+            if self.restart_requested and not self.stopping:
+                self.rolling_restart()
 
             try:
-                await websocket.send(payload)
-            except (websockets.ConnectionClosed, websockets.ConnectionClosedOK):
-                print("Connection closed by the client. Quitting")
-                break
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = 0, 0
 
+            if pid == 0:
+                time.sleep(0.2)
+                continue
 
-async def main(host, port):
-    async with websockets.serve(handler, host, port):
-        await asyncio.Future()  # run forever
+            index = self.workers.pop(pid, None)
+            if index is not None and not self.stopping:
+                print(f"Worker {index} (pid {pid}) exited with status {status}. Restarting")
+                self.spawn(index)
 
 
 if __name__ == "__main__":
@@ -48,13 +540,28 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default="0.0.0.0")
     parser.add_argument("--port", type=int, default=9000)
     parser.add_argument("--redis-host", type=str, default="localhost")
+    parser.add_argument("--queue-size", type=int, default=1000,
+                        help="Max number of frames buffered per connection")
+    parser.add_argument("--max-lag", type=float, default=10.0,
+                        help="Seconds a frame may wait in a queue before the client is disconnected")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Print relay metrics every given number of seconds (0 to disable)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port (more than 1 enables supervisor mode)")
+    parser.add_argument("--stats-port", type=int, default=0,
+                        help="Serve JSON stats of worker i on port stats_port + i (0 to disable)")
+    parser.add_argument("--drain-timeout", type=float, default=5.0,
+                        help="Seconds given to clients to receive pending events on shutdown")
+    parser.add_argument("--compression", choices=["deflate", "none"], default="deflate",
+                        help="Whether to negotiate permessage-deflate with clients")
     args = parser.parse_args()
 
     redis_host = args.redis_host
     print("REDIS_HOST", redis_host)
 
-    redis_host = "redis"
-
-    r = redis.from_url(f"redis://{redis_host}")
+    args.redis_host = "redis"
 
-    asyncio.run(main(args.host, args.port))
+    if args.workers > 1:
+        Supervisor(args).run()
+    else:
+        run_worker(args)
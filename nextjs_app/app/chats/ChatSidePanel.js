@@ -15,10 +15,11 @@ export default function ChatSidePanel() {
     term: queryParams.get("term") || "",
     sortby: queryParams.get("sortby") || "newest",
     filter: queryParams.get("filter") || "All",
-    page: queryParams.get("page") || 1,
+    cursor: queryParams.get("cursor") || "",
+    page: queryParams.get("page") || "",
     advanced: queryParams.get("advanced") || false
   };
-  const suspenseKey = paramsObject.term + paramsObject.page + paramsObject.sortby + paramsObject.filter;
+  const suspenseKey = paramsObject.term + paramsObject.cursor + paramsObject.page + paramsObject.sortby + paramsObject.filter;
 
   return (
     <div className="p-4 border-r overflow-y-auto bg-slate-200 h-dvh">
@@ -39,7 +40,7 @@ export default function ChatSidePanel() {
 function ChatList({ queryParams }) {
   const [loading, setLoading] = useState(true);
   const [items, setItems] = useState([]);
-  const [totalPages, setTotalPages] = useState(1);
+  const [links, setLinks] = useState({});
   const router = useRouter();
   const params = useParams();
   const queryString = (new URLSearchParams(queryParams)).toString();
@@ -51,7 +52,7 @@ function ChatList({ queryParams }) {
 
     const currentHost = getHostOrLocalhost(window);
 
-    fetchChats(baseUrl, query).then(([chats, pages]) => {
+    fetchChats(baseUrl, query).then(([chats, pageLinks]) => {
       const fallbackImage = "/app/test-image.jpeg";
       const fixedChats = chats.map(({ image, ...rest }) => ({
         image: image ? fixUrlHost(image, currentHost) : fallbackImage,
@@ -59,7 +60,7 @@ function ChatList({ queryParams }) {
       }));
 
       setItems(fixedChats);
-      setTotalPages(pages);
+      setLinks(pageLinks);
     }).finally(() => {
       setLoading(false);
     });
@@ -90,8 +91,8 @@ function ChatList({ queryParams }) {
     <div>
       {loading ? <Loader /> : itemsSection}
 
-      {totalPages > 1 && (
-        <Pagination totalPages={totalPages} inProgress={loading} />
+      {(links.next || links.previous) && (
+        <Pagination links={links} inProgress={loading} />
       )}
     </div>
   );
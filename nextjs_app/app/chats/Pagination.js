@@ -4,35 +4,35 @@ import { usePathname, useSearchParams } from "next/navigation";
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { faLeftLong, faRightLong } from "@fortawesome/free-solid-svg-icons";
 
-export function Pagination({ totalPages, inProgress }) {
+export function Pagination({ links, inProgress }) {
   const searchParams = useSearchParams();
   const pathName = usePathname();
-  const page = searchParams.get("page") || 1;
-  const pageNumber = Number(page);
 
-
-  function buildUrl(pageNo) {
+  function buildUrl(link) {
+    // API links carry the cursor (or the page number of ranked search results)
+    // of the page they point to, the first page has neither
     const params = new URLSearchParams(searchParams);
-    params.set("page", pageNo);
+    const linkParams = link ? new URL(link).searchParams : new URLSearchParams();
+    ["cursor", "page"].forEach(name => {
+      if (linkParams.get(name)) {
+        params.set(name, linkParams.get(name));
+      } else {
+        params.delete(name);
+      }
+    });
     return `/app${pathName}?${params.toString()}`;
   }
 
-  const prevUrl = buildUrl(pageNumber - 1);
-  const nextUrl = buildUrl(pageNumber + 1);
-
   return (
     <div className="mt-4 flex justify-between items-center">
       <PaginationLink
-        disabled={pageNumber === 1 || inProgress}
-        href={prevUrl}
+        disabled={!links.previous || inProgress}
+        href={buildUrl(links.previous)}
         icon={faLeftLong}
       />
-      <span>
-        Page {pageNumber} of {totalPages}
-      </span>
       <PaginationLink
-        disabled={pageNumber === totalPages || inProgress}
-        href={nextUrl}
+        disabled={!links.next || inProgress}
+        href={buildUrl(links.next)}
         icon={faRightLong}
       />
     </div>
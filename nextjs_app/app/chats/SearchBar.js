@@ -3,7 +3,7 @@ import React, { useState } from "react";
 import { useRouter, usePathname, useSearchParams } from "next/navigation";
 
 export function SearchBar({ queryParams }) {
-  const { page, term="", advanced=false, sortby, filter } = queryParams;
+  const { term="", advanced=false, sortby, filter } = queryParams;
   const [settingsOpen, setSettingsOpen] = useState(false);
   const searchParams = useSearchParams();
   const pathname = usePathname();
@@ -26,7 +26,7 @@ export function SearchBar({ queryParams }) {
 
   const handleSearchChange = (e) => {
     const term = e.target.value;
-    updateSearchParams([{ name: "term", value: term }, { name: "page", value: 1}]);
+    updateSearchParams([{ name: "term", value: term }, { name: "cursor", value: ""}, { name: "page", value: ""}]);
   };
 
   const handleAdvancedToggle = () => {
@@ -35,13 +35,13 @@ export function SearchBar({ queryParams }) {
 
   const handleSortChange = (e) => {
     const sortOption = e.target.value;
-    updateSearchParams([{ name: "sortby", value: sortOption }, { name: "page", value: 1}]);
+    updateSearchParams([{ name: "sortby", value: sortOption }, { name: "cursor", value: ""}, { name: "page", value: ""}]);
 
   };
 
   const handleContentFilterChange = (e) => {
     const newFilter = e.target.value;
-    updateSearchParams([{ name: "filter", value: newFilter }, { name: "page", value: 1}]);
+    updateSearchParams([{ name: "filter", value: newFilter }, { name: "cursor", value: ""}, { name: "page", value: ""}]);
   };
 
   return (
@@ -91,6 +91,7 @@ function SearchSettings({ sortOption, onSortChange, onContentFilterChange, conte
         >
           <option value="newest">Newest First</option>
           <option value="oldest">Oldest First</option>
+          <option value="relevance">Most Relevant</option>
         </select>
       </div>
       {/* Content Filter */}
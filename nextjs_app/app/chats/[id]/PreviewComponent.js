@@ -76,6 +76,9 @@ const RunningOperationItem = ({ item }) => {
                 </span>
                 <span className="mr-2">Building...</span>
                 <FontAwesomeIcon icon={faSpinner} spin />
+                {item.lastLogLine && (
+                    <span className="ml-2 text-sm text-gray-500">{item.lastLogLine}</span>
+                )}
             </div>
             <div className="grow-0">{clock}</div>
         </div>
@@ -451,8 +454,15 @@ function getWebsocketListener(activeRevisionId, setStateData, onBuildFinished) {
 
                 const [addOperation, removeOperation] = getStateMutators(prevState);
             
-                let updatedStateData
-                if (event_type === "build_started") {
+                let updatedStateData = prevState;
+                if (event_type === "build_log") {
+                    updatedStateData = {
+                        ...prevState,
+                        running: prevState.running.map(item => (
+                            item.id === data.build_id ? { ...item, lastLogLine: data.text } : item
+                        ))
+                    };
+                } else if (event_type === "build_started") {
                     updatedStateData = addOperation("running", data.build);
                 } else if (event_type === "build_finished") {
                     removeOperation("running", data.build);
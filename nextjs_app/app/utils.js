@@ -5,22 +5,20 @@ import 'highlight.js/styles/github.css';
 
 async function fetchChats(baseUrl, query) {
     let chats = [];
-    let totalPages = 1;
+    let links = {};
 
     try {
         const extra = query ? `?${query}` : "";
         const response = await fetch(`${baseUrl}${extra}`);
         const data = await response.json();
         chats = data.results;
-        // todo: modify API to return totalPages in response
-        totalPages = data.num_pages;
-        console.log(data.count, totalPages)
+        links = data.links;
     } catch (error) {
         console.error("Failed to fetch chats:", error);
         throw error;
     }
 
-    return [ chats, totalPages ];
+    return [ chats, links ];
 }
 
 
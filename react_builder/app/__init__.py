@@ -1,22 +1,182 @@
 from typing import List, Dict
+from contextlib import asynccontextmanager
+import os
+import io
+import json
 import tarfile
-from fastapi import FastAPI, UploadFile, HTTPException
+import threading
+from fastapi import FastAPI, UploadFile, HTTPException, Form, Request
 from fastapi.responses import FileResponse
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.builders import build, get_artifacts
+from app.builders import (
+    build, get_artifacts, get_build_cache, get_blob_store, get_collector, close_worker_pool,
+    num_build_workers
+)
+from app.blobs import BlobError, parse_manifest
+from app.jobs import JobQueue, QueueFull
+from app.archive import get_compressions, media_types
 
-app = FastAPI()
+
+job_queue = JobQueue(
+    build,
+    workers=int(os.environ.get("BUILD_JOB_WORKERS", max(num_build_workers, 1))),
+    max_pending=int(os.environ.get("BUILD_JOB_MAX_PENDING", 100))
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    gc_interval = int(os.environ.get("BUILD_GC_INTERVAL", 3600))
+    gc_stop = threading.Event()
+    if gc_interval > 0:
+        gc_thread = threading.Thread(target=get_collector().run_periodically,
+                                     args=(gc_interval, gc_stop), daemon=True)
+        gc_thread.start()
+
+    yield
+    gc_stop.set()
+    job_queue.shutdown()
+    close_worker_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/app_files/{build_id}/")
-def app_files(build_id: str):
-    tar_data = get_artifacts(build_id)
-    return StreamingResponse(iter([tar_data]))
+def app_files(build_id: str, compression: str = "none"):
+    """Streams a tar archive of the artifacts, optionally compressed with gzip or zstd"""
+    if compression not in get_compressions():
+        raise HTTPException(status_code=400, detail=f"Unsupported compression: {compression}")
+
+    try:
+        chunks = get_artifacts(build_id, compression)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return StreamingResponse(chunks, media_type=media_types[compression])
+
+
+class BlobHashes(BaseModel):
+    hashes: List[str]
+
+
+@app.post("/blobs/missing/")
+def missing_blobs(data: BlobHashes):
+    try:
+        return {"missing": get_blob_store().missing(data.hashes)}
+    except BlobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.put("/blobs/{sha256}/", status_code=201)
+async def upload_blob(sha256: str, request: Request):
+    """Saves the request body as a blob, the body must hash to sha256"""
+    try:
+        writer = get_blob_store().open_writer(sha256)
+    except BlobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        async for chunk in request.stream():
+            writer.write(chunk)
+        writer.commit()
+    except BlobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        writer.abort()
+        raise
+    return {"sha256": sha256}
+
+
+def load_manifest(manifest):
+    """Parses the manifest form field, responds with 409 and the missing hashes if there are any"""
+    if not manifest:
+        return None
+
+    try:
+        entries = parse_manifest(json.loads(manifest))
+    except (ValueError, BlobError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid manifest: {e}")
+
+    missing = get_blob_store().missing(entry["sha256"] for entry in entries)
+    if missing:
+        raise HTTPException(status_code=409, detail={"missing": missing})
+    return entries
 
 
 @app.post("/build-spa/")
-def build_spa(src: UploadFile):
+def build_spa(src: UploadFile, manifest: str = Form(None), base_build_id: str = Form(None)):
     # todo: create link for artifacts tar
+    entries = load_manifest(manifest)
     tar = tarfile.open(mode="r", fileobj=src.file)
-    return build(tar)
+    return build(tar, manifest=entries, base_build_id=base_build_id)
+
+
+@app.post("/jobs/", status_code=202)
+def create_build_job(src: UploadFile, manifest: str = Form(None), base_build_id: str = Form(None)):
+    entries = load_manifest(manifest)
+    # the upload is closed when the request ends, so the job gets its own copy
+    tar = tarfile.open(mode="r", fileobj=io.BytesIO(src.file.read()))
+    try:
+        job = job_queue.submit(tar, manifest=entries, base_build_id=base_build_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+
+@app.get("/queue/")
+def build_queue_stats():
+    """Queue length used by clients to pick the least loaded build server"""
+    return job_queue.stats()
+
+
+@app.get("/jobs/{job_id}/")
+def build_job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+
+@app.delete("/jobs/{job_id}/")
+def cancel_build_job(job_id: str):
+    get_job(job_id)
+    return job_queue.cancel(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/logs/")
+def build_job_logs(job_id: str, offset: int = 0):
+    """Streams log lines as JSON lines, the last line holds the job status and result"""
+    job = get_job(job_id)
+
+    def generate():
+        for line in job.follow_logs(offset):
+            if line is None:
+                yield "\n"  # heartbeat
+            else:
+                yield json.dumps(line) + "\n"
+        yield json.dumps(job.to_dict()) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Build job {job_id} not found")
+    return job
+
+
+@app.get("/build-cache/stats/")
+def build_cache_stats():
+    cache = get_build_cache()
+    if cache is None:
+        return {"enabled": False}
+    return dict(cache.stats(), enabled=True)
+
+
+@app.post("/gc/")
+def collect_garbage():
+    return get_collector().collect()
+
+
+@app.get("/gc/")
+def last_garbage_collection():
+    return {"last_run": get_collector().last_run}
@@ -0,0 +1,114 @@
+import os
+import queue
+import tarfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+chunk_size = 64 * 1024
+
+media_types = {
+    "none": "application/x-tar",
+    "gzip": "application/gzip",
+    "zstd": "application/zstd"
+}
+
+
+def get_compressions():
+    if zstandard is None:
+        return ["none", "gzip"]
+    return ["none", "gzip", "zstd"]
+
+
+class ConsumerGone(Exception):
+    pass
+
+
+class ChunkWriter:
+    """File-like object passing written data to a callback in chunks of chunk_size"""
+
+    def __init__(self, put, chunk_size):
+        self.put = put
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.chunk_size:
+            self.put(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+
+
+def write_tar(path, arcname, writer, compression):
+    if compression == "zstd":
+        zstd_writer = zstandard.ZstdCompressor().stream_writer(writer, closefd=False)
+        with tarfile.open(fileobj=zstd_writer, mode="w|") as tar:
+            tar.add(path, arcname=arcname, recursive=True)
+        zstd_writer.close()
+    else:
+        mode = "w|gz" if compression == "gzip" else "w|"
+        with tarfile.open(fileobj=writer, mode=mode) as tar:
+            tar.add(path, arcname=arcname, recursive=True)
+    writer.flush()
+
+
+def stream_tar(path, compression="none", max_pending_chunks=4):
+    """Yields a (compressed) tar archive of the directory while it is being written.
+
+    The archive is produced in a separate thread that blocks once max_pending_chunks
+    chunks are waiting, so memory use does not depend on the size of the directory.
+    An error of the producer is raised by the generator.
+    """
+    arcname = os.path.basename(path)
+    chunks = queue.Queue(maxsize=max_pending_chunks)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(chunk):
+        while not cancelled.is_set():
+            try:
+                chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise ConsumerGone()
+
+    def produce():
+        result = done
+        try:
+            write_tar(path, arcname, ChunkWriter(put, chunk_size), compression)
+        except ConsumerGone:
+            return
+        except Exception as e:
+            result = e
+        try:
+            put(result)
+        except ConsumerGone:
+            pass
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                # aborts the response, so that a truncated archive is not taken for a complete one
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+
+sha256_pattern = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobError(Exception):
+    pass
+
+
+class BlobStore:
+    """Content-addressed store of resource files, blobs are saved as root/<sha[:2]>/<sha>.
+
+    The modification time of a blob is refreshed whenever it is reported present, so a
+    build that passed the missing-check can link it before remove_unused may delete it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.lock = threading.Lock()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, sha256):
+        if not sha256_pattern.match(sha256):
+            raise BlobError(f"Invalid blob hash: {sha256}")
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def missing(self, hashes):
+        return [sha256 for sha256 in dict.fromkeys(hashes) if not self.touch(sha256)]
+
+    def touch(self, sha256):
+        """Marks the blob as recently used, returns False if there is no such blob"""
+        with self.lock:
+            try:
+                os.utime(self.path(sha256))
+            except FileNotFoundError:
+                return False
+            return True
+
+    def open_writer(self, sha256):
+        return BlobWriter(self, sha256)
+
+    def link(self, sha256, dest_path):
+        """Hardlinks the blob to dest_path, copying it when linking is not possible"""
+        src_path = self.path(sha256)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+
+        with self.lock:
+            if not os.path.exists(src_path):
+                raise BlobError(f"Blob {sha256} not found")
+            try:
+                os.link(src_path, dest_path)
+            except OSError:
+                shutil.copyfile(src_path, dest_path)
+
+    def remove_unused(self, max_age):
+        """Removes blobs not used for max_age seconds that are not linked anywhere else,
+        as well as abandoned uploads. Returns the number of removed files."""
+        now = time.time()
+        removed = 0
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                # the lock keeps blobs from being linked or touched between the check and removal
+                with self.lock:
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+                    unused = root == self.tmp_dir or st.st_nlink == 1
+                    if unused and now - st.st_mtime > max_age:
+                        os.remove(path)
+                        removed += 1
+        return removed
+
+
+class BlobWriter:
+    """Writes a blob to a temporary file and moves it into the store if its hash matches"""
+
+    def __init__(self, store, sha256):
+        self.store = store
+        self.sha256 = sha256
+        self.dest_path = store.path(sha256)
+        self.digest = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        actual = self.digest.hexdigest()
+        if actual != self.sha256:
+            os.remove(self.tmp_path)
+            raise BlobError(f"Hash mismatch: expected {self.sha256}, got {actual}")
+
+        os.makedirs(os.path.dirname(self.dest_path), exist_ok=True)
+        os.replace(self.tmp_path, self.dest_path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def parse_manifest(data):
+    """Validates a manifest: a list of {"path": ..., "sha256": ...} with relative paths"""
+    if not isinstance(data, list):
+        raise BlobError("Manifest must be a list")
+
+    manifest = []
+    for entry in data:
+        if not isinstance(entry, dict):
+            raise BlobError(f"Manifest entry must be an object: {entry!r}")
+        path = entry.get("path")
+        sha256 = entry.get("sha256")
+        if not isinstance(path, str) or not isinstance(sha256, str):
+            raise BlobError(f"Manifest entry must have string path and sha256: {entry!r}")
+
+        path = os.path.normpath(path)
+        if os.path.isabs(path) or path == "." or path.split(os.sep)[0] == "..":
+            raise BlobError(f"Invalid manifest path: {path}")
+        if not sha256_pattern.match(sha256):
+            raise BlobError(f"Invalid blob hash: {sha256}")
+        manifest.append(dict(path=path, sha256=sha256))
+    return manifest
@@ -4,13 +4,115 @@ import subprocess
 import uuid
 import tarfile
 import io
+import re
+import time
+import threading
 from typing import Union, List, Dict, Tuple
 from collections import namedtuple
 from app.render import render_webpack_config
+from app.workers import BuildWorkerPool
+from app.archive import stream_tar
+from app.cache import BuildCache, hash_source_tar, get_template_version
+from app.blobs import BlobStore
+from app.retention import BuildsCollector
 
 
 base_dir = "/data/builds"
 
+template_version = get_template_version()
+
+build_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+# number of warm webpack worker processes; 0 runs "npx webpack" for every build
+num_build_workers = int(os.environ.get("BUILD_WORKERS", 2))
+
+worker_pool = None
+
+
+def get_worker_pool():
+    global worker_pool
+    if worker_pool is None and num_build_workers > 0:
+        worker_pool = BuildWorkerPool(
+            base_dir,
+            size=num_build_workers,
+            max_builds=int(os.environ.get("BUILD_WORKER_MAX_BUILDS", 50)),
+            max_memory_mb=int(os.environ.get("BUILD_WORKER_MAX_MEMORY_MB", 1024)),
+            timeout=int(os.environ.get("BUILD_TIMEOUT", 300))
+        )
+    return worker_pool
+
+
+build_cache = None
+
+
+def get_build_cache():
+    global build_cache
+    max_entries = int(os.environ.get("BUILD_CACHE_MAX_ENTRIES", 200))
+    if build_cache is None and max_entries > 0:
+        max_bytes = int(os.environ.get("BUILD_CACHE_MAX_MB", 5 * 1024)) * 1024 * 1024
+        build_cache = BuildCache(base_dir, max_entries=max_entries, max_bytes=max_bytes,
+                                 is_busy=is_build_busy)
+    return build_cache
+
+
+blob_store = None
+
+
+def get_blob_store():
+    global blob_store
+    if blob_store is None:
+        blob_store = BlobStore(os.path.join(base_dir, "blobs"))
+    return blob_store
+
+
+# ids of builds whose directories are being written to, garbage collection skips them
+active_builds = set()
+active_builds_lock = threading.Lock()
+
+# a build and the incremental rebuilds based on it form a lineage. Builds of a lineage run
+# one at a time under the same path, workspaces/<lineage> linked to the build directory,
+# because webpack keys its filesystem cache by absolute paths of modules
+workspaces_dir = os.path.join(base_dir, "workspaces")
+lineage_file = "lineage"
+busy_lineages = set()
+
+
+def get_active_builds():
+    with active_builds_lock:
+        return set(active_builds)
+
+
+def is_build_busy(build_id):
+    """Whether the build is running or belongs to a lineage with a running rebuild"""
+    lineage = get_lineage(os.path.join(base_dir, build_id), build_id)
+    with active_builds_lock:
+        return build_id in active_builds or lineage in busy_lineages
+
+
+def get_build_ids():
+    return [name for name in os.listdir(base_dir) if build_id_pattern.match(name)]
+
+
+collector = None
+
+
+def get_collector():
+    global collector
+    if collector is None:
+        collector = BuildsCollector(
+            base_dir, get_build_ids, get_active_builds, get_blob_store(), get_build_cache(),
+            max_age=int(os.environ.get("BUILD_GC_MAX_AGE", 24 * 3600)),
+            max_bytes=int(os.environ.get("BUILD_GC_MAX_MB", 20 * 1024)) * 1024 * 1024
+        )
+    return collector
+
+
+def close_worker_pool():
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.close()
+        worker_pool = None
+
 def save_to_file(path, content):
     with open(path, "w") as f:
         f.write(content)
@@ -21,6 +123,11 @@ def load_file(path):
         return f.read()
 
 
+def load_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
 def exclude_config(member, path):
     if os.path.basename(member.name).endswith('webpack.config.js'):
         return None
@@ -28,13 +135,25 @@ def exclude_config(member, path):
 
 
 class SimpleReactBuilder:
-    def __init__(self, repo_directory):
+    dummy_file = os.path.join("static", "_____dummy.txt")
+
+    def __init__(self, repo_directory, on_log=None, manifest=None, base_directory=None, workspace=None):
         self.repo_directory = repo_directory
+        self.on_log = on_log
+        self.manifest = manifest or []
+        self.base_directory = base_directory
+        self.workspace = workspace or repo_directory
+        self.incremental = False
+        self.timings = {}
 
     def build(self, tar):
         self._prepare_source_dir(tar)
         self._prepare_output_dir()
-        return self._build_artifacts()
+        self._link_workspace()
+        try:
+            return self._build_artifacts()
+        finally:
+            self._unlink_workspace()
 
     def load_artifacts(self):
         artifacts = {}
@@ -49,23 +168,107 @@ class SimpleReactBuilder:
 
     def _prepare_source_dir(self, tar):
         source_dir = os.path.join(self.repo_directory, "source")
-        static_dir = os.path.join(source_dir, "static")
-        os.makedirs(source_dir)
-        os.makedirs(static_dir, exist_ok=True)
-        dummy_path = os.path.join(static_dir, "_____dummy.txt")
-        with open(dummy_path, "w") as f: f.write("hello")
+        if self.base_directory:
+            self.incremental = self._clone_base_workspace()
+
+        if not self.incremental:
+            static_dir = os.path.join(source_dir, "static")
+            os.makedirs(source_dir)
+            os.makedirs(static_dir, exist_ok=True)
+            dummy_path = os.path.join(source_dir, self.dummy_file)
+            with open(dummy_path, "w") as f: f.write("hello")
 
         index_path = self._get_indexjs(source_dir, tar)
-        #todo: exlude config (filter only available in Python 3.12)
-        tar.extractall(path=source_dir)
+        if self.incremental:
+            self._apply_changes(source_dir, tar)
+        else:
+            #todo: exlude config (filter only available in Python 3.12)
+            tar.extractall(path=source_dir)
         tar.close()
 
+        for entry in self.manifest:
+            get_blob_store().link(entry["sha256"], os.path.join(source_dir, entry["path"]))
+
+        # sources are seen by webpack under the workspace path, see _link_workspace
+        workspace_index_path = os.path.join(self.workspace, os.path.relpath(index_path, self.repo_directory))
         webpack_config = render_webpack_config(
-            build_path=self.repo_directory, index_path=index_path
+            build_path=self.repo_directory, index_path=workspace_index_path,
+            context=os.path.join(self.workspace, "source"),
+            cache_dir=os.path.join(self.repo_directory, "cache"), cache_version=template_version
         )
         webpack_config_path = os.path.join(source_dir, "webpack.config.js")
         save_to_file(webpack_config_path, webpack_config)
 
+    def _clone_base_workspace(self):
+        """Copies sources and the webpack cache of the base build, sharing blocks where the
+        file system supports reflinks. Returns False if the base workspace can not be used."""
+        base_source = os.path.join(self.base_directory, "source")
+        if not os.path.isdir(base_source):
+            return False
+
+        os.makedirs(self.repo_directory)
+        for name in ("source", "cache"):
+            path = os.path.join(self.base_directory, name)
+            if not os.path.isdir(path):
+                continue
+
+            proc = subprocess.run(["cp", "-a", "--reflink=auto", path, self.repo_directory],
+                                  capture_output=True)
+            if proc.returncode != 0:
+                print(f'Failed to clone workspace "{path}": {proc.stderr.decode(errors="replace")}')
+                shutil.rmtree(self.repo_directory, ignore_errors=True)
+                return False
+        return True
+
+    def _link_workspace(self):
+        if self.workspace == self.repo_directory:
+            return
+        os.makedirs(os.path.dirname(self.workspace), exist_ok=True)
+        tmp_path = f"{self.workspace}.{os.path.basename(self.repo_directory)}"
+        os.symlink(self.repo_directory, tmp_path)
+        os.replace(tmp_path, self.workspace)
+
+    def _unlink_workspace(self):
+        if self.workspace != self.repo_directory and os.path.islink(self.workspace):
+            os.remove(self.workspace)
+
+    def _apply_changes(self, source_dir, tar):
+        """Makes the cloned source dir match the tar, leaving unchanged files untouched
+        so that their timestamps stay valid for the webpack cache"""
+        expected = {"webpack.config.js", self.dummy_file}
+        expected.update(entry["path"] for entry in self.manifest)
+        changed = 0
+
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            member = tarfile.data_filter(member, source_dir)
+            path = os.path.normpath(member.name)
+            expected.add(path)
+
+            dest_path = os.path.join(source_dir, path)
+            content = tar.extractfile(member).read()
+            if os.path.isfile(dest_path) and load_bytes(dest_path) == content:
+                continue
+
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            with open(dest_path, "wb") as f:
+                f.write(content)
+            changed += 1
+
+        removed = 0
+        for root, dirs, files in os.walk(source_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, source_dir) not in expected:
+                    os.remove(path)
+                    removed += 1
+
+        if self.on_log:
+            self.on_log("stdout", f"Incremental build: {changed} files changed, {removed} removed")
+
     def _get_indexjs(self, source_dir, tar):
         index_relative_path = "index.js"
 
@@ -82,42 +285,115 @@ class SimpleReactBuilder:
 
     def _build_artifacts(self):
         cwd = os.path.join(self.repo_directory, "source")
-        proc = subprocess.run(["npx", "webpack"], cwd=cwd, capture_output=True)
-        return proc.stdout, proc.stderr
+        pool = get_worker_pool()
+        if pool is not None:
+            config_path = os.path.join(cwd, "webpack.config.js")
+            result = pool.build(cwd, config_path, self.on_log)
+            self.timings = dict(queued_seconds=result.queued_seconds,
+                                build_seconds=result.build_seconds)
+            return result.stdout, result.stderr
+
+        t0 = time.monotonic()
+        proc = subprocess.Popen(["npx", "webpack"], cwd=cwd,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr_lines = []
+        stderr_reader = threading.Thread(target=self._read_lines,
+                                         args=(proc.stderr, "stderr", stderr_lines))
+        stderr_reader.start()
+        stdout_lines = []
+        self._read_lines(proc.stdout, "stdout", stdout_lines)
+        stderr_reader.join()
+        proc.wait()
+        self.timings = dict(queued_seconds=0, build_seconds=time.monotonic() - t0)
+        return "".join(stdout_lines), "".join(stderr_lines)
+
+    def _read_lines(self, pipe, stream, lines):
+        for line in pipe:
+            line = line.decode(encoding="utf-8", errors="replace")
+            lines.append(line)
+            if self.on_log:
+                self.on_log(stream, line.rstrip("\n"))
 
     @property
     def output_dir(self):
         return os.path.join(self.repo_directory, "artifacts")
 
 
-def build(tar, props=None):
+def build(tar, props=None, on_log=None, manifest=None, base_build_id=None):
+    cache = get_build_cache()
+    if cache is not None:
+        cache_key = hash_source_tar(tar, version=template_version, manifest=manifest or [])
+        result = cache.get(cache_key)
+        if result is not None:
+            if on_log:
+                replay_logs(result, on_log)
+            return dict(result, cached=True, queued_seconds=0, build_seconds=0)
+
+    result = run_build(tar, on_log, manifest, base_build_id)
+
+    if cache is not None and result['success']:
+        cache.put(cache_key, result)
+    return dict(result, cached=False)
+
+
+def replay_logs(result, on_log):
+    for stream in ("stdout", "stderr"):
+        for line in result[stream].splitlines():
+            on_log(stream, line)
+
+
+def run_build(tar, on_log=None, manifest=None, base_build_id=None):
     build_id = uuid.uuid4().hex
     repo_directory = os.path.join(base_dir, build_id)
-    builder = SimpleReactBuilder(repo_directory)
-    
-    stdout, stderr = builder.build(tar)
+    base_directory = get_build_directory(base_build_id) if base_build_id else None
+    lineage = get_lineage(base_directory, base_build_id) if base_directory else build_id
 
-    stdout = stdout.decode(encoding="utf-8")
-    stderr = stderr.decode(encoding="utf-8")
+    with active_builds_lock:
+        active_builds.add(build_id)
+        if lineage in busy_lineages:
+            # the workspace path is taken, the cache of the base build would not match
+            base_directory = None
+            lineage = build_id
+        busy_lineages.add(lineage)
+
+    workspace = os.path.join(workspaces_dir, lineage)
+    builder = SimpleReactBuilder(repo_directory, on_log, manifest, base_directory, workspace)
+    try:
+        stdout, stderr = builder.build(tar)
+        save_to_file(os.path.join(repo_directory, lineage_file), lineage)
+    finally:
+        with active_builds_lock:
+            active_builds.discard(build_id)
+            busy_lineages.discard(lineage)
     success = "successfully" in stdout.lower()
 
     return {
         'success': success,
         'stdout': stdout,
         'stderr': stderr,
-        'build_id': build_id
+        'build_id': build_id,
+        'incremental': builder.incremental,
+        **builder.timings
     }
 
 
-def get_artifacts(build_id):
-    root_folder = os.path.join(base_dir, build_id)
-    path = os.path.join(root_folder, 'artifacts')
-    arcname = os.path.basename(path)
+def get_lineage(build_directory, build_id):
+    try:
+        return load_file(os.path.join(build_directory, lineage_file)).strip()
+    except FileNotFoundError:
+        return build_id
+
+
+def get_build_directory(build_id):
+    if not build_id_pattern.match(build_id):
+        return None
+    path = os.path.join(base_dir, build_id)
+    return path if os.path.isdir(path) else None
 
-    f = io.BytesIO()
 
-    with tarfile.open(fileobj=f, mode='w') as tar:
-        tar.add(path, arcname=arcname, recursive=True)
-    
-    f.seek(0)
-    return f.read()
+def get_artifacts(build_id, compression="none"):
+    root_folder = os.path.join(base_dir, build_id)
+    path = os.path.join(root_folder, 'artifacts')
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'No artifacts for build "{build_id}"')
+    return stream_tar(path, compression)
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from app.render import env
+
+
+def get_template_version():
+    source, _, _ = env.loader.get_source(env, "webpack.config.js")
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def hash_source_tar(tar, version="", manifest=()):
+    """Hash of (path, content) pairs of regular files in the tar and blobs in the manifest.
+
+    The hash does not depend on the order of members.
+    """
+    entries = [(entry["path"], entry["sha256"]) for entry in manifest]
+    for member in tar.getmembers():
+        if not member.isfile():
+            continue
+        path = os.path.normpath(member.name).lstrip("/")
+        content = tar.extractfile(member).read()
+        entries.append((path, hashlib.sha256(content).hexdigest()))
+
+    digest = hashlib.sha256(version.encode("utf-8"))
+    for path, content_hash in sorted(entries):
+        digest.update(f"{path}\0{content_hash}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class BuildCache:
+    """LRU index of successful builds keyed by the hash of their sources.
+
+    Entries are evicted (and their build directories removed) when there are more
+    than max_entries of them or they take more than max_bytes on disk. Builds for which
+    is_busy(build_id) is true, e.g. the base of a running incremental rebuild, are skipped.
+    The index is saved as JSON next to the builds so that it survives restarts.
+    """
+
+    result_file = "result.json"
+
+    def __init__(self, root, max_entries=200, max_bytes=5 * 1024 ** 3, is_busy=None):
+        self.root = root
+        self.index_path = os.path.join(root, "build_cache.json")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.is_busy = is_busy or (lambda build_id: False)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_index()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            result = entry and self._load_result(entry["build_id"])
+            if result is None:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            entry["last_used"] = time.time()
+            self.hits += 1
+            self._save_index()
+            return result
+
+    def put(self, key, result):
+        build_id = result["build_id"]
+        build_dir = os.path.join(self.root, build_id)
+        save_json(os.path.join(build_dir, self.result_file), result)
+        size = get_dir_size(build_dir)
+
+        with self.lock:
+            self.entries[key] = dict(build_id=build_id, size=size, last_used=time.time())
+            self.entries.move_to_end(key)
+            self._evict()
+            self._save_index()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes
+            }
+
+    def get_build_ids(self):
+        with self.lock:
+            return {entry["build_id"] for entry in self.entries.values()}
+
+    def shrink(self, num_bytes):
+        """Evicts least recently used entries until num_bytes are freed, returns their number"""
+        evicted = 0
+        with self.lock:
+            for key in list(self.entries):
+                if num_bytes <= 0:
+                    break
+                entry = self.entries[key]
+                if self.is_busy(entry["build_id"]):
+                    continue
+                del self.entries[key]
+                self._remove_entry(entry)
+                num_bytes -= entry["size"]
+                evicted += 1
+            self._save_index()
+        return evicted
+
+    @property
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def _evict(self):
+        # the newest entry is never evicted, even if it alone exceeds the quota
+        for key in list(self.entries)[:-1]:
+            if len(self.entries) <= self.max_entries and self.total_bytes <= self.max_bytes:
+                break
+            if self.is_busy(self.entries[key]["build_id"]):
+                continue
+            self._remove_entry(self.entries.pop(key))
+
+    def _remove_entry(self, entry):
+        shutil.rmtree(os.path.join(self.root, entry["build_id"]), ignore_errors=True)
+        self.evictions += 1
+        print(f'Evicted build {entry["build_id"]} from build cache')
+
+    def _load_result(self, build_id):
+        try:
+            with open(os.path.join(self.root, build_id, self.result_file)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        entries.sort(key=lambda entry: entry["last_used"])
+        for entry in entries:
+            key = entry.pop("key")
+            self.entries[key] = entry
+
+    def _save_index(self):
+        entries = [dict(entry, key=key) for key, entry in self.entries.items()]
+        tmp_path = self.index_path + ".tmp"
+        save_json(tmp_path, entries)
+        os.replace(tmp_path, self.index_path)
+
+
+def save_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
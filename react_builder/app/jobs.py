@@ -0,0 +1,147 @@
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BuildJob:
+    """State of a single build job with log lines that can be followed while it runs"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.future = None
+        self.logs = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ("finished", "failed", "cancelled")
+
+    def add_log(self, stream, text):
+        with self.condition:
+            self.logs.append(dict(stream=stream, text=text))
+            self.condition.notify_all()
+
+    def set_status(self, status, result=None, error=None):
+        with self.condition:
+            self.status = status
+            self.result = result
+            self.error = error
+            if status == "running":
+                self.started = time.time()
+            elif self.done:
+                self.finished = time.time()
+            self.condition.notify_all()
+
+    def follow_logs(self, offset=0, heartbeat=15):
+        """Yields log lines starting from offset until the job is done.
+
+        None is yielded when nothing happened for heartbeat seconds.
+        """
+        while True:
+            with self.condition:
+                if offset >= len(self.logs) and not self.done:
+                    self.condition.wait(timeout=heartbeat)
+                lines = self.logs[offset:]
+                done = self.done
+
+            offset += len(lines)
+            if not lines and not done:
+                yield None
+            yield from lines
+
+            if done and offset >= len(self.logs):
+                return
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "log_lines": len(self.logs)
+        }
+
+
+class JobQueue:
+    """Runs build jobs on a fixed number of threads.
+
+    At most max_pending jobs may be queued or running at a time. Only the last
+    max_jobs jobs are remembered.
+    """
+
+    def __init__(self, build_func, workers=2, max_pending=100, max_jobs=1000):
+        self.build_func = build_func
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="build-job")
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, tar, **kwargs):
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if not job.done)
+            if pending >= self.max_pending:
+                raise QueueFull(f"Too many pending build jobs: {pending}")
+
+            job = BuildJob()
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+
+        job.future = self.executor.submit(self._run, job, tar, kwargs)
+        return job
+
+    def cancel(self, job_id):
+        """Cancels a queued job. Running jobs can not be interrupted and are left to finish"""
+        job = self.get(job_id)
+        if job is not None and job.status == "queued" and job.future.cancel():
+            job.set_status("cancelled")
+        return job
+
+    def stats(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "max_pending": self.max_pending
+        }
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, tar, kwargs):
+        job.set_status("running")
+        try:
+            result = self.build_func(tar, on_log=job.add_log, **kwargs)
+            job.set_status("finished", result=result)
+        except Exception as e:
+            print(traceback.format_exc())
+            job.set_status("failed", error=repr(e))
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        excess = len(self.jobs) - self.max_jobs
+        for job_id in finished[:max(0, excess)]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -4,6 +4,12 @@ const CopyWebpackPlugin = require('copy-webpack-plugin');
 
 module.exports = {
     mode: 'development',
+    context: '{{ context }}',
+    cache: {
+      type: 'filesystem',
+      cacheDirectory: '{{ cache_dir }}',
+      version: '{{ cache_version }}'
+    },
     watchOptions: {
       poll: true,
       ignored: /node_modules/
@@ -50,6 +56,8 @@ module.exports = {
       ]
     },
     resolve: {
+        // keeps paths of modules under the workspace link, they are keys of the cache
+        symlinks: false,
         modules: [path.resolve(__dirname, 'node_modules'), 'node_modules']
     }
 };
@@ -0,0 +1,169 @@
+import os
+import stat
+import time
+import shutil
+import hashlib
+import threading
+from collections import defaultdict
+
+
+def hash_file(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_disk_usage(paths):
+    """Bytes used by files under paths, counting hardlinked files once"""
+    seen = set()
+    total = 0
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                if (st.st_dev, st.st_ino) not in seen:
+                    seen.add((st.st_dev, st.st_ino))
+                    total += st.st_size
+    return total
+
+
+def deduplicate_files(paths, min_size=1024):
+    """Replaces identical regular files under paths with hardlinks to a single copy.
+
+    Files must not be modified in place afterwards. Returns the number of replaced
+    files and the number of bytes saved.
+    """
+    by_size = defaultdict(list)
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    st = os.lstat(file_path)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and st.st_size >= min_size:
+                    by_size[st.st_size].append((file_path, st))
+
+    replaced = 0
+    saved = 0
+    for size, candidates in by_size.items():
+        if len(candidates) < 2:
+            continue
+
+        originals = {}
+        for file_path, st in candidates:
+            try:
+                digest = hash_file(file_path)
+            except FileNotFoundError:
+                continue
+
+            original = originals.setdefault(digest, (file_path, st))
+            original_path, original_st = original
+            if st.st_dev != original_st.st_dev or st.st_ino == original_st.st_ino:
+                continue
+
+            tmp_path = f"{file_path}.dedup"
+            try:
+                os.link(original_path, tmp_path)
+                os.replace(tmp_path, file_path)
+            except OSError as e:
+                print(f'Failed to deduplicate "{file_path}": {e!r}')
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                continue
+            replaced += 1
+            saved += size
+
+    return replaced, saved
+
+
+class BuildsCollector:
+    """Removes build directories and blobs that are no longer needed.
+
+    Build directories that are not in the build cache are removed after max_age
+    seconds. If builds and blobs take more than max_bytes, uncached builds are removed
+    oldest first, then the build cache is asked to evict entries. Blobs not linked
+    into any build directory are removed after max_age seconds. Identical sources and
+    artifacts of finished builds are deduplicated with hardlinks.
+    """
+
+    def __init__(self, root, get_build_ids, get_active_builds, blob_store, cache=None,
+                 max_age=24 * 3600, max_bytes=20 * 1024 ** 3):
+        self.root = root
+        self.get_build_ids = get_build_ids
+        self.get_active_builds = get_active_builds
+        self.blob_store = blob_store
+        self.cache = cache
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.last_run = None
+
+    def collect(self):
+        with self.lock:
+            t0 = time.monotonic()
+            stats = dict(removed_builds=0, removed_blobs=0, deduplicated_files=0, saved_bytes=0)
+            now = time.time()
+
+            cached = self.cache.get_build_ids() if self.cache else set()
+            active = self.get_active_builds()
+            builds = []
+            for build_id in self.get_build_ids():
+                if build_id in active:
+                    continue
+                path = os.path.join(self.root, build_id)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                builds.append((mtime, build_id, path))
+            builds.sort()
+
+            uncached = [build for build in builds if build[1] not in cached]
+            for mtime, build_id, path in list(uncached):
+                if now - mtime > self.max_age:
+                    self._remove_build(path, stats)
+                    uncached.remove((mtime, build_id, path))
+
+            paths = [os.path.join(self.root, build_id) for build_id in self.get_build_ids()]
+            total = get_disk_usage(paths + [self.blob_store.root])
+            while total > self.max_bytes and uncached:
+                mtime, build_id, path = uncached.pop(0)
+                total -= get_disk_usage([path])
+                self._remove_build(path, stats)
+
+            if total > self.max_bytes and self.cache:
+                stats["evicted_cache_entries"] = self.cache.shrink(total - self.max_bytes)
+
+            stats["removed_blobs"] = self.blob_store.remove_unused(self.max_age)
+
+            # webpack cache directories are left alone: cloned workspaces keep hardlinks
+            # between their files and webpack rewrites some cache files in place
+            active = self.get_active_builds()
+            finished = [os.path.join(self.root, build_id, name)
+                        for build_id in self.get_build_ids() if build_id not in active
+                        for name in ("source", "artifacts")]
+            replaced, saved = deduplicate_files(finished)
+            stats["deduplicated_files"] = replaced
+            stats["saved_bytes"] = saved
+            stats["duration_seconds"] = time.monotonic() - t0
+            self.last_run = dict(stats, finished_at=now)
+            print(f"Build GC: {stats}")
+            return stats
+
+    def _remove_build(self, path, stats):
+        shutil.rmtree(path, ignore_errors=True)
+        stats["removed_builds"] += 1
+
+    def run_periodically(self, interval, stop_event):
+        while not stop_event.wait(interval):
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Build GC failed: {e!r}")
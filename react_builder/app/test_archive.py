@@ -0,0 +1,36 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+from app.archive import stream_tar, chunk_size
+
+
+class TestStreamTar(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, "artifacts")
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "main.js"), "wb") as f:
+            f.write(os.urandom(3 * chunk_size))
+
+    def test_archive_is_streamed_in_chunks(self):
+        chunks = list(stream_tar(self.path, max_pending_chunks=1))
+        self.assertGreater(len(chunks), 1)
+
+        with tarfile.open(fileobj=io.BytesIO(b"".join(chunks))) as tar:
+            self.assertEqual(tar.getmember("artifacts/main.js").size, 3 * chunk_size)
+
+    def test_archiving_error_is_raised_after_written_chunks(self):
+        def failing_write_tar(path, arcname, writer, compression):
+            writer.write(b"x" * chunk_size)
+            raise OSError("disk failure")
+
+        chunks = []
+        with patch("app.archive.write_tar", side_effect=failing_write_tar):
+            with self.assertRaisesRegex(OSError, "disk failure"):
+                for chunk in stream_tar(self.path):
+                    chunks.append(chunk)
+        self.assertEqual(chunks, [b"x" * chunk_size])
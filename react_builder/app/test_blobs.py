@@ -0,0 +1,101 @@
+import os
+import time
+import hashlib
+import tempfile
+import unittest
+from fastapi import HTTPException
+from app import load_manifest
+from app.blobs import BlobStore, BlobError, parse_manifest
+
+
+def sha(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class TestParseManifest(unittest.TestCase):
+    def test_paths_are_normalized(self):
+        manifest = parse_manifest([dict(path="public/./img/../logo.png", sha256=sha(b"logo"))])
+        self.assertEqual(manifest, [dict(path="public/logo.png", sha256=sha(b"logo"))])
+
+    def test_manifest_must_be_a_list(self):
+        with self.assertRaises(BlobError):
+            parse_manifest(dict(path="logo.png", sha256=sha(b"logo")))
+
+    def test_paths_outside_of_the_build_are_rejected(self):
+        for path in ["/etc/passwd", "../logo.png", "public/../../logo.png", ".", ""]:
+            with self.subTest(path=path), self.assertRaises(BlobError):
+                parse_manifest([dict(path=path, sha256=sha(b"logo"))])
+
+    def test_invalid_hashes_are_rejected(self):
+        for sha256 in ["", "abc", sha(b"logo").upper(), sha(b"logo") + "0"]:
+            with self.subTest(sha256=sha256), self.assertRaises(BlobError):
+                parse_manifest([dict(path="logo.png", sha256=sha256)])
+
+    def test_malformed_entries_are_rejected(self):
+        entries = ["logo.png", None, [sha(b"logo")], dict(sha256=sha(b"logo")),
+                   dict(path=["logo.png"], sha256=sha(b"logo")), dict(path="logo.png", sha256=None)]
+        for entry in entries:
+            with self.subTest(entry=entry), self.assertRaises(BlobError):
+                parse_manifest([entry])
+
+    def test_malformed_manifest_is_a_bad_request(self):
+        with self.assertRaises(HTTPException) as cm:
+            load_manifest('[["logo.png"]]')
+        self.assertEqual(cm.exception.status_code, 400)
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = BlobStore(os.path.join(self.tmp.name, "blobs"))
+
+    def add_blob(self, content):
+        writer = self.store.open_writer(sha(content))
+        writer.write(content)
+        writer.commit()
+        return sha(content)
+
+    def make_old(self, path, age=3600):
+        timestamp = time.time() - age
+        os.utime(path, (timestamp, timestamp))
+
+    def test_written_blobs_are_no_longer_missing(self):
+        stored = self.add_blob(b"logo")
+        self.assertEqual(self.store.missing([stored, sha(b"other"), stored]), [sha(b"other")])
+
+    def test_blob_with_wrong_content_is_rejected(self):
+        writer = self.store.open_writer(sha(b"logo"))
+        writer.write(b"not a logo")
+        with self.assertRaises(BlobError):
+            writer.commit()
+        self.assertEqual(self.store.missing([sha(b"logo")]), [sha(b"logo")])
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+    def test_remove_unused_keeps_linked_and_recent_blobs(self):
+        linked = self.add_blob(b"linked")
+        unused = self.add_blob(b"unused")
+        recent = self.add_blob(b"recent")
+        self.store.link(linked, os.path.join(self.tmp.name, "build", "public", "linked.png"))
+        for sha256 in (linked, unused):
+            self.make_old(self.store.path(sha256))
+
+        self.assertEqual(self.store.remove_unused(max_age=60), 1)
+        self.assertEqual(self.store.missing([linked, unused, recent]), [unused])
+
+    def test_remove_unused_keeps_blobs_that_were_just_checked(self):
+        stored = self.add_blob(b"logo")
+        self.make_old(self.store.path(stored))
+
+        self.assertEqual(self.store.missing([stored]), [])
+        self.assertEqual(self.store.remove_unused(max_age=60), 0)
+        self.store.link(stored, os.path.join(self.tmp.name, "build", "logo.png"))
+
+    def test_remove_unused_removes_abandoned_uploads(self):
+        writer = self.store.open_writer(sha(b"logo"))
+        writer.write(b"lo")
+        writer.file.close()
+        self.make_old(writer.tmp_path)
+
+        self.assertEqual(self.store.remove_unused(max_age=60), 1)
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
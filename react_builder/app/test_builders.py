@@ -0,0 +1,80 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+from app import builders
+from app.builders import SimpleReactBuilder, run_build
+
+
+def make_tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for path, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return tarfile.open(fileobj=buffer)
+
+
+class TestLineageWorkspaces(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, value in [("base_dir", self.tmp.name),
+                            ("workspaces_dir", os.path.join(self.tmp.name, "workspaces"))]:
+            patcher = patch.object(builders, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.configs = []
+        patcher = patch.object(SimpleReactBuilder, "_build_artifacts", autospec=True,
+                               side_effect=self.fake_build_artifacts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_build_artifacts(self, builder):
+        # webpack sees the sources of the build under the workspace path
+        self.assertEqual(os.path.realpath(builder.workspace), builder.repo_directory)
+        with open(os.path.join(builder.workspace, "source", "webpack.config.js")) as f:
+            self.configs.append(f.read())
+        return "compiled successfully", ""
+
+    def build(self, content, base_build_id=None):
+        return run_build(make_tar({"index.js": content}), base_build_id=base_build_id)
+
+    def test_rebuilds_use_workspace_path_of_their_lineage(self):
+        first = self.build("render(1)")
+        second = self.build("render(2)", base_build_id=first["build_id"])
+        third = self.build("render(3)", base_build_id=second["build_id"])
+
+        self.assertEqual([first["incremental"], second["incremental"], third["incremental"]],
+                         [False, True, True])
+        workspace = os.path.join(builders.workspaces_dir, first["build_id"])
+        for config in self.configs:
+            self.assertIn(f"context: '{workspace}/source'", config)
+            self.assertIn(f"entry: '{workspace}/source/index.js'", config)
+        self.assertFalse(os.path.lexists(workspace))
+
+    def test_concurrent_rebuild_starts_new_lineage(self):
+        first = self.build("render(1)")
+        builders.busy_lineages.add(first["build_id"])
+        self.addCleanup(builders.busy_lineages.discard, first["build_id"])
+
+        second = self.build("render(2)", base_build_id=first["build_id"])
+        self.assertFalse(second["incremental"])
+        self.assertIn(os.path.join(builders.workspaces_dir, second["build_id"]), self.configs[-1])
+
+    def test_cache_keeps_builds_of_busy_lineages(self):
+        first = self.build("render(1)")
+        second = self.build("render(2)", base_build_id=first["build_id"])
+        builders.busy_lineages.add(first["build_id"])
+        self.addCleanup(builders.busy_lineages.discard, first["build_id"])
+
+        self.assertTrue(builders.is_build_busy(first["build_id"]))
+        self.assertTrue(builders.is_build_busy(second["build_id"]))
+        builders.busy_lineages.discard(first["build_id"])
+        self.assertFalse(builders.is_build_busy(second["build_id"]))
@@ -0,0 +1,119 @@
+import io
+import os
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from app.cache import BuildCache, hash_source_tar
+
+
+def make_tar(files):
+    """In-memory tar opened for reading, files is a list of (path, content) pairs"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for path, content in files:
+            info = tarfile.TarInfo(path)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    buffer.seek(0)
+    return tarfile.open(fileobj=buffer)
+
+
+class TestHashSourceTar(unittest.TestCase):
+    def test_hash_does_not_depend_on_order_of_members(self):
+        files = [("src/index.js", b"render()"), ("src/styles.css", b"body {}")]
+        self.assertEqual(hash_source_tar(make_tar(files)), hash_source_tar(make_tar(files[::-1])))
+
+    def test_hash_depends_on_contents_paths_and_version(self):
+        base = hash_source_tar(make_tar([("src/index.js", b"render()")]))
+        self.assertNotEqual(base, hash_source_tar(make_tar([("src/index.js", b"render(1)")])))
+        self.assertNotEqual(base, hash_source_tar(make_tar([("src/main.js", b"render()")])))
+        self.assertNotEqual(base, hash_source_tar(make_tar([("src/index.js", b"render()")]), version="2"))
+
+    def test_manifest_blobs_are_hashed_like_files(self):
+        content = b"binary image"
+        manifest = [dict(path="public/logo.png", sha256=hashlib.sha256(content).hexdigest())]
+        self.assertEqual(
+            hash_source_tar(make_tar([("src/index.js", b"x")]), manifest=manifest),
+            hash_source_tar(make_tar([("src/index.js", b"x"), ("public/logo.png", content)]))
+        )
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+
+    def add_build(self, cache, key, build_id, size=10):
+        build_dir = os.path.join(self.root, build_id)
+        os.makedirs(build_dir)
+        with open(os.path.join(build_dir, "main.js"), "wb") as f:
+            f.write(b"x" * size)
+        cache.put(key, dict(build_id=build_id, success=True))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = BuildCache(self.root, max_entries=2)
+        self.add_build(cache, "a", "build-a")
+        self.add_build(cache, "b", "build-b")
+        self.assertIsNotNone(cache.get("a"))
+        self.add_build(cache, "c", "build-c")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "build-b")))
+        self.assertEqual(cache.get("a")["build_id"], "build-a")
+        self.assertEqual(cache.get("c")["build_id"], "build-c")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_are_evicted_over_byte_quota(self):
+        cache = BuildCache(self.root, max_bytes=150)
+        self.add_build(cache, "a", "build-a", size=100)
+        self.add_build(cache, "b", "build-b", size=100)
+
+        self.assertEqual(cache.get_build_ids(), {"build-b"})
+        self.assertLessEqual(cache.stats()["bytes"], 150)
+
+    def test_newest_entry_is_kept_even_over_quota(self):
+        cache = BuildCache(self.root, max_bytes=50)
+        self.add_build(cache, "a", "build-a", size=100)
+        self.assertEqual(cache.get_build_ids(), {"build-a"})
+
+    def test_index_survives_restart_in_lru_order(self):
+        cache = BuildCache(self.root, max_entries=2)
+        self.add_build(cache, "a", "build-a")
+        self.add_build(cache, "b", "build-b")
+        cache.get("a")
+
+        cache = BuildCache(self.root, max_entries=2)
+        self.add_build(cache, "c", "build-c")
+        self.assertEqual(cache.get_build_ids(), {"build-a", "build-c"})
+
+    def test_entry_without_result_is_a_miss(self):
+        cache = BuildCache(self.root)
+        self.add_build(cache, "a", "build-a")
+        os.remove(os.path.join(self.root, "build-a", BuildCache.result_file))
+
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (0, 1, 0))
+
+    def test_shrink_frees_oldest_entries(self):
+        cache = BuildCache(self.root)
+        self.add_build(cache, "a", "build-a", size=100)
+        self.add_build(cache, "b", "build-b", size=100)
+        self.add_build(cache, "c", "build-c", size=100)
+
+        self.assertEqual(cache.shrink(150), 2)
+        self.assertEqual(cache.get_build_ids(), {"build-c"})
+
+    def test_busy_builds_are_not_evicted(self):
+        busy = {"build-a"}
+        cache = BuildCache(self.root, max_entries=2, is_busy=lambda build_id: build_id in busy)
+        self.add_build(cache, "a", "build-a", size=100)
+        self.add_build(cache, "b", "build-b", size=100)
+        self.add_build(cache, "c", "build-c", size=100)
+
+        self.assertEqual(cache.get_build_ids(), {"build-a", "build-c"})
+        self.assertTrue(os.path.exists(os.path.join(self.root, "build-a")))
+        self.assertEqual(cache.shrink(150), 1)
+        self.assertEqual(cache.get_build_ids(), {"build-a"})
@@ -0,0 +1,103 @@
+import threading
+import unittest
+from app.jobs import JobQueue, BuildJob, QueueFull
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def blocking_build(self, tar, on_log, **kwargs):
+        self.started.set()
+        on_log("stdout", f"building {tar}")
+        if not self.release.wait(timeout=5):
+            raise TimeoutError("build was never released")
+        if kwargs.get("fail"):
+            raise RuntimeError("webpack crashed")
+        on_log("stdout", "done")
+        return dict(success=True, tar=tar)
+
+    def make_queue(self, **kwargs):
+        queue = JobQueue(self.blocking_build, **kwargs)
+        self.addCleanup(queue.shutdown)
+        self.addCleanup(self.release.set)
+        return queue
+
+    def test_job_goes_through_states(self):
+        queue = self.make_queue(workers=1)
+        job = queue.submit("sources")
+        self.assertTrue(self.started.wait(timeout=5))
+        self.assertEqual(queue.get(job.id).status, "running")
+        self.assertEqual(queue.stats()["running"], 1)
+
+        self.release.set()
+        job.future.result(timeout=5)
+        self.assertEqual(job.status, "finished")
+        self.assertEqual(job.result, dict(success=True, tar="sources"))
+        self.assertIsNotNone(job.started)
+        self.assertIsNotNone(job.finished)
+
+    def test_failing_build_marks_job_failed(self):
+        queue = self.make_queue(workers=1)
+        job = queue.submit("sources", fail=True)
+        self.release.set()
+        job.future.result(timeout=5)
+        self.assertEqual(job.status, "failed")
+        self.assertIn("webpack crashed", job.error)
+
+    def test_queued_job_can_be_cancelled(self):
+        queue = self.make_queue(workers=1)
+        running = queue.submit("first")
+        queued = queue.submit("second")
+        self.assertTrue(self.started.wait(timeout=5))
+        self.assertEqual(queue.stats()["queued"], 1)
+
+        self.assertEqual(queue.cancel(queued.id).status, "cancelled")
+        self.assertEqual(queue.cancel(running.id).status, "running")
+        self.release.set()
+        running.future.result(timeout=5)
+        self.assertEqual(running.status, "finished")
+
+    def test_pending_jobs_are_limited(self):
+        queue = self.make_queue(workers=1, max_pending=2)
+        queue.submit("first")
+        queue.submit("second")
+        with self.assertRaises(QueueFull):
+            queue.submit("third")
+
+    def test_only_last_finished_jobs_are_remembered(self):
+        queue = self.make_queue(workers=1, max_jobs=2)
+        self.release.set()
+        jobs = []
+        for i in range(3):
+            jobs.append(queue.submit(f"sources {i}"))
+            jobs[-1].future.result(timeout=5)
+
+        self.assertIsNone(queue.get(jobs[0].id))
+        self.assertIsNotNone(queue.get(jobs[2].id))
+
+    def test_follow_logs_yields_lines_until_job_is_done(self):
+        queue = self.make_queue(workers=1)
+        job = queue.submit("sources")
+        self.assertTrue(self.started.wait(timeout=5))
+
+        lines = job.follow_logs(heartbeat=5)
+        self.assertEqual(next(lines), dict(stream="stdout", text="building sources"))
+        self.release.set()
+        self.assertEqual(list(lines), [dict(stream="stdout", text="done")])
+
+    def test_follow_logs_from_offset_of_finished_job(self):
+        job = BuildJob()
+        job.add_log("stdout", "first")
+        job.add_log("stderr", "second")
+        job.set_status("finished", result={})
+        self.assertEqual(list(job.follow_logs(offset=1)), [dict(stream="stderr", text="second")])
+
+    def test_follow_logs_yields_heartbeats_while_idle(self):
+        job = BuildJob()
+        job.set_status("running")
+        lines = job.follow_logs(heartbeat=0.01)
+        self.assertIsNone(next(lines))
+        job.set_status("finished", result={})
+        self.assertEqual(list(lines), [])
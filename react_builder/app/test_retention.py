@@ -0,0 +1,100 @@
+import os
+import time
+import tempfile
+import unittest
+from app.blobs import BlobStore
+from app.cache import BuildCache
+from app.retention import BuildsCollector, deduplicate_files, get_disk_usage
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class TestBuildsCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.builds = os.path.join(self.root, "builds")
+        os.makedirs(self.builds)
+        self.blob_store = BlobStore(os.path.join(self.root, "blobs"))
+        self.cache = BuildCache(self.builds)
+        self.active = set()
+
+    def make_collector(self, **kwargs):
+        return BuildsCollector(self.builds, self.get_build_ids, lambda: set(self.active),
+                               self.blob_store, self.cache, **kwargs)
+
+    def get_build_ids(self):
+        return [name for name in os.listdir(self.builds) if os.path.isdir(os.path.join(self.builds, name))]
+
+    def add_build(self, build_id, size=100, age=0, content=None):
+        path = os.path.join(self.builds, build_id)
+        write_file(os.path.join(path, "artifacts", "main.js"), content or os.urandom(size))
+        timestamp = time.time() - age
+        os.utime(path, (timestamp, timestamp))
+        return path
+
+    def test_old_uncached_builds_are_removed(self):
+        old = self.add_build("old", age=7200)
+        recent = self.add_build("recent")
+        cached = self.add_build("cached", age=7200)
+        self.cache.put("key", dict(build_id="cached"))
+        running = self.add_build("running", age=7200)
+        self.active.add("running")
+
+        stats = self.make_collector(max_age=3600).collect()
+        self.assertEqual(stats["removed_builds"], 1)
+        self.assertFalse(os.path.exists(old))
+        for path in (recent, cached, running):
+            self.assertTrue(os.path.exists(path))
+
+    def test_oldest_uncached_builds_are_removed_over_quota(self):
+        oldest = self.add_build("oldest", size=1000, age=300)
+        older = self.add_build("older", size=1000, age=200)
+        newest = self.add_build("newest", size=1000, age=100)
+
+        stats = self.make_collector(max_bytes=1500).collect()
+        self.assertEqual(stats["removed_builds"], 2)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+
+    def test_cache_is_shrunk_when_uncached_builds_do_not_free_enough(self):
+        self.add_build("first", size=1000)
+        self.cache.put("first", dict(build_id="first"))
+        self.add_build("second", size=1000)
+        self.cache.put("second", dict(build_id="second"))
+
+        stats = self.make_collector(max_bytes=1500).collect()
+        self.assertEqual(stats["evicted_cache_entries"], 1)
+        self.assertEqual(self.cache.get_build_ids(), {"second"})
+
+    def test_identical_artifacts_are_hardlinked(self):
+        content = os.urandom(4096)
+        first = self.add_build("first", content=content)
+        second = self.add_build("second", content=content)
+        self.active.add("second")
+        third = self.add_build("third", content=content)
+
+        stats = self.make_collector().collect()
+        self.assertEqual((stats["deduplicated_files"], stats["saved_bytes"]), (1, 4096))
+        first_js, second_js, third_js = [os.path.join(path, "artifacts", "main.js")
+                                         for path in (first, second, third)]
+        self.assertTrue(os.path.samefile(first_js, third_js))
+        self.assertFalse(os.path.samefile(first_js, second_js))
+        self.assertEqual(get_disk_usage([first, third]), 4096)
+
+
+class TestDeduplicateFiles(unittest.TestCase):
+    def test_small_and_different_files_are_left_alone(self):
+        with tempfile.TemporaryDirectory() as root:
+            write_file(os.path.join(root, "a", "small.txt"), b"x")
+            write_file(os.path.join(root, "b", "small.txt"), b"x")
+            write_file(os.path.join(root, "a", "big.txt"), b"a" * 2048)
+            write_file(os.path.join(root, "b", "big.txt"), b"b" * 2048)
+
+            self.assertEqual(deduplicate_files([root]), (0, 0))
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from app import workers
+from app.workers import BuildWorker, WorkerError
+
+
+class TestBuildWorkerStartup(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.started = []
+        popen = workers.subprocess.Popen
+
+        def record_popen(*args, **kwargs):
+            proc = popen(*args, **kwargs)
+            self.started.append(proc)
+            return proc
+
+        patcher = patch("app.workers.subprocess.Popen", side_effect=record_popen)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_script(self, source):
+        path = os.path.join(self.root.name, "worker.js")
+        with open(path, "w") as f:
+            f.write(source)
+        patcher = patch("app.workers.worker_script", path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_silent_worker_is_killed_after_startup_timeout(self):
+        self.use_script("setInterval(() => {}, 1000);")
+        with self.assertRaises(WorkerError):
+            BuildWorker(self.root.name, startup_timeout=0.5)
+        self.assertIsNotNone(self.started[0].poll())
+
+    def test_malformed_greeting_kills_worker(self):
+        self.use_script("console.log('not json'); setInterval(() => {}, 1000);")
+        with self.assertRaises(ValueError):
+            BuildWorker(self.root.name, startup_timeout=5)
+        self.assertIsNotNone(self.started[0].poll())
+
+    def test_unexpected_greeting_kills_worker(self):
+        self.use_script("console.log(JSON.stringify({hello: true})); setInterval(() => {}, 1000);")
+        with self.assertRaises(WorkerError):
+            BuildWorker(self.root.name, startup_timeout=5)
+        self.assertIsNotNone(self.started[0].poll())
+
+    def test_ready_worker_is_kept(self):
+        self.use_script("console.log(JSON.stringify({ready: true, rss: 42})); setInterval(() => {}, 1000);")
+        worker = BuildWorker(self.root.name, startup_timeout=5)
+        self.addCleanup(worker.close)
+        self.assertTrue(worker.alive)
+        self.assertEqual(worker.rss, 42)
@@ -0,0 +1,123 @@
+// Long-lived build worker keeping webpack and babel loaded between builds.
+//
+// Reads one JSON job per line from stdin: {"id": ..., "cwd": ..., "config_path": ...}
+// and writes JSON lines to stdout: any number of log lines while the job runs
+// {"id": ..., "stream": "stdout" | "stderr", "text": ...}
+// followed by one result line
+// {"id": ..., "success": ..., "stdout": ..., "stderr": ..., "rss": ...}
+// Anything printed by webpack plugins is sent as log lines, so stdout only carries JSON.
+const path = require('path');
+const readline = require('readline');
+const { createRequire } = require('module');
+
+const modulesRoot = process.env.BUILDS_ROOT || '/data/builds';
+const requireFromBuilds = createRequire(path.join(modulesRoot, 'package.json'));
+
+const webpack = requireFromBuilds('webpack');
+
+// warm up the loaders used by the webpack config template
+['@babel/core', '@babel/preset-env', '@babel/preset-react', 'babel-loader'].forEach(name => {
+  try {
+    requireFromBuilds(name);
+  } catch (e) {
+    console.error(`Failed to preload ${name}: ${e.message}`);
+  }
+});
+
+const writeLine = process.stdout.write.bind(process.stdout);
+const writeResult = result => writeLine(JSON.stringify(result) + '\n');
+
+let currentJob = null;
+
+function log(stream, text) {
+  if (currentJob === null) {
+    process.stderr.write(text + '\n');
+  } else {
+    writeResult({ id: currentJob.id, stream, text });
+  }
+}
+
+console.log = (...args) => log('stdout', args.join(' '));
+console.info = console.log;
+console.warn = (...args) => log('stderr', args.join(' '));
+
+function makeProgressPlugin() {
+  let lastStep = -1;
+  return new webpack.ProgressPlugin((percentage, message) => {
+    const step = Math.floor(percentage * 10);
+    if (step !== lastStep) {
+      lastStep = step;
+      log('stdout', `${Math.round(percentage * 100)}% ${message}`);
+    }
+  });
+}
+
+function loadConfig(configPath) {
+  const resolved = require.resolve(configPath);
+  delete require.cache[resolved];
+  return require(resolved);
+}
+
+function runBuild(job) {
+  return new Promise(resolve => {
+    let config;
+    try {
+      config = loadConfig(job.config_path);
+    } catch (e) {
+      resolve({ success: false, stdout: '', stderr: String(e.stack || e) });
+      return;
+    }
+
+    // webpack-cli runs from the source dir; relative paths in the config rely on it
+    config.context = config.context || job.cwd;
+    config.plugins = [...(config.plugins || []), makeProgressPlugin()];
+
+    webpack(config, (err, stats) => {
+      if (err) {
+        resolve({ success: false, stdout: '', stderr: String(err.stack || err) });
+        return;
+      }
+
+      const stdout = stats.toString({ colors: false });
+      const stderr = stats.hasErrors() ? stats.toString({ preset: 'errors-only', colors: false }) : '';
+
+      stats.compilation.compiler.close(() => {
+        resolve({ success: !stats.hasErrors(), stdout, stderr });
+      });
+    });
+  });
+}
+
+const rl = readline.createInterface({ input: process.stdin });
+const jobs = [];
+let busy = false;
+
+async function drain() {
+  if (busy) return;
+  busy = true;
+  while (jobs.length) {
+    const job = jobs.shift();
+    currentJob = job;
+    const result = await runBuild(job);
+    currentJob = null;
+    result.id = job.id;
+    result.rss = process.memoryUsage().rss;
+    writeResult(result);
+  }
+  busy = false;
+}
+
+rl.on('line', line => {
+  if (!line.trim()) return;
+  try {
+    jobs.push(JSON.parse(line));
+  } catch (e) {
+    console.error(`Malformed job: ${line}`);
+    return;
+  }
+  drain();
+});
+
+rl.on('close', () => process.exit(0));
+
+writeResult({ ready: true, rss: process.memoryUsage().rss });
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import queue
+import threading
+import subprocess
+from collections import namedtuple
+
+
+worker_script = os.path.join(os.path.dirname(__file__), "worker", "build_worker.js")
+
+WorkerResult = namedtuple("WorkerResult", ["success", "stdout", "stderr", "queued_seconds", "build_seconds"])
+
+
+class WorkerError(Exception):
+    pass
+
+
+class BuildWorker:
+    """A Node process running webpack builds sent to its stdin, one JSON line per job"""
+
+    def __init__(self, builds_root, startup_timeout=60):
+        env = dict(os.environ, BUILDS_ROOT=builds_root)
+        self.proc = subprocess.Popen(
+            ["node", worker_script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=env, cwd=builds_root
+        )
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read_lines, daemon=True)
+        self.reader.start()
+        self.builds = 0
+        self.rss = 0
+
+        try:
+            ready = self._next_message(startup_timeout)
+            if not ready.get("ready"):
+                raise WorkerError(f"Unexpected greeting from build worker: {ready}")
+        except Exception:
+            self.close()
+            raise
+        self.rss = ready.get("rss", 0)
+
+    def _read_lines(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def _next_message(self, timeout):
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError(f"Build worker did not respond in {timeout} seconds")
+
+        if line is None:
+            raise WorkerError("Build worker exited unexpectedly")
+        return json.loads(line)
+
+    def build(self, cwd, config_path, timeout, on_log=None):
+        job = dict(id=self.builds, cwd=cwd, config_path=config_path)
+        try:
+            self.proc.stdin.write((json.dumps(job) + "\n").encode())
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError(f"Failed to send a job to build worker: {e}")
+
+        deadline = time.monotonic() + timeout
+        result = self._next_message(timeout)
+        while "stream" in result:
+            if on_log:
+                on_log(result["stream"], result["text"])
+            result = self._next_message(max(0, deadline - time.monotonic()))
+
+        self.builds += 1
+        self.rss = result.get("rss", 0)
+        return result
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        if self.alive:
+            self.proc.kill()
+        self.proc.wait()
+
+
+class BuildWorkerPool:
+    """A fixed number of warm build workers shared by request handler threads.
+
+    A worker is replaced after max_builds builds, when its resident memory exceeds
+    max_memory_mb, or when it crashes or times out.
+    """
+
+    def __init__(self, builds_root, size=2, max_builds=50, max_memory_mb=1024, timeout=300):
+        self.builds_root = builds_root
+        self.size = size
+        self.max_builds = max_builds
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(None)  # workers are started lazily
+
+    def build(self, cwd, config_path, on_log=None):
+        t0 = time.monotonic()
+        worker = self.idle.get()
+        queued_seconds = time.monotonic() - t0
+
+        t0 = time.monotonic()
+        try:
+            if worker is None or not worker.alive:
+                worker = BuildWorker(self.builds_root)
+            result = worker.build(cwd, config_path, self.timeout, on_log)
+        except WorkerError as e:
+            if worker is not None:
+                worker.close()
+            worker = None
+            result = dict(success=False, stdout="", stderr=str(e))
+        finally:
+            self.idle.put(self._recycle(worker))
+
+        build_seconds = time.monotonic() - t0
+        return WorkerResult(result["success"], result["stdout"], result["stderr"],
+                            queued_seconds, build_seconds)
+
+    def _recycle(self, worker):
+        if worker is None:
+            return None
+
+        if worker.builds >= self.max_builds or worker.rss > self.max_memory:
+            worker.close()
+            return None
+        return worker
+
+    def close(self):
+        while not self.idle.empty():
+            worker = self.idle.get_nowait()
+            if worker is not None:
+                worker.close()